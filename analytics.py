@@ -0,0 +1,305 @@
+import re
+from datetime import datetime, timedelta
+
+import db_async
+from config import ALLOWED_USER_IDS, ISRAEL_TZ
+from reports import format_amount
+from services.local_parser import CATEGORY_KEYWORDS, match_category
+
+MONTHS = [
+    ("январ", "январе"), ("феврал", "феврале"), ("март", "марте"),
+    ("апрел", "апреле"), (r"ма[йяе]\b", "мае"), ("июн", "июне"), ("июл", "июле"),
+    ("август", "августе"), ("сентябр", "сентябре"), ("октябр", "октябре"),
+    ("ноябр", "ноябре"), ("декабр", "декабре"),
+]
+
+_SPEND_RE = re.compile(r"трат|потрач|расход|ушл[оиа]|заплатил")
+_SELF_RE = re.compile(r"\b(я|мои|моих|мне|мной)\b")
+_PARTNER_RE = re.compile(r"\b(жена|жены|женой|муж|мужа|мужем|супруг\w*)\b")
+# Words a question can use without naming what was bought: question words,
+# periods, people, intents. Anything else that isn't a category keyword is a
+# subject we can't map to a category, so the question goes to the LLM.
+_FILLER_WORDS = {
+    "а", "и", "в", "во", "на", "за", "по", "с", "со", "у", "к", "о", "об", "из", "от",
+    "до", "для", "что", "чем", "ли", "же", "не", "ну", "мы", "я", "ты", "вы", "мне",
+    "мной", "нам", "нас", "нами", "мой", "моя", "мое", "мои", "моих", "наш", "наша",
+    "наши", "наших", "все", "всех", "весь", "вся", "как", "какие", "какой", "какая",
+    "каких", "какую", "каком", "куда", "где", "когда", "топ", "день", "дн", "дня",
+    "дней", "чек", "чека", "раз", "май", "мае", "мая", "деньги", "денег", "сейчас",
+}
+_FILLER_STEMS = (
+    "сколько", "трат", "потрат", "потрач", "расход", "ушл", "уход", "заплат", "оплат",
+    "покуп", "купил", "шекел", "руб", "сумм", "итог", "всег", "сам", "крупн", "больш",
+    "меньш", "дорог", "категори", "сравн", "измен", "средн", "прошл", "позапрошл", "эт",
+    "текущ", "последн", "недел", "месяц", "год", "сегодн", "вчера", "позавчера",
+    "показ", "покаж", "скаж", "подскаж", "расскаж", "пожалуйст", "жена", "жены", "женой",
+    "муж", "супруг", "был", "период", "квартал",
+    *(stem for stem, _ in MONTHS if stem.isalpha()),
+)
+_CATEGORY_STEMS = tuple(stem for stems in CATEGORY_KEYWORDS.values() for stem in stems)
+# Checked in order. "какие категории самые большие" asks for top categories,
+# so categories are checked before "largest"; "на что"/"куда" only count with
+# a spending verb ("на что лучше копить?" is for the LLM).
+_INTENTS = [
+    ("top", re.compile(r"\bтоп\b|как\w* категори|категори\w* (сам|больш|крупн|дорог)")),
+    ("largest", re.compile(r"сам\w* (крупн|больш|дорог)|крупнейш|крупн\w+ (трат|покуп)")),
+    ("compare", re.compile(r"сравн|по сравнению|чем (в|на|за) прошл|изменил")),
+    ("top", re.compile(
+        r"больше всего"
+        r"|(на что|куда)( \w+){0,3} (по)?(трат|трач|ушл|уход)"
+        r"|(трат|трач|ушл|уход)\w*( \w+){0,3} (на что|куда)\b"
+    )),
+    ("average", re.compile(r"в среднем|средн")),
+    ("total", re.compile(r"сколько|сумм|итого|всего")),
+]
+
+
+def _day_start(dt: datetime) -> datetime:
+    return dt.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def _add_months(dt: datetime, months: int) -> datetime:
+    index = dt.year * 12 + dt.month - 1 + months
+    return dt.replace(year=index // 12, month=index % 12 + 1)
+
+
+def _shifted(start: datetime, end: datetime, unit: str, full: bool) -> tuple[datetime, datetime]:
+    """The preceding period of the same kind; partial periods compare like for like."""
+    if unit == "month":
+        prev_start = _add_months(start, -1)
+    elif unit == "year":
+        prev_start = start.replace(year=start.year - 1)
+    elif unit == "week":
+        prev_start = start - timedelta(days=7)
+    elif unit == "day":
+        prev_start = start - timedelta(days=1)
+    else:
+        prev_start = start - (end - start)
+    if full:
+        return prev_start, start
+    return prev_start, min(prev_start + (end - start), start)
+
+
+def resolve_period(q: str, now: datetime) -> dict:
+    """Resolve the time range a question refers to. Defaults to the current month."""
+    today = _day_start(now)
+    week_start = today - timedelta(days=(today.weekday() + 1) % 7)  # weeks start on Sunday
+    month_start = today.replace(day=1)
+    year_start = month_start.replace(month=1)
+
+    if "позавчера" in q:
+        start, end = today - timedelta(days=2), today - timedelta(days=1)
+        unit, full, label = "day", True, "позавчера"
+    elif "вчера" in q:
+        start, end = today - timedelta(days=1), today
+        unit, full, label = "day", True, "вчера"
+    elif "сегодня" in q:
+        start, end = today, now
+        unit, full, label = "day", False, "сегодня"
+    elif m := re.search(r"(\d+)\s*(дн|дня|дней|день)", q):
+        days = int(m[1])
+        start, end = now - timedelta(days=days), now
+        unit, full, label = "days", True, f"за последние {days} дн."
+    elif re.search(r"прошл\w* недел", q):
+        start, end = week_start - timedelta(days=7), week_start
+        unit, full, label = "week", True, "на прошлой неделе"
+    elif re.search(r"(эт\w*|текущ\w*) недел", q):
+        start, end = week_start, now
+        unit, full, label = "week", False, "на этой неделе"
+    elif re.search(r"(за|последн\w*) недел", q):
+        start, end = now - timedelta(days=7), now
+        unit, full, label = "days", True, "за последние 7 дней"
+    elif re.search(r"прошл\w* месяц", q):
+        start, end = _add_months(month_start, -1), month_start
+        unit, full, label = "month", True, "в прошлом месяце"
+    elif re.search(r"прошл\w* год", q):
+        start, end = year_start.replace(year=now.year - 1), year_start
+        unit, full, label = "year", True, "в прошлом году"
+    elif re.search(r"(за|эт\w*|текущ\w*) год", q):
+        start, end = year_start, now
+        unit, full, label = "year", False, "в этом году"
+    else:
+        start, end = month_start, now
+        unit, full, label = "month", False, "в этом месяце"
+        for number, (stem, prepositional) in enumerate(MONTHS, start=1):
+            if re.search(rf"\b{stem}", q):
+                year = now.year if number <= now.month else now.year - 1
+                start = month_start.replace(year=year, month=number)
+                end = min(_add_months(start, 1), now)
+                full = end != now
+                label = f"в {prepositional}" if year == now.year else f"в {prepositional} {year}"
+                break
+
+    prev_start, prev_end = _shifted(start, end, unit, full)
+    return {
+        "start": start,
+        "end": end,
+        # Open periods run up to now; leave them unbounded so that nothing
+        # recorded in the current second is cut off.
+        "until": end if full else None,
+        "label": label,
+        "prev_start": prev_start,
+        "prev_end": prev_end,
+    }
+
+
+def _who(q: str, user_id: int | None) -> tuple[int | None, str]:
+    """Which user a question is about (None for the whole family) and how to name them."""
+    if user_id is None:
+        return None, ""
+    if _SELF_RE.search(q):
+        return user_id, "Ты: "
+    others = [uid for uid in ALLOWED_USER_IDS if uid != user_id]
+    if _PARTNER_RE.search(q) and len(others) == 1:
+        return others[0], "Вторая половина: "
+    return None, ""
+
+
+def _plural_expenses(n: int) -> str:
+    if n % 10 == 1 and n % 100 != 11:
+        return f"{n} трата"
+    if 2 <= n % 10 <= 4 and not 12 <= n % 100 <= 14:
+        return f"{n} траты"
+    return f"{n} трат"
+
+
+async def _total(p: dict, category: str | None, who_id: int | None, who: str) -> str:
+    row = await db_async.get_total(p["start"], p["until"], category, who_id)
+    scope = category or "Всего"
+    return (
+        f"💰 {who}{scope} {p['label']}: {format_amount(row['total'])} "
+        f"({_plural_expenses(row['count'])})"
+    )
+
+
+async def _average(q: str, p: dict, category: str | None, who_id: int | None, who: str) -> str:
+    row = await db_async.get_total(p["start"], p["until"], category, who_id)
+    days = max((p["end"] - p["start"]).total_seconds() / 86400, 1)
+    if re.search(r"(за|на) (трат|покупк)|чек", q):
+        per, divisor = "за трату", max(row["count"], 1)
+    elif "в неделю" in q:
+        per, divisor = "в неделю", max(days / 7, 1)
+    elif "в месяц" in q:
+        per, divisor = "в месяц", max(days / 30.44, 1)
+    else:
+        per, divisor = "в день", days
+    scope = category or "все категории"
+    return (
+        f"📈 {who}В среднем {per} ({scope}, {p['label']}): "
+        f"{format_amount(round(row['total'] / divisor, 2))}"
+    )
+
+
+async def _top(p: dict, who_id: int | None, who: str) -> str:
+    rows = await db_async.get_category_totals(p["start"], p["until"], who_id)
+    if not rows:
+        return f"{who}Трат {p['label']} нет."
+    total = sum(r["total"] for r in rows)
+    lines = [f"🏆 {who}Топ категорий {p['label']}:"]
+    for i, r in enumerate(rows[:5], start=1):
+        pct = r["total"] / total * 100 if total else 0
+        lines.append(f"{i}. {r['category']}: {format_amount(r['total'])} ({pct:.0f}%)")
+    lines.append(f"Итого: {format_amount(total)}")
+    return "\n".join(lines)
+
+
+async def _compare(p: dict, category: str | None, who_id: int | None, who: str) -> str:
+    cur = await db_async.get_total(p["start"], p["until"], category, who_id)
+    prev = await db_async.get_total(p["prev_start"], p["prev_end"], category, who_id)
+    scope = category or "Все траты"
+    prev_last = p["prev_end"] - timedelta(seconds=1)
+    lines = [
+        f"📊 {who}{scope} {p['label']}: {format_amount(cur['total'])}",
+        f"Предыдущий период ({p['prev_start']:%d.%m}–{prev_last:%d.%m}): "
+        f"{format_amount(prev['total'])}",
+    ]
+    if prev["total"] > 0:
+        diff = cur["total"] - prev["total"]
+        pct = diff / prev["total"] * 100
+        sign = "+" if diff > 0 else ""
+        lines.append(f"Разница: {sign}{format_amount(round(diff, 2))} ({sign}{pct:.0f}%)")
+    return "\n".join(lines)
+
+
+async def _largest(p: dict, category: str | None, who_id: int | None, who: str) -> str:
+    rows = await db_async.get_largest_expenses(
+        p["start"], p["until"], 5, category, who_id
+    )
+    if not rows:
+        return f"{who}Трат {p['label']} нет."
+    lines = [f"💸 {who}Самые крупные траты {p['label']}:"]
+    for r in rows:
+        lines.append(
+            f"{r['created_at'][:10]} — {r['category']}, "
+            f"{format_amount(r['amount'])} — {r['description']}"
+        )
+    return "\n".join(lines)
+
+
+def route_question(q: str) -> tuple[str, str | None] | None:
+    """Intent and category (None for all) of a lowercased question.
+
+    None if it doesn't match a known shape, or names a subject that isn't
+    exactly one category.
+
+    >>> route_question("сколько потратили на рестораны в этом месяце?")
+    ('total', 'Рестораны/Кафе')
+    >>> route_question("сколько потратили в этом месяце")
+    ('total', None)
+    >>> route_question("сколько потратили на маникюр в этом месяце") is None
+    True
+    >>> route_question("сколько ушло на кафе и такси") is None
+    True
+    >>> route_question("какие категории самые большие?")
+    ('top', None)
+    >>> route_question("куда ушли деньги в прошлом месяце")
+    ('top', None)
+    >>> route_question("самые крупные траты на продукты")
+    ('largest', 'Продукты')
+    >>> route_question("на что лучше копить?") is None
+    True
+    """
+    intent = next((name for name, pattern in _INTENTS if pattern.search(q)), None)
+    if intent is None or (intent == "total" and not _SPEND_RE.search(q)):
+        return None
+    words = re.findall(r"[a-zа-я]+", q)
+    category = match_category(words)
+    named = [w for w in words if w.startswith(_CATEGORY_STEMS)]
+    unknown = [
+        w for w in words
+        if w not in _FILLER_WORDS and not w.startswith(_FILLER_STEMS + _CATEGORY_STEMS)
+    ]
+    if unknown or (named and category is None):
+        return None
+    return intent, category
+
+
+async def answer_locally(question: str, user_id: int | None = None) -> str | None:
+    """Answer common question shapes straight from SQL aggregates.
+
+    Handles totals and averages per category/user over a period, top categories,
+    comparison with the previous period and the largest expenses. Returns None
+    for anything else so the caller can fall back to the LLM.
+    """
+    q = question.lower().replace("ё", "е")
+    route = route_question(q)
+    if route is None:
+        return None
+    intent, category = route
+
+    period_text = q
+    if intent == "compare":
+        # "сравни с прошлым месяцем" names the baseline, not the period asked about
+        period_text = re.sub(r"\b(с|со|чем в|чем на|чем за) прошл\w* \w+", "", q)
+    p = resolve_period(period_text, datetime.now(tz=ISRAEL_TZ))
+    who_id, who = _who(q, user_id)
+
+    if intent == "total":
+        return await _total(p, category, who_id, who)
+    if intent == "average":
+        return await _average(q, p, category, who_id, who)
+    if intent == "top":
+        return await _top(p, who_id, who)
+    if intent == "compare":
+        return await _compare(p, category, who_id, who)
+    return await _largest(p, category, who_id, who)
@@ -0,0 +1,293 @@
+"""Compare update-to-reply latency of long polling and webhook mode.
+
+    python -m benchmarks.ingress                          # 50 updates per mode
+    python -m benchmarks.ingress --count 200 --rtt-ms 60 --interval-ms 100
+
+A fake Bot API server stands in for Telegram. For each mode the bot runs as
+a child process through main.main(), pointed at the fake with
+TELEGRAM_API_URL, and is sent /start updates every --interval-ms. An update
+is timestamped when the fake makes it available (queued for getUpdates or
+POSTed to the webhook) and again when the bot's sendMessage reply arrives.
+--rtt-ms adds a simulated network round trip to every call between the bot
+and Telegram, and to every webhook delivery.
+
+The run also checks that a webhook POST with a wrong secret is rejected and
+that the bot exits cleanly on SIGTERM; it exits non-zero if either fails or
+a reply never arrives.
+"""
+import argparse
+import asyncio
+import json
+import os
+import signal
+import socket
+import statistics
+import sys
+import tempfile
+import time
+from collections import deque
+from pathlib import Path
+
+import httpx
+import tornado.httpserver
+import tornado.netutil
+import tornado.web
+
+BENCH_DIR = Path(__file__).parent
+USER = 1001
+SECRET = "benchmark-secret"
+REPLY_TIMEOUT = 30
+STARTUP_TIMEOUT = 60
+# The child is main.main() with the database moved out of data/.
+CHILD = "import db, main; from pathlib import Path; db.DB_PATH = Path({path!r}); main.main()"
+
+
+class FakeTelegram:
+    """Just enough of the Bot API for the bot to start, receive /start and reply."""
+
+    def __init__(self, rtt: float) -> None:
+        self.one_way = rtt / 2
+        self.ready = asyncio.Event()
+        self.webhook: tuple[str, str] | None = None
+        self._updates: list[dict] = []
+        self._new_update = asyncio.Event()
+        self._next_id = 1
+        self._sent: deque[float] = deque()
+        self.latencies: list[float] = []
+        self.replied = asyncio.Event()
+        self.expected = 0
+
+    def reset(self, expected: int) -> None:
+        self.ready.clear()
+        self.webhook = None
+        self._updates.clear()
+        self._sent.clear()
+        self.latencies = []
+        self.replied.clear()
+        self.expected = expected
+
+    def _update(self) -> dict:
+        update_id, self._next_id = self._next_id, self._next_id + 1
+        user = {"id": USER, "is_bot": False, "first_name": "Bench"}
+        return {
+            "update_id": update_id,
+            "message": {
+                "message_id": update_id,
+                "date": int(time.time()),
+                "chat": {"id": USER, "type": "private", "first_name": "Bench"},
+                "from": user,
+                "text": "/start",
+                "entities": [{"type": "bot_command", "offset": 0, "length": 6}],
+            },
+        }
+
+    def wake_pollers(self) -> None:
+        """Answer any pending getUpdates now (with nothing, once the bot is gone)."""
+        self._new_update.set()
+
+    async def deliver(self, client: httpx.AsyncClient) -> None:
+        """Make one update available to the bot, the way the current mode gets it."""
+        update = self._update()
+        self._sent.append(time.perf_counter())
+        if self.webhook is None:
+            self._updates.append(update)
+            self._new_update.set()
+            return
+        url, secret = self.webhook
+        await asyncio.sleep(self.one_way)
+        await client.post(url, json=update, headers={"X-Telegram-Bot-Api-Secret-Token": secret})
+
+    async def call(self, method: str, params: dict):
+        if method == "getMe":
+            return {"id": 1, "is_bot": True, "first_name": "Finance", "username": "bench_bot"}
+        if method == "setWebhook":
+            self.webhook = (params["url"], params.get("secret_token", ""))
+            self.ready.set()
+            return True
+        if method == "getUpdates":
+            self.ready.set()
+            return await self._get_updates(
+                int(params.get("offset", 0)), float(params.get("timeout", 0))
+            )
+        if method == "sendMessage":
+            if self._sent:
+                self.latencies.append(time.perf_counter() - self._sent.popleft())
+                if len(self.latencies) >= self.expected:
+                    self.replied.set()
+            return {
+                "message_id": len(self.latencies),
+                "date": int(time.time()),
+                "chat": {"id": int(params["chat_id"]), "type": "private"},
+                "text": params.get("text", ""),
+            }
+        return True
+
+    async def _get_updates(self, offset: int, timeout: float) -> list[dict]:
+        self._updates = [u for u in self._updates if u["update_id"] >= offset]
+        if not self._updates and timeout:
+            self._new_update.clear()
+            try:
+                await asyncio.wait_for(self._new_update.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return list(self._updates)
+
+
+class _BotApi(tornado.web.RequestHandler):
+    def initialize(self, fake: FakeTelegram) -> None:
+        self.fake = fake
+
+    async def post(self, method: str) -> None:
+        if self.request.headers.get("Content-Type", "").startswith("application/json"):
+            params = json.loads(self.request.body or b"{}")
+        else:
+            params = {k: self.get_argument(k) for k in self.request.arguments}
+        await asyncio.sleep(self.fake.one_way)
+        result = await self.fake.call(method, params)
+        await asyncio.sleep(self.fake.one_way)
+        self.write({"ok": True, "result": result})
+
+    get = post
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+async def _wait_listening(port: int) -> None:
+    """PTB sets the webhook before its server listens; Telegram would retry too."""
+    while True:
+        try:
+            _, writer = await asyncio.open_connection("127.0.0.1", port)
+        except OSError:
+            await asyncio.sleep(0.05)
+            continue
+        writer.close()
+        await writer.wait_closed()
+        return
+
+
+async def _run_mode(
+    mode: str, fake: FakeTelegram, api_url: str, args, tmp: Path
+) -> tuple[list[float], list[str]]:
+    """Start the bot in mode, send it args.count updates and stop it.
+
+    Returns the reply latencies and a list of problems found.
+    """
+    fake.reset(args.count)
+    env = {
+        **os.environ,
+        "TELEGRAM_BOT_TOKEN": "0:benchmark",
+        "OPENAI_API_KEY": "benchmark",
+        "ALLOWED_USER_IDS": str(USER),
+        "METRICS_PORT": "0",
+        "TELEGRAM_API_URL": api_url,
+        "WEBHOOK_URL": "",
+        "WEBHOOK_SECRET": "",
+    }
+    if mode == "webhook":
+        port = _free_port()
+        env.update(
+            WEBHOOK_URL=f"http://127.0.0.1:{port}", WEBHOOK_PORT=str(port), WEBHOOK_SECRET=SECRET
+        )
+    log_path = tmp / f"{mode}.log"
+    with open(log_path, "wb") as log:
+        proc = await asyncio.create_subprocess_exec(
+            sys.executable, "-c", CHILD.format(path=str(tmp / f"{mode}.db")),
+            cwd=BENCH_DIR.parent, env=env, stdout=log, stderr=log,
+        )
+    problems = []
+    try:
+        await asyncio.wait_for(fake.ready.wait(), STARTUP_TIMEOUT)
+        if mode == "webhook":
+            await asyncio.wait_for(_wait_listening(port), STARTUP_TIMEOUT)
+        async with httpx.AsyncClient(timeout=REPLY_TIMEOUT) as client:
+            if fake.webhook is not None:
+                url, _ = fake.webhook
+                forged = await client.post(
+                    url, json=fake._update(),
+                    headers={"X-Telegram-Bot-Api-Secret-Token": "wrong"},
+                )
+                if forged.status_code != 403:
+                    problems.append(f"webhook accepted a wrong secret ({forged.status_code})")
+            deliveries = []
+            for _ in range(args.count):
+                deliveries.append(asyncio.create_task(fake.deliver(client)))
+                await asyncio.sleep(args.interval_ms / 1000)
+            await asyncio.gather(*deliveries)
+            try:
+                await asyncio.wait_for(fake.replied.wait(), REPLY_TIMEOUT)
+            except asyncio.TimeoutError:
+                problems.append(f"only {len(fake.latencies)}/{args.count} replies arrived")
+    except asyncio.TimeoutError:
+        problems.append("bot did not start")
+    finally:
+        if proc.returncode is None:
+            proc.send_signal(signal.SIGTERM)
+        try:
+            code = await asyncio.wait_for(proc.wait(), STARTUP_TIMEOUT)
+        except asyncio.TimeoutError:
+            proc.kill()
+            code = await proc.wait()
+            problems.append("bot did not stop on SIGTERM")
+    if code != 0:
+        problems.append(f"bot exited with {code}")
+    if problems:
+        print(log_path.read_text(errors="replace")[-3000:])
+    return fake.latencies, problems
+
+
+def _summary(latencies: list[float]) -> str:
+    if not latencies:
+        return "no replies"
+    ms = sorted(x * 1000 for x in latencies)
+    p95 = statistics.quantiles(ms, n=20)[-1] if len(ms) > 1 else ms[0]
+    return (
+        f"n={len(ms):<4} p50={statistics.median(ms):7.1f}ms  p95={p95:7.1f}ms  "
+        f"mean={statistics.fmean(ms):7.1f}ms  max={ms[-1]:7.1f}ms"
+    )
+
+
+async def _main(args) -> int:
+    fake = FakeTelegram(args.rtt_ms / 1000)
+    sockets = tornado.netutil.bind_sockets(0, "127.0.0.1")
+    server = tornado.httpserver.HTTPServer(
+        tornado.web.Application([(r"/bot[^/]+/(\w+)", _BotApi, {"fake": fake})])
+    )
+    server.add_sockets(sockets)
+    api_url = f"http://127.0.0.1:{sockets[0].getsockname()[1]}"
+
+    failures = []
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            for mode in args.modes:
+                latencies, problems = await _run_mode(mode, fake, api_url, args, Path(tmp))
+                print(f"{mode:<8} {_summary(latencies)}")
+                failures += [f"{mode}: {p}" for p in problems]
+    finally:
+        fake.wake_pollers()
+        await asyncio.sleep(fake.one_way * 2 + 0.1)
+        server.stop()
+
+    for line in failures:
+        print(f"  FAIL {line}")
+    return 1 if failures else 0
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--count", type=int, default=50)
+    parser.add_argument("--interval-ms", type=float, default=200)
+    parser.add_argument("--rtt-ms", type=float, default=0)
+    parser.add_argument(
+        "--modes", nargs="+", choices=("polling", "webhook"), default=["polling", "webhook"]
+    )
+    args = parser.parse_args()
+    print(f"{args.count} updates every {args.interval_ms:g}ms, simulated RTT {args.rtt_ms:g}ms")
+    return asyncio.run(_main(args))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
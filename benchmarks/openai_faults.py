@@ -0,0 +1,273 @@
+"""Exercise the OpenAI resilience layer against a fake OpenAI server.
+
+    python -m benchmarks.openai_faults
+    python -m benchmarks.openai_faults --count 100 --slow-seconds 3
+
+The fake serves chat completions and transcriptions and can add latency,
+a slow tail, 5xx errors or a full outage. Each scenario runs --count
+expense parses (and a few voice transcriptions) one after another through
+services.ai_parser and services.whisper, then reports latency, how many
+parses came from the LLM rather than the local fallback, and the
+resilience counters:
+
+    healthy     steady 50 ms responses
+    slow-tail   --slow-rate of responses take --slow-seconds, without and with hedging
+    burst       --count parses at once, which must queue under the model's
+                concurrency limit
+    flaky       --error-rate of responses are 500s
+    outage      every response is a 503 until the circuit opens, then the
+                server recovers and a probe must close the circuit
+
+The run exits non-zero if hedging doesn't cut the tail, a burst exceeds
+the concurrency limit, retries don't keep flaky calls from being lost,
+calls don't fail fast while the circuit is open, or it never closes.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+# config.py requires these; nothing here talks to the real OpenAI or Telegram.
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "0:benchmark")
+os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+os.environ.setdefault("ALLOWED_USER_IDS", "1001,1002")
+
+import tornado.httpserver  # noqa: E402
+import tornado.netutil  # noqa: E402
+import tornado.web  # noqa: E402
+
+from services import ai_gateway, ai_parser, parse_cache, resilience, whisper  # noqa: E402
+
+BASE_LATENCY = 0.05
+# Fails fast means well under one fake round trip.
+FAST_FAIL_SECONDS = 0.02
+
+
+class Faults:
+    """What the fake server does to the next responses."""
+
+    def __init__(self) -> None:
+        self.slow_rate = 0.0
+        self.slow_seconds = 0.0
+        self.error_rate = 0.0
+        self.outage = False
+        self.requests = 0
+        self.in_flight = 0
+        self.peak = 0
+
+
+class _Completions(tornado.web.RequestHandler):
+    def initialize(self, faults: Faults) -> None:
+        self.faults = faults
+
+    async def _misbehave(self) -> bool:
+        """Sleep and maybe answer with an error; True if the error was sent."""
+        faults = self.faults
+        faults.requests += 1
+        faults.in_flight += 1
+        faults.peak = max(faults.peak, faults.in_flight)
+        slow = random.random() < faults.slow_rate
+        try:
+            await asyncio.sleep(faults.slow_seconds if slow else BASE_LATENCY)
+        finally:
+            faults.in_flight -= 1
+        if faults.outage or random.random() < faults.error_rate:
+            self.set_status(503 if faults.outage else 500)
+            self.write({"error": {"message": "injected", "type": "server_error"}})
+            return True
+        return False
+
+    async def post(self) -> None:
+        if await self._misbehave():
+            return
+        body = json.loads(self.request.body)
+        texts = json.loads(body["messages"][-1]["content"])
+        content = [
+            {"type": "expense", "items": [{"amount": 10, "category": "Дом", "description": t}]}
+            for t in texts
+        ]
+        self.write({
+            "id": "chatcmpl-fake",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body["model"],
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": json.dumps(content, ensure_ascii=False)},
+                "finish_reason": "stop",
+            }],
+            "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2},
+        })
+
+
+class _Transcriptions(_Completions):
+    async def post(self) -> None:
+        if await self._misbehave():
+            return
+        self.write({"text": "кофе 18"})
+
+
+async def _run(label: str, count: int, prefix: str) -> dict:
+    """Parse count distinct messages sequentially; latency and where results came from."""
+    latencies, llm, fallback, failed = [], 0, 0, 0
+    for i in range(count):
+        started = time.perf_counter()
+        (result,) = await ai_parser.parse_expense_texts([f"{prefix} штука {i + 1}"])
+        latencies.append(time.perf_counter() - started)
+        if result is None or result["type"] != "expense":
+            failed += 1
+        elif result["items"][0]["category"] == "Дом":
+            llm += 1
+        else:
+            fallback += 1
+    voice = [await whisper.transcribe_voice(b"OggS fake") for _ in range(3)]
+    ms = sorted(x * 1000 for x in latencies)
+    row = {
+        "p50": statistics.median(ms),
+        "p95": ms[int(len(ms) * 0.95) - 1],
+        "max": ms[-1],
+        "llm": llm,
+        "fallback": fallback,
+        "failed": failed,
+        "voice_ok": sum(v is not None for v in voice),
+    }
+    counters = resilience.stats()
+    row.update({
+        key: sum(v for k, v in counters.items() if k.endswith(f"_{key}"))
+        for key in ("retries", "hedges", "hedge_wins", "short_circuits", "opened")
+    })
+    print(
+        f"  {label:<18} p50={row['p50']:7.1f}ms p95={row['p95']:7.1f}ms max={row['max']:7.1f}ms"
+        f"  llm={llm} fallback={fallback} failed={failed} voice={row['voice_ok']}/3"
+        f"  retries={row['retries']} hedges={row['hedges']}/{row['hedge_wins']} won"
+        f"  short-circuits={row['short_circuits']} opened={row['opened']}"
+    )
+    return row
+
+
+def _reset(faults: Faults) -> None:
+    faults.__init__()
+    resilience._endpoints.clear()
+    ai_gateway._models.clear()
+
+
+async def _burst(faults: Faults, count: int) -> list[str]:
+    """Parse count messages at once; the gateway must queue them under the model's limit."""
+    _reset(faults)
+    limit, _ = ai_gateway.MODEL_LIMITS[ai_parser.GPT_MODEL]
+    started = time.perf_counter()
+    results = await asyncio.gather(*(
+        ai_parser.parse_expense_texts([f"burst штука {i + 1}"]) for i in range(count)
+    ))
+    elapsed = time.perf_counter() - started
+    llm = sum(r[0] is not None and r[0]["items"][0]["category"] == "Дом" for r in results)
+    usage = ai_gateway.stats()
+    prefix = ai_parser.GPT_MODEL.replace("-", "_").replace(".", "_")
+    print(
+        f"  {'burst':<18} {count} at once in {elapsed * 1000:.0f}ms  llm={llm}"
+        f"  peak in flight={faults.peak} (limit {limit})"
+        f"  tokens={usage[f'{prefix}_prompt_tokens']}+{usage[f'{prefix}_completion_tokens']}"
+    )
+    problems = []
+    if faults.peak > limit:
+        problems.append(f"burst: {faults.peak} requests in flight, limit is {limit}")
+    if llm != count:
+        problems.append(f"burst: {count - llm} parses lost the LLM")
+    if not usage[f"{prefix}_prompt_tokens"]:
+        problems.append("burst: token usage was not recorded")
+    return problems
+
+
+async def _main(args) -> int:
+    faults = Faults()
+    sockets = tornado.netutil.bind_sockets(0, "127.0.0.1")
+    server = tornado.httpserver.HTTPServer(tornado.web.Application([
+        (r"/v1/chat/completions", _Completions, {"faults": faults}),
+        (r"/v1/audio/transcriptions", _Transcriptions, {"faults": faults}),
+    ]))
+    server.add_sockets(sockets)
+    base_url = f"http://127.0.0.1:{sockets[0].getsockname()[1]}/v1"
+    ai_gateway.client.base_url = base_url
+
+    failures = []
+    try:
+        _reset(faults)
+        await _run("healthy", args.count, "healthy")
+
+        # Warm up the latency history, then inject the tail.
+        for hedging in (False, True):
+            _reset(faults)
+            min_samples = resilience.HEDGE_MIN_SAMPLES
+            if not hedging:
+                resilience.HEDGE_MIN_SAMPLES = 10**9
+            mode = "on" if hedging else "off"
+            await _run("warm-up", resilience.HEDGE_MIN_SAMPLES if hedging else 5, f"warm {mode}")
+            faults.slow_rate, faults.slow_seconds = args.slow_rate, args.slow_seconds
+            row = await _run(f"slow-tail hedge={mode}", args.count, f"tail {mode}")
+            resilience.HEDGE_MIN_SAMPLES = min_samples
+            if hedging and row["max"] >= args.slow_seconds * 1000:
+                failures.append("hedging did not cut the slow tail")
+
+        failures += await _burst(faults, args.count)
+
+        _reset(faults)
+        faults.error_rate = args.error_rate
+        row = await _run("flaky", args.count, "flaky")
+        # A parse is lost only if every attempt fails; demand better than one retry.
+        lost = row["fallback"] + row["failed"]
+        if lost > args.count * args.error_rate ** 2:
+            failures.append(f"flaky: {lost} parses lost the LLM")
+
+        _reset(faults)
+        faults.outage = True
+        row = await _run("outage", args.count, "outage")
+        if not row["opened"]:
+            failures.append("outage: the circuit never opened")
+        started = time.perf_counter()
+        (result,) = await ai_parser.parse_expense_texts(["outage штука 7"])
+        if time.perf_counter() - started > FAST_FAIL_SECONDS or result is None:
+            failures.append("outage: open circuit did not fail fast to the local parser")
+        # Let the next call probe right away instead of after OPEN_SECONDS.
+        faults.outage = False
+        open_seconds, resilience.OPEN_SECONDS = resilience.OPEN_SECONDS, 0.0
+        row = await _run("recovered", args.count, "recovered")
+        resilience.OPEN_SECONDS = open_seconds
+        if row["llm"] != args.count:
+            failures.append("recovery: the circuit did not close")
+    finally:
+        server.stop()
+
+    for line in failures:
+        print(f"  FAIL {line}")
+    return 1 if failures else 0
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--count", type=int, default=100)
+    # Hedging targets the tail beyond p95, so keep this well under 5%.
+    parser.add_argument("--slow-rate", type=float, default=0.03)
+    parser.add_argument("--slow-seconds", type=float, default=3.0)
+    parser.add_argument("--error-rate", type=float, default=0.2)
+    args = parser.parse_args()
+    # A hedge goes out HEDGE_MIN_DELAY into a slow call at the earliest; below
+    # twice that there is no tail left for it to cut.
+    if args.slow_seconds < 2 * resilience.HEDGE_MIN_DELAY:
+        parser.error(
+            f"--slow-seconds must be at least {2 * resilience.HEDGE_MIN_DELAY:g} "
+            f"(twice resilience.HEDGE_MIN_DELAY)"
+        )
+    with tempfile.TemporaryDirectory() as tmp:
+        # Keep the benchmark's parses out of the bot's cache.
+        parse_cache.CACHE_DB_PATH = Path(tmp) / "cache.db"
+        return asyncio.run(_main(args))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,219 @@
+"""Check the query plan of every db.py query.
+
+    python -m benchmarks.query_plans                 # fresh DB and a 10k-row synthetic DB
+    python -m benchmarks.query_plans --size 100000
+
+Every statement a db function runs is captured with a trace callback and
+passed through EXPLAIN QUERY PLAN. The run exits non-zero if any statement
+scans a table or builds a temp B-tree, unless its case allows that step
+(aggregates that group or rank their results, whole-table reads of the small
+lookup tables). Reading the UNION ALL of the hot table and archived years is
+a scan of that subquery's output, which is fine as long as each arm searches
+its own index.
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+from collections import Counter
+from datetime import datetime, timedelta
+from pathlib import Path
+
+# config.py requires these; the check never talks to Telegram or OpenAI.
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "0:benchmark")
+os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+os.environ.setdefault("ALLOWED_USER_IDS", "1001,1002")
+
+import db  # noqa: E402
+from benchmarks.synthetic import USERS, generate  # noqa: E402
+from config import ISRAEL_TZ  # noqa: E402
+
+BENCH_DIR = Path(__file__).parent
+
+GROUP = "USE TEMP B-TREE FOR GROUP BY"
+ORDER = "USE TEMP B-TREE FOR ORDER BY"
+LOOKUPS = ("SCAN archives", "SCAN budgets", "SCAN categories", "SCAN sources")
+
+
+def _cases() -> dict:
+    """name: (call, plan steps it may contain besides index searches)."""
+    now = datetime.now(tz=ISRAEL_TZ)
+    month_ago = now - timedelta(days=30)
+    week_ago = now - timedelta(days=7)
+    quarter_ago = now - timedelta(days=90)
+    year_ago = now - timedelta(days=365)
+    # Far enough back to reach archived years once the archiver has run.
+    years_ago = now - timedelta(days=800)
+    return {
+        "db.init_db": (db.init_db, (*LOOKUPS, GROUP)),
+        "db.add_expense": (lambda: db.add_expense(USERS[0], 42.0, "Продукты", "хлеб"), ()),
+        "db.add_expenses": (
+            lambda: db.add_expenses(
+                USERS[0], [{"amount": 1.5, "category": "Дом", "description": "x"}], "photo"
+            ),
+            (),
+        ),
+        "db.set_budget": (lambda: db.set_budget("Продукты", 4000), ()),
+        "db.get_all_budgets": (db.get_all_budgets, ("SCAN budgets",)),
+        "db.get_expenses_since": (lambda: db.get_expenses_since(quarter_ago), ()),
+        "db.get_week_expenses": (db.get_week_expenses, ()),
+        "db.get_month_expenses": (db.get_month_expenses, ()),
+        "db.get_last_n_days_expenses": (db.get_last_n_days_expenses, ()),
+        "db.get_earliest_since": (lambda: db.get_earliest_since(month_ago), ()),
+        "db.get_previous_week_total": (db.get_previous_week_total, ()),
+        "db.get_total": (lambda: db.get_total(month_ago, None), ()),
+        "db.get_total[until]": (lambda: db.get_total(month_ago, week_ago), ()),
+        "db.get_total[category]": (lambda: db.get_total(month_ago, None, "Продукты"), ()),
+        "db.get_total[user]": (lambda: db.get_total(month_ago, None, None, USERS[0]), ()),
+        "db.get_total[category,user]": (
+            lambda: db.get_total(month_ago, week_ago, "Продукты", USERS[0]), ()
+        ),
+        "db.get_total[archived]": (lambda: db.get_total(years_ago, quarter_ago), ()),
+        "db.get_category_totals": (lambda: db.get_category_totals(month_ago, None), (GROUP,)),
+        "db.get_category_totals[user]": (
+            lambda: db.get_category_totals(month_ago, week_ago, USERS[1]), (GROUP,)
+        ),
+        # Top-N by amount within a range: SQLite keeps a bounded sorter.
+        "db.get_category_totals[archived]": (
+            lambda: db.get_category_totals(years_ago, None), (GROUP,)
+        ),
+        "db.get_largest_expenses": (lambda: db.get_largest_expenses(month_ago, None), (ORDER,)),
+        "db.get_largest_expenses[category]": (
+            lambda: db.get_largest_expenses(month_ago, None, 5, "Продукты"), (ORDER,)
+        ),
+        "db.get_daily_totals": (lambda: db.get_daily_totals(quarter_ago), (GROUP,)),
+        "db.get_rollups": (lambda: db.get_rollups("month", year_ago.date()), ()),
+        "db.get_rollups[week,user]": (
+            lambda: db.get_rollups("week", quarter_ago.date(), now.date(), USERS[0]), ()
+        ),
+        "db.get_rollups[day]": (lambda: db.get_rollups("day", years_ago.date()), ()),
+        "db.get_top_descriptions": (
+            lambda: db.get_top_descriptions(quarter_ago), (GROUP, ORDER)
+        ),
+        "db.get_expenses": (lambda: db.get_expenses(month_ago, None), ()),
+        "db.get_expenses[category]": (lambda: db.get_expenses(month_ago, None, "Продукты"), ()),
+        "db.get_expenses[user]": (lambda: db.get_expenses(month_ago, week_ago, None, USERS[0]), ()),
+        "db.get_expenses[archived]": (lambda: db.get_expenses(years_ago, quarter_ago), (ORDER,)),
+        "db.iter_expenses": (lambda: list(db.iter_expenses(month_ago, week_ago)), ()),
+        # A full export reads every row; it must still come from the index, in order.
+        "db.iter_expenses[all]": (
+            lambda: list(db.iter_expenses(None, None)),
+            ("SCAN expenses USING COVERING INDEX idx_expenses_date",),
+        ),
+        "db.import_expenses": (
+            lambda: db.import_expenses(
+                USERS[0],
+                [{"amount": 42.0, "category": "Продукты", "description": "хлеб",
+                  "created_at": week_ago}],
+                "bank",
+                Counter(),
+            ),
+            LOOKUPS,
+        ),
+    }
+
+
+def _statements(call) -> list[str]:
+    """Every data statement call() runs, with parameters inlined."""
+    captured: list[str] = []
+    conns = [db._reader()]
+    with db._writer_lock:
+        conns.append(db._writer())
+    for conn in conns:
+        conn.set_trace_callback(captured.append)
+
+    # Functions that open a connection of their own (db.iter_expenses).
+    get_connection = db.get_connection
+
+    def traced_connection(path: Path | None = None) -> sqlite3.Connection:
+        conn = get_connection(path)
+        conn.set_trace_callback(captured.append)
+        return conn
+
+    db.get_connection = traced_connection
+    try:
+        call()
+    finally:
+        db.get_connection = get_connection
+        for conn in conns:
+            conn.set_trace_callback(None)
+    return [
+        sql for sql in captured
+        if sql.lstrip().split(None, 1)[0].upper() in ("SELECT", "INSERT", "UPDATE", "DELETE", "WITH")
+    ]
+
+
+def check(label: str) -> list[str]:
+    """Run every case against the current DB_PATH and describe plan violations."""
+    explain = sqlite3.connect(f"file:{db.DB_PATH}?mode=ro", uri=True)
+    explain.row_factory = sqlite3.Row
+    failures = []
+    try:
+        for name, (call, allowed) in _cases().items():
+            for sql in _statements(call):
+                # Archived years are attached under the names the queries use.
+                db._attach(explain, db._archived_years(None, None))
+                plan = [row[3] for row in explain.execute(f"EXPLAIN QUERY PLAN {sql}")]
+                subqueries = {step.split()[1] for step in plan if step.startswith("CO-ROUTINE ")}
+                bad = [
+                    step for step in plan
+                    if (step.startswith("SCAN ") or "TEMP B-TREE" in step)
+                    and step != "SCAN CONSTANT ROW"
+                    and step.split()[1] not in subqueries
+                    and not any(step.startswith(a) for a in allowed)
+                ]
+                status = "FAIL" if bad else "ok"
+                print(f"  {status:<4} {name}: {' | '.join(plan) or 'no plan'}")
+                if bad:
+                    failures.append(f"{label} {name}: {', '.join(bad)}\n      {sql}")
+    finally:
+        explain.close()
+    return failures
+
+
+def _use(path: Path) -> None:
+    db.DB_PATH = path
+    db.close_connections()
+    db.init_db()
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size", type=int, default=10_000)
+    parser.add_argument("--data-dir", type=Path, default=BENCH_DIR / "data")
+    args = parser.parse_args()
+
+    failures = []
+    with tempfile.TemporaryDirectory() as tmp:
+        print("== fresh database")
+        _use(Path(tmp) / "fresh.db")
+        failures += check("fresh")
+
+        # The synthetic DB is ANALYZEd, so this covers plans chosen from statistics too.
+        source = generate(args.data_dir / f"expenses_{args.size}.db", args.size)
+        work = Path(tmp) / "work.db"
+        src, dst = sqlite3.connect(source), sqlite3.connect(work)
+        src.backup(dst)
+        src.close()
+        dst.close()
+        print(f"\n== {args.size:,} rows")
+        _use(work)
+        failures += check(f"{args.size} rows")
+
+        years = db.archive_closed_years()
+        print(f"\n== {args.size:,} rows, archived {', '.join(map(str, years)) or 'nothing'}")
+        failures += check(f"{args.size} rows archived")
+        db.close_connections()
+
+    if failures:
+        print(f"\n{len(failures)} plan regression(s):")
+        for line in failures:
+            print(f"  {line}")
+        return 1
+    print("\nAll query plans use index searches")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,253 @@
+"""Time every db.py query and report builder against synthetic databases.
+
+    python -m benchmarks.run                          # 10k, 100k, 1M, 10M rows
+    python -m benchmarks.run --sizes 10000 100000 --save-baseline
+    python -m benchmarks.run --sizes 10000 100000 --baseline benchmarks/baseline.json
+
+Each case is timed over --repeat runs (median and min) and its peak Python
+allocation is measured separately with tracemalloc. Archiving closed years
+changes the data for good, so it runs once, last, with tracemalloc on.
+Results are written as JSON; with --baseline, the run exits non-zero if
+any case's best time is slower than the baseline's by more than --tolerance.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import itertools
+import resource
+import shutil
+import sqlite3
+import statistics
+import sys
+import time
+import tracemalloc
+from collections import Counter
+from datetime import datetime, timedelta
+from pathlib import Path
+
+# config.py requires these; benchmarks never talk to Telegram or OpenAI.
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "0:benchmark")
+os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+os.environ.setdefault("ALLOWED_USER_IDS", "1001,1002")
+
+import db  # noqa: E402
+import reports  # noqa: E402
+from benchmarks.synthetic import USERS, generate  # noqa: E402
+from config import ISRAEL_TZ  # noqa: E402
+from services import export  # noqa: E402
+
+BENCH_DIR = Path(__file__).parent
+DEFAULT_SIZES = [10_000, 100_000, 1_000_000, 10_000_000]
+DEFAULT_BASELINE = BENCH_DIR / "baseline.json"
+# Differences below this are noise regardless of the ratio.
+MIN_REGRESSION_SECONDS = 0.001
+
+
+def _cases(loop: asyncio.AbstractEventLoop) -> dict:
+    now = datetime.now(tz=ISRAEL_TZ)
+    month_ago = now - timedelta(days=30)
+    quarter_ago = now - timedelta(days=90)
+    year_ago = (now - timedelta(days=365)).date()
+    receipt = [
+        {"amount": 12.5, "category": "Продукты", "description": "хлеб"},
+        {"amount": 8.9, "category": "Продукты", "description": "молоко"},
+        {"amount": 45.0, "category": "Дом", "description": "лампочки"},
+    ] * 7
+    # A bank statement: a month of purchases, one cent apart per call so that
+    # no call's rows are skipped as duplicates of an earlier one.
+    imports = itertools.count(1)
+
+    def statement() -> list[dict]:
+        cents = next(imports) / 100
+        return [
+            {"amount": 30.0 + i + cents, "category": "Продукты", "description": "шуферсаль",
+             "created_at": now - timedelta(days=i)}
+            for i in range(30)
+        ]
+
+    def export_csv(since: datetime) -> None:
+        out, _ = loop.run_until_complete(export.export_expenses(since, None))
+        out.close()
+
+    def run(coro_fn, *args):
+        return lambda: loop.run_until_complete(coro_fn(*args))
+
+    def cold(coro_fn):
+        def call():
+            reports._cache.clear()
+            return loop.run_until_complete(coro_fn())
+        return call
+
+    return {
+        "db.init_db": db.init_db,
+        "db.add_expense": lambda: db.add_expense(USERS[0], 42.0, "Продукты", "хлеб"),
+        "db.add_expenses[21]": lambda: db.add_expenses(USERS[0], receipt, "photo"),
+        "db.set_budget": lambda: db.set_budget("Продукты", 4000),
+        "db.get_monthly_total": lambda: db.get_monthly_total("Продукты"),
+        "db.get_budget": lambda: db.get_budget("Продукты"),
+        "db.get_month_to_date": lambda: db.get_month_to_date(["Продукты", "Дом"]),
+        "db.get_budget_status": db.get_budget_status,
+        "db.get_all_budgets": db.get_all_budgets,
+        "db.get_expenses_since[90d]": lambda: db.get_expenses_since(quarter_ago),
+        "db.get_week_expenses": db.get_week_expenses,
+        "db.get_month_expenses": db.get_month_expenses,
+        "db.get_last_n_days_expenses": db.get_last_n_days_expenses,
+        "db.get_previous_week_total": db.get_previous_week_total,
+        "db.get_earliest_since": lambda: db.get_earliest_since(month_ago),
+        "db.get_total": lambda: db.get_total(month_ago, None),
+        "db.get_total[category,user]": lambda: db.get_total(month_ago, None, "Продукты", USERS[0]),
+        "db.get_category_totals": lambda: db.get_category_totals(month_ago, None),
+        "db.get_largest_expenses": lambda: db.get_largest_expenses(month_ago, None),
+        "db.get_daily_totals": lambda: db.get_daily_totals(quarter_ago),
+        "db.get_top_descriptions": lambda: db.get_top_descriptions(quarter_ago),
+        "db.get_rollups[month]": lambda: db.get_rollups("month", year_ago),
+        "db.get_rollups[day]": lambda: db.get_rollups("day", year_ago),
+        "db.get_expenses": lambda: db.get_expenses(month_ago, None, "Продукты"),
+        "db.iter_expenses[90d]": lambda: sum(map(len, db.iter_expenses(quarter_ago, None))),
+        "db.import_expenses[30]": lambda: db.import_expenses(
+            USERS[0], statement(), "bank", Counter()
+        ),
+        "export.export_expenses[90d]": lambda: export_csv(quarter_ago),
+        "reports.build_week_report": cold(reports.build_week_report),
+        "reports.build_month_report": cold(reports.build_month_report),
+        "reports.build_budget_report": cold(reports.build_budget_report),
+        "reports.build_year_report": cold(reports.build_year_report),
+        "reports.build_trend_report": cold(reports.build_trend_report),
+        "reports.build_month_report[cached]": run(reports.build_month_report),
+        "reports.format_expense_feedback": run(reports.format_expense_feedback, "Продукты", 42.0),
+        "reports.format_batch_feedback": run(reports.format_batch_feedback, receipt),
+    }
+
+
+def _measure(fn, repeat: int) -> dict:
+    fn()  # warm up connections and caches
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - started)
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "median_s": statistics.median(timings),
+        "min_s": min(timings),
+        "peak_bytes": peak,
+    }
+
+
+def _measure_once(fn) -> dict:
+    """Time a single call, for work that can't be repeated on the same data."""
+    tracemalloc.start()
+    started = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"median_s": elapsed, "min_s": elapsed, "peak_bytes": peak}
+
+
+def run_size(size: int, data_dir: Path, repeat: int) -> dict:
+    started = time.perf_counter()
+    path = generate(data_dir / f"expenses_{size}.db", size)
+    print(f"\n== {size:,} rows ({path.stat().st_size / 1e6:.1f} MB, "
+          f"ready in {time.perf_counter() - started:.1f}s)")
+
+    # Work on a copy so writes made by the cases don't change the cached data.
+    work = data_dir / f"work_{size}.db"
+    src = sqlite3.connect(path)
+    dst = sqlite3.connect(work)
+    src.backup(dst)
+    src.close()
+    dst.close()
+    db.DB_PATH = work
+    db.close_connections()
+    db.init_db()
+
+    loop = asyncio.new_event_loop()
+    results = {}
+    try:
+        cases = {name: (_measure, fn, repeat) for name, fn in _cases(loop).items()}
+        cases["db.archive_closed_years"] = (_measure_once, db.archive_closed_years)
+        for name, (measure, *args) in cases.items():
+            results[name] = r = measure(*args)
+            print(f"  {name:<40} {r['median_s'] * 1000:>10.2f} ms  "
+                  f"{r['peak_bytes'] / 1024:>10.0f} KiB")
+    finally:
+        loop.close()
+        db.close_connections()
+        for suffix in ("", "-wal", "-shm"):
+            Path(f"{work}{suffix}").unlink(missing_ok=True)
+        shutil.rmtree(work.parent / f"{work.stem}_archive", ignore_errors=True)
+    return results
+
+
+def compare(current: dict, baseline: dict, tolerance: float) -> list[str]:
+    """Describe every case that got slower than the baseline beyond tolerance."""
+    regressions = []
+    for size, cases in current["results"].items():
+        for name, result in cases.items():
+            base = baseline.get("results", {}).get(size, {}).get(name)
+            if base is None:
+                continue
+            # min is far less noisy than the median on shared machines
+            now_s, base_s = result["min_s"], base["min_s"]
+            if now_s > base_s * (1 + tolerance) and now_s - base_s > MIN_REGRESSION_SECONDS:
+                regressions.append(
+                    f"{size} rows {name}: {base_s * 1000:.2f} ms -> {now_s * 1000:.2f} ms "
+                    f"({now_s / base_s:.2f}x)"
+                )
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--data-dir", type=Path, default=BENCH_DIR / "data")
+    parser.add_argument("--output", type=Path)
+    parser.add_argument("--baseline", type=Path)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    args = parser.parse_args()
+
+    results = {
+        "meta": {
+            "timestamp": datetime.now(tz=ISRAEL_TZ).isoformat(),
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "machine": platform.machine(),
+            "repeat": args.repeat,
+        },
+        "results": {},
+    }
+    for size in args.sizes:
+        results["results"][str(size)] = run_size(size, args.data_dir, args.repeat)
+    # ru_maxrss is KiB on Linux.
+    results["meta"]["max_rss_bytes"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    print(f"\nPeak RSS: {results['meta']['max_rss_bytes'] / 1e6:.1f} MB")
+
+    output = args.output or BENCH_DIR / "results" / f"{datetime.now():%Y%m%d-%H%M%S}.json"
+    if args.save_baseline:
+        output = args.baseline or DEFAULT_BASELINE
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(results, indent=2, ensure_ascii=False))
+    print(f"Results written to {output}")
+
+    if args.baseline and not args.save_baseline:
+        baseline = json.loads(args.baseline.read_text())
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) vs {args.baseline}:")
+            for line in regressions:
+                print(f"  {line}")
+            return 1
+        print(f"\nNo regressions vs {args.baseline}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,142 @@
+"""Compare transcribing voice notes as they are with trimmed, chunked ones.
+
+    python -m benchmarks.voice_prep
+    python -m benchmarks.voice_prep --lengths 15 60 180 --uplink-kbps 500
+
+Needs ffmpeg on PATH. Synthetic notes stand in for Telegram voice messages
+(48 kHz Opus at 32 kbit/s): bursts of tone for speech with pauses of
+0.3-3 s between them, plus leading and trailing silence. A fake Whisper
+endpoint charges a base latency, the upload time at --uplink-kbps and
+--rtf seconds of processing per second of audio, and answers with the
+length of the audio it got.
+
+Each note is sent once whole through services.ai_gateway and once through
+services.whisper.transcribe_voice (silence trimmed, split at pauses, chunks
+in parallel). The run exits non-zero if preprocessing doesn't shrink the
+upload, the original note's text is wrong or the chunks' texts come back
+out of order.
+"""
+import argparse
+import asyncio
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+# config.py requires these; nothing here talks to the real OpenAI or Telegram.
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "0:benchmark")
+os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+os.environ.setdefault("ALLOWED_USER_IDS", "1001,1002")
+
+import tornado.httpserver  # noqa: E402
+import tornado.netutil  # noqa: E402
+import tornado.web  # noqa: E402
+
+from services import ai_gateway, audio_prep, whisper  # noqa: E402
+
+BASE_LATENCY = 0.3
+
+
+def _synthetic_note(seconds: float, path: Path) -> bytes:
+    """A voice-note-like Ogg Opus file: tone bursts between random pauses."""
+    rng = random.Random(int(seconds))
+    spans, t = [], rng.uniform(0.5, 1.5)
+    while t < seconds - 1.0:
+        length = min(rng.uniform(1.0, 5.0), seconds - 1.0 - t)
+        spans.append(f"between(t,{t:.2f},{t + length:.2f})")
+        t += length + rng.uniform(0.3, 3.0)
+    voiced = "+".join(spans) or "0"
+    expression = f"({voiced})*0.3*sin(2*PI*220*t)*(0.6+0.4*sin(2*PI*4*t))"
+    subprocess.run(
+        [
+            "ffmpeg", "-hide_banner", "-loglevel", "error", "-y",
+            "-f", "lavfi", "-i", f"aevalsrc='{expression}':s=48000:d={seconds}",
+            "-c:a", "libopus", "-b:a", "32k", str(path),
+        ],
+        check=True,
+    )
+    return path.read_bytes()
+
+
+class _Transcriptions(tornado.web.RequestHandler):
+    def initialize(self, args) -> None:
+        self.args = args
+
+    async def post(self) -> None:
+        audio = self.request.files["file"][0]["body"]
+        seconds = audio_prep.ogg_duration(audio)
+        await asyncio.sleep(
+            BASE_LATENCY
+            + len(audio) * 8 / (self.args.uplink_kbps * 1000)
+            + seconds * self.args.rtf
+        )
+        self.write({"text": f"[{seconds:.2f}]"})
+
+
+async def _main(args, tmp: Path) -> int:
+    sockets = tornado.netutil.bind_sockets(0, "127.0.0.1")
+    server = tornado.httpserver.HTTPServer(tornado.web.Application([
+        (r"/v1/audio/transcriptions", _Transcriptions, {"args": args}),
+    ]))
+    server.add_sockets(sockets)
+    ai_gateway.client.base_url = f"http://127.0.0.1:{sockets[0].getsockname()[1]}/v1"
+
+    failures = []
+    print(f"{'note':>6} {'mode':<9} {'bytes':>8} {'audio':>7} {'chunks':>6} {'latency':>9}")
+    try:
+        for length in args.lengths:
+            note = _synthetic_note(length, tmp / f"{length}.ogg")
+
+            started = time.perf_counter()
+            whole = await ai_gateway.transcribe(note, "voice.ogg")
+            whole_ms = (time.perf_counter() - started) * 1000
+            print(
+                f"{length:>5g}s {'original':<9} {len(note):>8} "
+                f"{audio_prep.ogg_duration(note):>6.1f}s {1:>6} {whole_ms:>7.0f}ms"
+            )
+
+            chunks = audio_prep.preprocess_voice(note)
+            started = time.perf_counter()
+            text = await whisper.transcribe_voice(note)
+            prepared_ms = (time.perf_counter() - started) * 1000
+            size = sum(len(chunk) for chunk in chunks)
+            seconds = sum(audio_prep.ogg_duration(chunk) for chunk in chunks)
+            print(
+                f"{'':>6} {'prepared':<9} {size:>8} {seconds:>6.1f}s "
+                f"{len(chunks):>6} {prepared_ms:>7.0f}ms"
+            )
+
+            if whole != f"[{audio_prep.ogg_duration(note):.2f}]":
+                failures.append(f"{length:g}s: original note came back as {whole!r}")
+            expected = " ".join(f"[{audio_prep.ogg_duration(chunk):.2f}]" for chunk in chunks)
+            if text != expected:
+                failures.append(f"{length:g}s: got {text!r}, expected {expected!r}")
+            if size >= len(note):
+                failures.append(f"{length:g}s: {size} bytes prepared, {len(note)} originally")
+    finally:
+        server.stop()
+
+    for line in failures:
+        print(f"  FAIL {line}")
+    return 1 if failures else 0
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--lengths", type=float, nargs="+", default=[10, 45, 120, 300])
+    parser.add_argument("--uplink-kbps", type=float, default=1000)
+    parser.add_argument("--rtf", type=float, default=0.05)
+    args = parser.parse_args()
+    if shutil.which("ffmpeg") is None:
+        print("ffmpeg not found on PATH")
+        return 2
+    with tempfile.TemporaryDirectory() as tmp:
+        return asyncio.run(_main(args, Path(tmp)))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
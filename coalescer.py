@@ -0,0 +1,99 @@
+import asyncio
+import logging
+from collections import Counter
+from typing import Awaitable, Callable, Generic, Hashable, TypeVar
+
+logger = logging.getLogger(__name__)
+
+K = TypeVar("K", bound=Hashable)
+T = TypeVar("T")
+
+
+class _Batch(Generic[T]):
+    def __init__(self, now: float) -> None:
+        self.items: list[T] = []
+        self.first = now
+        self.last = now
+        self.ready = asyncio.Event()
+
+
+class Coalescer(Generic[K, T]):
+    """Group items added under the same key in quick succession into one batch.
+
+    A batch is flushed `window` seconds after its latest item, but no later
+    than `max_wait` after its first, or as soon as it holds `max_items`.
+    Batches of one key are flushed one at a time and in order; items added
+    while a flush is running start the next batch.
+    """
+
+    def __init__(
+        self,
+        flush: Callable[[K, list[T]], Awaitable[None]],
+        window: float,
+        max_wait: float,
+        max_items: int,
+    ) -> None:
+        self._flush = flush
+        self._window = window
+        self._max_wait = max_wait
+        self._max_items = max_items
+        self._open: dict[K, _Batch[T]] = {}
+        self._locks: dict[K, asyncio.Lock] = {}
+        self._unflushed: Counter = Counter()
+        self._tasks: set[asyncio.Task] = set()
+        self._closing = False
+
+    def busy(self, key: K) -> bool:
+        """Whether key has a batch waiting or being flushed.
+
+        An item handled outside the coalescer while this is true could
+        overtake earlier ones.
+        """
+        return self._unflushed[key] > 0
+
+    def add(self, key: K, item: T) -> None:
+        now = asyncio.get_running_loop().time()
+        batch = self._open.get(key)
+        if batch is None:
+            batch = self._open[key] = _Batch(now)
+            self._unflushed[key] += 1
+            task = asyncio.create_task(self._run(key, batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        batch.items.append(item)
+        batch.last = now
+        if len(batch.items) >= self._max_items or self._closing:
+            batch.ready.set()
+
+    async def _run(self, key: K, batch: _Batch[T]) -> None:
+        loop = asyncio.get_running_loop()
+        while not batch.ready.is_set():
+            delay = min(batch.last + self._window, batch.first + self._max_wait) - loop.time()
+            if delay <= 0:
+                break
+            try:
+                await asyncio.wait_for(batch.ready.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+        # From here on new items for the key go to a new batch.
+        del self._open[key]
+
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        try:
+            async with lock:
+                await self._flush(key, batch.items)
+        except Exception:
+            logger.exception("Flushing %d items for %r failed", len(batch.items), key)
+        finally:
+            self._unflushed[key] -= 1
+            if not self._unflushed[key]:
+                del self._unflushed[key]
+                del self._locks[key]
+
+    async def drain(self) -> None:
+        """Flush every pending batch now and wait for the flushes to finish."""
+        self._closing = True
+        for batch in self._open.values():
+            batch.ready.set()
+        while self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
@@ -14,12 +14,38 @@ ALLOWED_USER_IDS = [
     if uid.strip()
 ]
 
+# /stats is limited to these users; defaults to the first allowed user.
+ADMIN_USER_IDS = [
+    int(uid.strip())
+    for uid in os.environ.get("ADMIN_USER_IDS", "").split(",")
+    if uid.strip()
+] or ALLOWED_USER_IDS[:1]
+
+# Local Prometheus-style endpoint at http://127.0.0.1:<port>/metrics; 0 disables it.
+METRICS_PORT = int(os.environ.get("METRICS_PORT", "0"))
+
+# Updates handled at the same time across all chats; each chat is still one at a time.
+MAX_CONCURRENT_UPDATES = int(os.environ.get("MAX_CONCURRENT_UPDATES", "8"))
+
+# Webhook mode: Telegram posts updates to <WEBHOOK_URL>/telegram, served on
+# WEBHOOK_PORT behind the proxy; unset means long polling. Requests without
+# WEBHOOK_SECRET in the X-Telegram-Bot-Api-Secret-Token header are rejected.
+WEBHOOK_URL = os.environ.get("WEBHOOK_URL", "").rstrip("/")
+WEBHOOK_PORT = int(os.environ.get("WEBHOOK_PORT", "8080"))
+WEBHOOK_SECRET = os.environ.get("WEBHOOK_SECRET", "")
+if WEBHOOK_URL and not WEBHOOK_SECRET:
+    raise RuntimeError("WEBHOOK_SECRET is required when WEBHOOK_URL is set")
+
+# A local Bot API server (or the benchmarks' fake one) instead of api.telegram.org.
+TELEGRAM_API_URL = os.environ.get("TELEGRAM_API_URL", "").rstrip("/")
+
 ISRAEL_TZ = ZoneInfo("Asia/Jerusalem")
 
 BASE_DIR = Path(__file__).parent
 DATA_DIR = BASE_DIR / "data"
 DATA_DIR.mkdir(exist_ok=True)
 DB_PATH = DATA_DIR / "finance.db"
+CACHE_DB_PATH = DATA_DIR / "cache.db"
 
 CATEGORIES = [
     "Продукты",
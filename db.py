@@ -1,6 +1,22 @@
+import logging
 import sqlite3
-from datetime import datetime, timedelta, timezone
-from config import DB_PATH, ISRAEL_TZ
+import threading
+from collections import Counter
+from datetime import date, datetime, timedelta, timezone
+from pathlib import Path
+from typing import Callable, Iterable, Iterator
+from config import CATEGORIES, DB_PATH, ISRAEL_TZ
+
+logger = logging.getLogger(__name__)
+
+# Years that ended longer ago than this move to archive files. Reports and
+# Q&A context look back 90 days, so they never have to leave the hot table.
+ARCHIVE_AFTER_DAYS = 120
+
+_local = threading.local()
+_writer_lock = threading.Lock()
+_writer_conn: sqlite3.Connection | None = None
+_write_listeners: list[Callable[[str, list[datetime]], None]] = []
 
 
 def _now_il() -> datetime:
@@ -8,42 +24,572 @@ def _now_il() -> datetime:
     return datetime.now(tz=ISRAEL_TZ)
 
 
-def _utc_str(dt: datetime) -> str:
-    """Convert timezone-aware datetime to UTC string for SQLite comparison."""
-    return dt.astimezone(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+def _epoch(dt: datetime) -> int:
+    """Timezone-aware datetime as integer Unix seconds, the created_at encoding."""
+    return int(dt.timestamp())
+
+
+def _to_minor(amount: float) -> int:
+    """Amount in minor units (agorot/kopecks); amounts are stored as integers."""
+    return round(amount * 100)
+
 
+def _month_start(dt: datetime) -> datetime:
+    """First instant of dt's month, in dt's timezone."""
+    return dt.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
 
-def get_connection() -> sqlite3.Connection:
-    conn = sqlite3.connect(DB_PATH)
+
+def get_connection(path: Path | None = None) -> sqlite3.Connection:
+    conn = sqlite3.connect(path or DB_PATH, check_same_thread=False)
     conn.row_factory = sqlite3.Row
     conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA busy_timeout=5000")
     return conn
 
 
-def init_db() -> None:
-    conn = get_connection()
-    conn.executescript("""
-        CREATE TABLE IF NOT EXISTS expenses (
+def _reader() -> sqlite3.Connection:
+    """Long-lived read-only connection owned by the calling thread.
+
+    Reopened if DB_PATH has been pointed elsewhere (benchmarks do this).
+    """
+    conn = getattr(_local, "conn", None)
+    if conn is not None and _local.path != DB_PATH:
+        conn.close()
+        conn = None
+    if conn is None:
+        conn = get_connection()
+        conn.execute("PRAGMA query_only=ON")
+        _local.conn = conn
+        _local.path = DB_PATH
+    return conn
+
+
+def _writer() -> sqlite3.Connection:
+    """The single shared write connection. Callers must hold _writer_lock."""
+    global _writer_conn
+    if _writer_conn is None:
+        _writer_conn = get_connection()
+        _writer_conn.execute("PRAGMA synchronous=NORMAL")
+    return _writer_conn
+
+
+def close_connections() -> None:
+    """Close the writer and the calling thread's reader connection."""
+    global _writer_conn
+    with _writer_lock:
+        if _writer_conn is not None:
+            _writer_conn.close()
+            _writer_conn = None
+    conn = getattr(_local, "conn", None)
+    if conn is not None:
+        conn.close()
+        _local.conn = None
+
+
+class _Codes:
+    """Name <-> integer id mapping for a small lookup table (categories, sources).
+
+    Rows only store the id; the mapping is loaded once and kept in memory.
+    """
+
+    def __init__(self, table: str) -> None:
+        self._table = table
+        self._lock = threading.Lock()
+        self._ids: dict[str, int] = {}
+        self._names: dict[int, str] = {}
+
+    def load(self, conn: sqlite3.Connection) -> None:
+        rows = conn.execute(f"SELECT id, name FROM {self._table}").fetchall()
+        with self._lock:
+            self._ids = {r["name"]: r["id"] for r in rows}
+            self._names = {r["id"]: r["name"] for r in rows}
+
+    def id(self, name: str) -> int | None:
+        with self._lock:
+            return self._ids.get(name)
+
+    def ensure(self, conn: sqlite3.Connection, name: str) -> int:
+        """Id for name, inserting it if new. Caller holds _writer_lock, outside a transaction."""
+        code = self.id(name)
+        if code is None:
+            conn.execute(f"INSERT OR IGNORE INTO {self._table} (name) VALUES (?)", (name,))
+            conn.commit()
+            self.load(conn)
+            code = self.id(name)
+        return code
+
+    def name(self, code: int) -> str:
+        with self._lock:
+            name = self._names.get(code)
+        if name is None:
+            # Added by another process since we loaded.
+            self.load(_reader())
+            with self._lock:
+                name = self._names.get(code, str(code))
+        return name
+
+
+_categories = _Codes("categories")
+_sources = _Codes("sources")
+
+
+class _MonthToDateCache:
+    """Month-to-date spend per category and budget limits, held in memory.
+
+    Writers update it under _writer_lock right after committing, so it never
+    disagrees with the tables. It is rebuilt with one GROUP BY when the month
+    changes in Israel time. Amounts are kept in minor units so that running
+    sums don't drift.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._month: tuple[int, int] | None = None
+        self._spent: dict[str, int] = {}
+        self._budgets: dict[str, int] = {}
+
+    def rebuild(self, conn: sqlite3.Connection) -> None:
+        now = _now_il()
+        rows = conn.execute(
+            "SELECT category_id, SUM(amount_minor) AS total FROM expenses "
+            "WHERE created_at >= ? GROUP BY +category_id",
+            (_epoch(_month_start(now)),),
+        ).fetchall()
+        budgets = conn.execute("SELECT category_id, limit_minor FROM budgets").fetchall()
+        with self._lock:
+            self._month = (now.year, now.month)
+            self._spent = {_categories.name(r["category_id"]): r["total"] for r in rows}
+            self._budgets = {
+                _categories.name(r["category_id"]): r["limit_minor"] for r in budgets
+            }
+
+    def _is_current(self) -> bool:
+        now = _now_il()
+        return self._month == (now.year, now.month)
+
+    def _ensure_current(self) -> None:
+        if not self._is_current():
+            with _writer_lock:
+                if not self._is_current():
+                    self.rebuild(_writer())
+
+    def record_expenses(self, entries: list[tuple[str, int]]) -> None:
+        """Account for just-committed (category, amount_minor) pairs. Caller holds _writer_lock."""
+        if not self._is_current():
+            self.rebuild(_writer())
+            return
+        with self._lock:
+            for category, amount_minor in entries:
+                self._spent[category] = self._spent.get(category, 0) + amount_minor
+
+    def record_budget(self, category: str, limit_minor: int) -> None:
+        with self._lock:
+            self._budgets[category] = limit_minor
+
+    def spent(self, category: str) -> float:
+        self._ensure_current()
+        with self._lock:
+            return self._spent.get(category, 0) / 100
+
+    def budget(self, category: str) -> float | None:
+        self._ensure_current()
+        with self._lock:
+            limit = self._budgets.get(category)
+        return None if limit is None else limit / 100
+
+    def snapshot(self, categories: list[str]) -> dict[str, tuple[float, float | None]]:
+        self._ensure_current()
+        with self._lock:
+            return {
+                cat: (
+                    self._spent.get(cat, 0) / 100,
+                    None if self._budgets.get(cat) is None else self._budgets[cat] / 100,
+                )
+                for cat in categories
+            }
+
+    def budgets(self) -> list[dict]:
+        self._ensure_current()
+        with self._lock:
+            return [
+                {
+                    "category": cat,
+                    "monthly_limit": limit / 100,
+                    "spent": self._spent.get(cat, 0) / 100,
+                }
+                for cat, limit in self._budgets.items()
+            ]
+
+
+_mtd = _MonthToDateCache()
+
+
+def add_write_listener(listener: Callable[[str, list[datetime]], None]) -> None:
+    """Call listener(table, timestamps) after every committed write.
+
+    table is "expenses" (timestamps: created_at of the new rows, UTC) or
+    "budgets" (timestamps empty). Listeners run on the writing thread.
+    """
+    _write_listeners.append(listener)
+
+
+def _notify_write(table: str, timestamps: list[datetime]) -> None:
+    for listener in _write_listeners:
+        listener(table, timestamps)
+
+
+# Archived years, year -> file. Readers take a snapshot; the archiver adds a
+# year before moving its first rows so that reads never miss them.
+_archives_lock = threading.Lock()
+_archives: dict[int, Path] = {}
+
+_ROW_COLUMNS = "id, user_id, amount_minor, category_id, description, source_id, created_at"
+
+_ARCHIVE_SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS {alias}.expenses (
+        id INTEGER PRIMARY KEY,
+        user_id INTEGER NOT NULL,
+        amount_minor INTEGER NOT NULL,
+        category_id INTEGER NOT NULL,
+        description TEXT NOT NULL,
+        source_id INTEGER NOT NULL,
+        created_at INTEGER NOT NULL
+    )""",
+    "CREATE INDEX IF NOT EXISTS {alias}.idx_expenses_date ON expenses"
+    "(created_at, category_id, user_id, amount_minor, source_id, description)",
+    "CREATE INDEX IF NOT EXISTS {alias}.idx_expenses_category_date ON expenses"
+    "(category_id, created_at, user_id, amount_minor, source_id)",
+]
+
+
+def _archive_dir() -> Path:
+    """finance.db keeps its archive next to it, in finance_archive/."""
+    return DB_PATH.parent / f"{DB_PATH.stem}_archive"
+
+
+def _year_start(year: int) -> datetime:
+    return datetime(year, 1, 1, tzinfo=ISRAEL_TZ)
+
+
+def _load_archives(conn: sqlite3.Connection) -> None:
+    found = {}
+    for r in conn.execute("SELECT year, file FROM archives"):
+        path = _archive_dir() / r["file"]
+        if path.exists():
+            found[r["year"]] = path
+        else:
+            logger.error("Archive for %d is missing: %s", r["year"], path)
+    with _archives_lock:
+        _archives.clear()
+        _archives.update(found)
+
+
+def _archived_years(since: datetime | None, until: datetime | None) -> list[tuple[int, Path]]:
+    """Archived (year, file) pairs that overlap [since, until), oldest first."""
+    with _archives_lock:
+        archives = sorted(_archives.items())
+    return [
+        (year, path) for year, path in archives
+        if (until is None or _year_start(year) < until)
+        and (since is None or _year_start(year + 1) > since)
+    ]
+
+
+def _attach(conn: sqlite3.Connection, archives: list[tuple[int, Path]]) -> list[str]:
+    """Attach the archive files to conn (if not yet) and return their schema names.
+
+    Attachments are kept for later queries; ones not needed now are detached
+    when SQLite's attach limit would be exceeded.
+    """
+    attached = {r["name"] for r in conn.execute("PRAGMA database_list")} - {"main", "temp"}
+    wanted = [f"archive_{year}" for year, _ in archives]
+    limit = conn.getlimit(sqlite3.SQLITE_LIMIT_ATTACHED)
+    missing = [(alias, path) for alias, (_, path) in zip(wanted, archives) if alias not in attached]
+    spare = sorted(attached - set(wanted))
+    while spare and len(attached) + len(missing) > limit:
+        alias = spare.pop()
+        conn.execute(f"DETACH DATABASE {alias}")
+        attached.discard(alias)
+    for alias, path in missing:
+        conn.execute(f"ATTACH DATABASE ? AS {alias}", (str(path),))
+    return wanted
+
+
+def _expenses_source(
+    conn: sqlite3.Connection, since: datetime | None, until: datetime | None
+) -> str:
+    """FROM-clause for expenses in [since, until).
+
+    The hot table alone for recent ranges; otherwise a UNION ALL with the
+    archived years the range reaches, attached to conn. SQLite pushes the
+    range filters down into each arm, so every file is searched by index.
+    """
+    archives = _archived_years(since, until)
+    if not archives:
+        return "expenses"
+    arms = [f"SELECT {_ROW_COLUMNS} FROM main.expenses"] + [
+        f"SELECT {_ROW_COLUMNS} FROM {alias}.expenses" for alias in _attach(conn, archives)
+    ]
+    return f"({' UNION ALL '.join(arms)}) AS expenses"
+
+
+# Rollup grains. A period is keyed by the local date it starts on: the day
+# itself, the Monday of its week, the first of its month.
+ROLLUP_GRAINS = ("day", "week", "month")
+
+_ROLLUP_UPSERT = (
+    "INSERT INTO rollups (grain, period, category_id, user_id, total_minor, count) "
+    "VALUES (?, ?, ?, ?, ?, ?) "
+    "ON CONFLICT (grain, period, category_id, user_id) DO UPDATE SET "
+    "total_minor = total_minor + excluded.total_minor, count = count + excluded.count"
+)
+
+
+def _period_starts(day: date) -> tuple[str, str, str]:
+    """Keys of the day, week and month periods that day falls in."""
+    return (
+        day.isoformat(),
+        (day - timedelta(days=day.weekday())).isoformat(),
+        day.replace(day=1).isoformat(),
+    )
+
+
+def _update_rollups(conn: sqlite3.Connection, rows: Iterable[tuple]) -> None:
+    """Add (user_id, amount_minor, category_id, created_at, count) rows to the rollups.
+
+    Runs inside the caller's transaction, so the rollups commit together
+    with the expenses they count. Periods only ever grow: archiving moves
+    rows without touching them, and nothing deletes expenses.
+    """
+    deltas: dict[tuple, list[int]] = {}
+    for user_id, amount_minor, category_id, created_at, count in rows:
+        day = datetime.fromtimestamp(created_at, tz=ISRAEL_TZ).date()
+        for grain, period in zip(ROLLUP_GRAINS, _period_starts(day)):
+            delta = deltas.setdefault((grain, period, category_id, user_id), [0, 0])
+            delta[0] += amount_minor
+            delta[1] += count
+    conn.executemany(
+        _ROLLUP_UPSERT, [(*key, total, count) for key, (total, count) in deltas.items()]
+    )
+
+
+def _backfill_rollups(conn: sqlite3.Connection, source: sqlite3.Connection) -> None:
+    """Add every expense in source's expenses table to conn's rollups.
+
+    Rows are pre-summed per UTC hour: Israel's offsets are whole hours, so
+    an hour never straddles two local days.
+    """
+    _update_rollups(conn, source.execute(
+        "SELECT user_id, SUM(amount_minor), category_id, created_at / 3600 * 3600, COUNT(*) "
+        "FROM expenses GROUP BY created_at / 3600, category_id, user_id"
+    ))
+
+
+# The schema the bot shipped with. Fresh databases start here too, so every
+# database reaches the current schema through the same migrations.
+_BASE_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS expenses (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        amount REAL NOT NULL,
+        category TEXT NOT NULL,
+        description TEXT NOT NULL,
+        source TEXT NOT NULL DEFAULT 'text',
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    CREATE INDEX IF NOT EXISTS idx_expenses_user_date
+        ON expenses(user_id, created_at);
+    CREATE INDEX IF NOT EXISTS idx_expenses_category_date
+        ON expenses(category, created_at);
+
+    CREATE TABLE IF NOT EXISTS budgets (
+        category TEXT NOT NULL UNIQUE,
+        monthly_limit REAL NOT NULL,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+"""
+
+_NOW_EPOCH = "CAST(strftime('%s', 'now') AS INTEGER)"
+
+
+def _migrate_compact_schema(conn: sqlite3.Connection) -> None:
+    """1: integer minor-unit amounts, epoch created_at, coded categories and sources."""
+    conn.execute("""
+        CREATE TABLE categories (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL UNIQUE
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE sources (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL UNIQUE
+        )
+    """)
+    conn.executemany("INSERT INTO categories (name) VALUES (?)", [(c,) for c in CATEGORIES])
+    conn.execute(
+        "INSERT OR IGNORE INTO categories (name) "
+        "SELECT category FROM expenses UNION SELECT category FROM budgets"
+    )
+    conn.executemany(
+        "INSERT INTO sources (name) VALUES (?)", [("text",), ("voice",), ("photo",)]
+    )
+    conn.execute("INSERT OR IGNORE INTO sources (name) SELECT DISTINCT source FROM expenses")
+
+    conn.execute("""
+        CREATE TABLE expenses_v1 (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             user_id INTEGER NOT NULL,
-            amount REAL NOT NULL,
-            category TEXT NOT NULL,
+            amount_minor INTEGER NOT NULL,
+            category_id INTEGER NOT NULL REFERENCES categories(id),
             description TEXT NOT NULL,
-            source TEXT NOT NULL DEFAULT 'text',
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        );
-        CREATE INDEX IF NOT EXISTS idx_expenses_user_date
-            ON expenses(user_id, created_at);
-        CREATE INDEX IF NOT EXISTS idx_expenses_category_date
-            ON expenses(category, created_at);
-
-        CREATE TABLE IF NOT EXISTS budgets (
-            category TEXT NOT NULL UNIQUE,
-            monthly_limit REAL NOT NULL,
-            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        );
+            source_id INTEGER NOT NULL REFERENCES sources(id),
+            created_at INTEGER NOT NULL
+        )
+    """)
+    conn.execute(f"""
+        INSERT INTO expenses_v1
+            (id, user_id, amount_minor, category_id, description, source_id, created_at)
+        SELECT e.id, e.user_id, CAST(round(e.amount * 100) AS INTEGER), c.id,
+               e.description, s.id,
+               COALESCE(CAST(strftime('%s', e.created_at) AS INTEGER), {_NOW_EPOCH})
+        FROM expenses e
+        JOIN categories c ON c.name = e.category
+        JOIN sources s ON s.name = e.source
+    """)
+    seq = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'expenses'").fetchone()
+    conn.execute("DROP TABLE expenses")
+    conn.execute("ALTER TABLE expenses_v1 RENAME TO expenses")
+    if seq is not None:
+        # Keep ids of deleted rows from being reused.
+        conn.execute(
+            "UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = 'expenses'", (seq[0],)
+        )
+    conn.execute("CREATE INDEX idx_expenses_date ON expenses(created_at)")
+    conn.execute("CREATE INDEX idx_expenses_user_date ON expenses(user_id, created_at)")
+    conn.execute("CREATE INDEX idx_expenses_category_date ON expenses(category_id, created_at)")
+
+    conn.execute("""
+        CREATE TABLE budgets_v1 (
+            category_id INTEGER PRIMARY KEY REFERENCES categories(id),
+            limit_minor INTEGER NOT NULL,
+            updated_at INTEGER NOT NULL
+        )
+    """)
+    conn.execute(f"""
+        INSERT INTO budgets_v1 (category_id, limit_minor, updated_at)
+        SELECT c.id, CAST(round(b.monthly_limit * 100) AS INTEGER),
+               COALESCE(CAST(strftime('%s', b.updated_at) AS INTEGER), {_NOW_EPOCH})
+        FROM budgets b JOIN categories c ON c.name = b.category
     """)
-    conn.close()
+    conn.execute("DROP TABLE budgets")
+    conn.execute("ALTER TABLE budgets_v1 RENAME TO budgets")
+
+
+def _migrate_covering_indexes(conn: sqlite3.Connection) -> None:
+    """2: covering indexes, so that every expenses query is an index range search.
+
+    Range queries are answered from idx_expenses_date alone; queries filtered by
+    category use idx_expenses_category_date. Only the date index carries the
+    free-text description: the aggregates never read it, and listings by
+    category fetch their few rows from the table. With two users a
+    user_id-led index barely narrows anything, so user filters are applied
+    inside these indexes.
+    Range aggregates group by +category_id: without the unary plus, and with no
+    ANALYZE statistics, SQLite prefers walking the whole category index to
+    avoid a small GROUP BY sort. Checked by benchmarks/query_plans.py.
+    """
+    conn.execute("DROP INDEX IF EXISTS idx_expenses_date")
+    conn.execute("DROP INDEX IF EXISTS idx_expenses_user_date")
+    conn.execute("DROP INDEX IF EXISTS idx_expenses_category_date")
+    conn.execute(
+        "CREATE INDEX idx_expenses_date ON expenses"
+        "(created_at, category_id, user_id, amount_minor, source_id, description)"
+    )
+    conn.execute(
+        "CREATE INDEX idx_expenses_category_date ON expenses"
+        "(category_id, created_at, user_id, amount_minor, source_id)"
+    )
+
+
+def _migrate_archives(conn: sqlite3.Connection) -> None:
+    """3: registry of years moved out to archive files (see archive_closed_years)."""
+    conn.execute("""
+        CREATE TABLE archives (
+            year INTEGER PRIMARY KEY,
+            file TEXT NOT NULL,
+            rows INTEGER NOT NULL,
+            archived_at INTEGER NOT NULL
+        )
+    """)
+
+
+def _migrate_rollups(conn: sqlite3.Connection) -> None:
+    """4: per-day, week and month totals by category and user (see get_rollups).
+
+    Backfilled from the hot table and every archived year; from then on
+    each write updates them in its own transaction.
+    """
+    conn.execute("""
+        CREATE TABLE rollups (
+            grain TEXT NOT NULL,
+            period TEXT NOT NULL,
+            category_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            total_minor INTEGER NOT NULL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (grain, period, category_id, user_id)
+        ) WITHOUT ROWID
+    """)
+    _backfill_rollups(conn, conn)
+    for r in conn.execute("SELECT year, file FROM archives").fetchall():
+        path = _archive_dir() / r["file"]
+        if not path.exists():
+            raise RuntimeError(f"Archive for {r['year']} is missing: {path}")
+        archive = get_connection(path)
+        try:
+            _backfill_rollups(conn, archive)
+        finally:
+            archive.close()
+
+
+# Applied in order; PRAGMA user_version holds how many have run.
+MIGRATIONS: list[Callable[[sqlite3.Connection], None]] = [
+    _migrate_compact_schema,
+    _migrate_covering_indexes,
+    _migrate_archives,
+    _migrate_rollups,
+]
+
+
+def _migrate(conn: sqlite3.Connection) -> None:
+    """Bring the database up to date, one transaction per migration.
+
+    In WAL mode readers keep seeing the previous schema until a migration
+    commits, so a running process is never shown a half-converted table.
+    """
+    (version,) = conn.execute("PRAGMA user_version").fetchone()
+    if version == 0:
+        conn.executescript(_BASE_SCHEMA)
+    for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            migration(conn)
+            conn.execute(f"PRAGMA user_version = {number}")
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+
+
+def init_db() -> None:
+    with _writer_lock:
+        conn = _writer()
+        _migrate(conn)
+        _categories.load(conn)
+        _sources.load(conn)
+        _load_archives(conn)
+        _mtd.rebuild(conn)
 
 
 def add_expense(
@@ -53,92 +599,536 @@ def add_expense(
     description: str,
     source: str = "text",
 ) -> int:
-    conn = get_connection()
-    cur = conn.execute(
-        "INSERT INTO expenses (user_id, amount, category, description, source) "
-        "VALUES (?, ?, ?, ?, ?)",
-        (user_id, amount, category, description, source),
-    )
-    conn.commit()
-    expense_id = cur.lastrowid
-    conn.close()
-    return expense_id
+    now = datetime.now(tz=timezone.utc)
+    amount_minor = _to_minor(amount)
+    with _writer_lock:
+        conn = _writer()
+        category_id = _categories.ensure(conn, category)
+        source_id = _sources.ensure(conn, source)
+        with conn:
+            cur = conn.execute(
+                "INSERT INTO expenses "
+                "(user_id, amount_minor, category_id, description, source_id, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (user_id, amount_minor, category_id, description, source_id, _epoch(now)),
+            )
+            _update_rollups(conn, [(user_id, amount_minor, category_id, _epoch(now), 1)])
+        _mtd.record_expenses([(category, amount_minor)])
+        _notify_write("expenses", [now])
+        return cur.lastrowid
+
+
+def add_expenses(user_id: int, items: list[dict], source: str = "text") -> list[int]:
+    """Insert several expenses in a single transaction and return their ids.
+
+    Each item needs "amount", "category" and "description".
+    """
+    if not items:
+        return []
+    now = datetime.now(tz=timezone.utc)
+    with _writer_lock:
+        conn = _writer()
+        source_id = _sources.ensure(conn, source)
+        rows = [
+            (
+                user_id,
+                _to_minor(item["amount"]),
+                _categories.ensure(conn, item["category"]),
+                item["description"],
+                source_id,
+                _epoch(now),
+            )
+            for item in items
+        ]
+        with conn:
+            conn.executemany(
+                "INSERT INTO expenses "
+                "(user_id, amount_minor, category_id, description, source_id, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+            last_id = conn.execute("SELECT last_insert_rowid()").fetchone()[0]
+            _update_rollups(conn, [(row[0], row[1], row[2], row[5], 1) for row in rows])
+        _mtd.record_expenses([(item["category"], row[1]) for item, row in zip(items, rows)])
+        _notify_write("expenses", [now])
+    # Inserts are serialized on the writer, so the AUTOINCREMENT ids are contiguous.
+    return list(range(last_id - len(rows) + 1, last_id + 1))
 
 
 def get_monthly_total(category: str) -> float:
-    start = _now_il().replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-    conn = get_connection()
-    row = conn.execute(
-        "SELECT COALESCE(SUM(amount), 0) AS total FROM expenses "
-        "WHERE category = ? AND created_at >= ?",
-        (category, _utc_str(start)),
-    ).fetchone()
-    conn.close()
-    return row["total"]
+    return _mtd.spent(category)
 
 
 def get_budget(category: str) -> float | None:
-    conn = get_connection()
-    row = conn.execute(
-        "SELECT monthly_limit FROM budgets WHERE category = ?", (category,)
-    ).fetchone()
-    conn.close()
-    return row["monthly_limit"] if row else None
+    return _mtd.budget(category)
+
+
+def get_month_to_date(categories: list[str]) -> dict[str, tuple[float, float | None]]:
+    """Month-to-date spend and budget limit (or None) for each category."""
+    return _mtd.snapshot(categories)
+
+
+def get_budget_status() -> list[dict]:
+    """Every budget with its month-to-date spend: category, monthly_limit, spent."""
+    return _mtd.budgets()
 
 
 def set_budget(category: str, monthly_limit: float) -> None:
-    conn = get_connection()
-    conn.execute(
-        "INSERT OR REPLACE INTO budgets (category, monthly_limit, updated_at) "
-        "VALUES (?, ?, ?)",
-        (category, monthly_limit, datetime.now().isoformat()),
-    )
-    conn.commit()
-    conn.close()
+    limit_minor = _to_minor(monthly_limit)
+    with _writer_lock:
+        conn = _writer()
+        category_id = _categories.ensure(conn, category)
+        conn.execute(
+            "INSERT OR REPLACE INTO budgets (category_id, limit_minor, updated_at) "
+            "VALUES (?, ?, ?)",
+            (category_id, limit_minor, _epoch(datetime.now(tz=timezone.utc))),
+        )
+        conn.commit()
+        _mtd.record_budget(category, limit_minor)
+        _notify_write("budgets", [])
 
 
 def get_all_budgets() -> list[dict]:
-    conn = get_connection()
-    rows = conn.execute("SELECT category, monthly_limit FROM budgets").fetchall()
-    conn.close()
-    return [dict(r) for r in rows]
+    rows = _reader().execute("SELECT category_id, limit_minor FROM budgets").fetchall()
+    return [
+        {"category": _categories.name(r["category_id"]), "monthly_limit": r["limit_minor"] / 100}
+        for r in rows
+    ]
+
+
+_EXPENSE_COLUMNS = (
+    "user_id, amount_minor, category_id, description, source_id, "
+    "datetime(created_at, 'unixepoch') AS created_at"
+)
+
 
+def _expense(row: sqlite3.Row) -> dict:
+    """Decode a row selected with _EXPENSE_COLUMNS; created_at is UTC text."""
+    return {
+        "user_id": row["user_id"],
+        "amount": row["amount_minor"] / 100,
+        "category": _categories.name(row["category_id"]),
+        "description": row["description"],
+        "source": _sources.name(row["source_id"]),
+        "created_at": row["created_at"],
+    }
 
-def get_expenses_since(since: str) -> list[dict]:
-    conn = get_connection()
+
+def get_expenses_since(since: datetime) -> list[dict]:
+    conn = _reader()
     rows = conn.execute(
-        "SELECT user_id, amount, category, description, source, created_at "
-        "FROM expenses WHERE created_at >= ? ORDER BY created_at",
-        (since,),
+        f"SELECT {_EXPENSE_COLUMNS} FROM {_expenses_source(conn, since, None)} "
+        "WHERE expenses.created_at >= ? ORDER BY expenses.created_at",
+        (_epoch(since),),
     ).fetchall()
-    conn.close()
-    return [dict(r) for r in rows]
+    return [_expense(r) for r in rows]
 
 
 def get_week_expenses() -> list[dict]:
-    since = _now_il() - timedelta(days=7)
-    return get_expenses_since(_utc_str(since))
+    return get_expenses_since(_now_il() - timedelta(days=7))
 
 
 def get_month_expenses() -> list[dict]:
-    since = _now_il().replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-    return get_expenses_since(_utc_str(since))
+    return get_expenses_since(_month_start(_now_il()))
 
 
 def get_last_n_days_expenses(days: int = 90) -> list[dict]:
-    since = _now_il() - timedelta(days=days)
-    return get_expenses_since(_utc_str(since))
+    return get_expenses_since(_now_il() - timedelta(days=days))
+
+
+def get_earliest_since(since: datetime) -> datetime | None:
+    """created_at (UTC) of the oldest expense at or after since."""
+    conn = _reader()
+    row = conn.execute(
+        f"SELECT MIN(created_at) AS earliest FROM {_expenses_source(conn, since, None)} "
+        "WHERE created_at >= ?",
+        (_epoch(since),),
+    ).fetchone()
+    if row["earliest"] is None:
+        return None
+    return datetime.fromtimestamp(row["earliest"], tz=timezone.utc)
 
 
 def get_previous_week_total() -> float:
     now = _now_il()
     end = now - timedelta(days=7)
     start = end - timedelta(days=7)
-    conn = get_connection()
+    conn = _reader()
     row = conn.execute(
-        "SELECT COALESCE(SUM(amount), 0) AS total FROM expenses "
+        "SELECT COALESCE(SUM(amount_minor), 0) AS total "
+        f"FROM {_expenses_source(conn, start, end)} "
         "WHERE created_at >= ? AND created_at < ?",
-        (_utc_str(start), _utc_str(end)),
+        (_epoch(start), _epoch(end)),
     ).fetchone()
-    conn.close()
-    return row["total"]
+    return row["total"] / 100
+
+
+def _range_filter(
+    since: datetime,
+    until: datetime | None,
+    category: str | None,
+    user_id: int | None,
+) -> tuple[str, list]:
+    clauses = ["expenses.created_at >= ?"]
+    params: list = [_epoch(since)]
+    if until is not None:
+        clauses.append("expenses.created_at < ?")
+        params.append(_epoch(until))
+    if category is not None:
+        clauses.append("category_id = ?")
+        # An unknown category matches nothing.
+        params.append(_categories.id(category) or -1)
+    if user_id is not None:
+        clauses.append("user_id = ?")
+        params.append(user_id)
+    return " AND ".join(clauses), params
+
+
+def get_total(
+    since: datetime,
+    until: datetime | None,
+    category: str | None = None,
+    user_id: int | None = None,
+) -> dict:
+    """Sum and count of expenses in [since, until), optionally filtered.
+
+    until=None means no upper bound.
+    """
+    where, params = _range_filter(since, until, category, user_id)
+    conn = _reader()
+    row = conn.execute(
+        "SELECT COALESCE(SUM(amount_minor), 0) AS total, COUNT(*) AS count "
+        f"FROM {_expenses_source(conn, since, until)} WHERE {where}",
+        params,
+    ).fetchone()
+    return {"total": row["total"] / 100, "count": row["count"]}
+
+
+def get_category_totals(
+    since: datetime, until: datetime | None, user_id: int | None = None
+) -> list[dict]:
+    """Per-category sums in [since, until), largest first."""
+    where, params = _range_filter(since, until, None, user_id)
+    conn = _reader()
+    rows = conn.execute(
+        "SELECT category_id, SUM(amount_minor) AS total, COUNT(*) AS count "
+        f"FROM {_expenses_source(conn, since, until)} WHERE {where} GROUP BY +category_id",
+        params,
+    ).fetchall()
+    # A dozen groups at most; sorting here keeps a temp B-tree out of the plan.
+    rows.sort(key=lambda r: r["total"], reverse=True)
+    return [
+        {
+            "category": _categories.name(r["category_id"]),
+            "total": r["total"] / 100,
+            "count": r["count"],
+        }
+        for r in rows
+    ]
+
+
+def get_largest_expenses(
+    since: datetime,
+    until: datetime | None,
+    limit: int = 5,
+    category: str | None = None,
+    user_id: int | None = None,
+) -> list[dict]:
+    """The largest single expenses in [since, until)."""
+    where, params = _range_filter(since, until, category, user_id)
+    conn = _reader()
+    rows = conn.execute(
+        f"SELECT {_EXPENSE_COLUMNS} "
+        f"FROM {_expenses_source(conn, since, until)} WHERE {where} "
+        "ORDER BY amount_minor DESC LIMIT ?",
+        [*params, limit],
+    ).fetchall()
+    return [_expense(r) for r in rows]
+
+
+def get_daily_totals(since: datetime) -> list[dict]:
+    """Sums per UTC day, category and user since the given time."""
+    conn = _reader()
+    rows = conn.execute(
+        "SELECT date(created_at, 'unixepoch') AS day, category_id, user_id, "
+        "SUM(amount_minor) AS total, COUNT(*) AS count "
+        f"FROM {_expenses_source(conn, since, None)} WHERE created_at >= ? "
+        "GROUP BY day, category_id, user_id ORDER BY day, category_id, user_id",
+        (_epoch(since),),
+    ).fetchall()
+    return [
+        {
+            "day": r["day"],
+            "category": _categories.name(r["category_id"]),
+            "user_id": r["user_id"],
+            "total": r["total"] / 100,
+            "count": r["count"],
+        }
+        for r in rows
+    ]
+
+
+def get_rollups(
+    grain: str, since: date, until: date | None = None, user_id: int | None = None
+) -> list[dict]:
+    """Totals per period and category for periods starting in [since, until).
+
+    grain is one of ROLLUP_GRAINS and the bounds are local dates. Reads the
+    rollup table only, so the cost depends on the number of periods, not of
+    expenses, and archived years need no attaching. Oldest period first.
+    """
+    clauses = ["grain = ?", "period >= ?"]
+    params: list = [grain, since.isoformat()]
+    if until is not None:
+        clauses.append("period < ?")
+        params.append(until.isoformat())
+    if user_id is not None:
+        clauses.append("user_id = ?")
+        params.append(user_id)
+    rows = _reader().execute(
+        "SELECT period, category_id, SUM(total_minor) AS total, SUM(count) AS count "
+        f"FROM rollups WHERE {' AND '.join(clauses)} GROUP BY period, category_id",
+        params,
+    ).fetchall()
+    return [
+        {
+            "period": date.fromisoformat(r["period"]),
+            "category": _categories.name(r["category_id"]),
+            "total": r["total"] / 100,
+            "count": r["count"],
+        }
+        for r in rows
+    ]
+
+
+def get_top_descriptions(since: datetime, limit: int = 20) -> list[dict]:
+    """Most expensive descriptions (case-insensitive) since the given time."""
+    conn = _reader()
+    rows = conn.execute(
+        "SELECT MIN(description) AS description, category_id, "
+        "SUM(amount_minor) AS total, COUNT(*) AS count "
+        f"FROM {_expenses_source(conn, since, None)} WHERE created_at >= ? "
+        "GROUP BY lower(description), category_id ORDER BY total DESC LIMIT ?",
+        (_epoch(since), limit),
+    ).fetchall()
+    return [
+        {
+            "description": r["description"],
+            "category": _categories.name(r["category_id"]),
+            "total": r["total"] / 100,
+            "count": r["count"],
+        }
+        for r in rows
+    ]
+
+
+def get_expenses(
+    since: datetime,
+    until: datetime | None,
+    category: str | None = None,
+    user_id: int | None = None,
+    limit: int = 200,
+) -> list[dict]:
+    """Expenses in [since, until), newest first."""
+    where, params = _range_filter(since, until, category, user_id)
+    conn = _reader()
+    rows = conn.execute(
+        f"SELECT {_EXPENSE_COLUMNS} "
+        f"FROM {_expenses_source(conn, since, until)} WHERE {where} "
+        "ORDER BY expenses.created_at DESC LIMIT ?",
+        [*params, limit],
+    ).fetchall()
+    return [_expense(r) for r in rows]
+
+
+def iter_expenses(
+    since: datetime | None, until: datetime | None, chunk_size: int = 1000
+) -> Iterator[list[dict]]:
+    """Expenses in [since, until), oldest first, in lists of up to chunk_size.
+
+    Archived years are read from their files one after another, then the hot
+    table, each through a cursor on a connection of its own, so a long export
+    never holds a pooled reader and never has the whole range in memory.
+    """
+    clauses, params = [], []
+    if since is not None:
+        clauses.append("created_at >= ?")
+        params.append(_epoch(since))
+    if until is not None:
+        clauses.append("created_at < ?")
+        params.append(_epoch(until))
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+    for path in [path for _, path in _archived_years(since, until)] + [DB_PATH]:
+        conn = get_connection(path)
+        conn.execute("PRAGMA query_only=ON")
+        try:
+            cur = conn.execute(
+                f"SELECT {_EXPENSE_COLUMNS} FROM expenses {where} ORDER BY expenses.created_at",
+                params,
+            )
+            while rows := cur.fetchmany(chunk_size):
+                yield [_expense(r) for r in rows]
+        finally:
+            conn.close()
+
+
+def import_expenses(
+    user_id: int, items: list[dict], source: str, imported: Counter
+) -> tuple[int, int]:
+    """Insert dated items in one transaction, skipping ones already recorded.
+
+    Each item needs "amount", "category", "description" and "created_at"
+    (aware datetime). An item is a duplicate when an existing expense falls on
+    the same local day with the same amount. imported counts, per (day,
+    amount_minor), the rows earlier batches of the same import have inserted,
+    so that repeated purchases within one statement are all kept.
+    Returns (inserted, skipped).
+    """
+    if not items:
+        return 0, 0
+    keyed = [
+        ((item["created_at"].astimezone(ISRAEL_TZ).date(), _to_minor(item["amount"])), item)
+        for item in items
+    ]
+    first = min(item["created_at"] for item in items).astimezone(ISRAEL_TZ)
+    last = max(item["created_at"] for item in items).astimezone(ISRAEL_TZ)
+    day_start = first.replace(hour=0, minute=0, second=0, microsecond=0)
+    day_end = last.replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1)
+    month_start = _epoch(_month_start(_now_il()))
+
+    with _writer_lock:
+        conn = _writer()
+        source_id = _sources.ensure(conn, source)
+        category_ids = {
+            item["category"]: _categories.ensure(conn, item["category"]) for item in items
+        }
+        existing = Counter(
+            (datetime.fromtimestamp(r["created_at"], tz=ISRAEL_TZ).date(), r["amount_minor"])
+            for r in conn.execute(
+                "SELECT created_at, amount_minor "
+                f"FROM {_expenses_source(conn, day_start, day_end)} "
+                "WHERE created_at >= ? AND created_at < ?",
+                (_epoch(day_start), _epoch(day_end)),
+            )
+        )
+        existing.subtract(imported)
+        rows = []
+        for key, item in keyed:
+            if existing[key] > 0:
+                existing[key] -= 1
+                continue
+            imported[key] += 1
+            rows.append((
+                user_id,
+                key[1],
+                category_ids[item["category"]],
+                item["description"],
+                source_id,
+                _epoch(item["created_at"]),
+            ))
+        if rows:
+            with conn:
+                conn.executemany(
+                    "INSERT INTO expenses "
+                    "(user_id, amount_minor, category_id, description, source_id, created_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    rows,
+                )
+                _update_rollups(conn, [(row[0], row[1], row[2], row[5], 1) for row in rows])
+            _mtd.record_expenses([
+                (_categories.name(row[2]), row[1]) for row in rows if row[5] >= month_start
+            ])
+            _notify_write(
+                "expenses",
+                sorted({datetime.fromtimestamp(row[5], tz=timezone.utc) for row in rows}),
+            )
+    return len(rows), len(items) - len(rows)
+
+
+def archive_closed_years(now: datetime | None = None) -> list[int]:
+    """Move years that ended over ARCHIVE_AFTER_DAYS ago into their own files.
+
+    Each year goes to <archive dir>/<year>.db, a month per transaction, so
+    the writer lock is only held briefly. Rows keep their ids; a year that
+    is already archived (e.g. after a late statement import) gets the new
+    rows appended. Safe to re-run after a crash. Returns the years moved.
+    """
+    now = now or _now_il()
+    cutoff = (now - timedelta(days=ARCHIVE_AFTER_DAYS)).year
+    with _writer_lock:
+        row = _writer().execute("SELECT MIN(created_at) AS first FROM expenses").fetchone()
+    if row["first"] is None:
+        return []
+    first = datetime.fromtimestamp(row["first"], tz=ISRAEL_TZ).year
+
+    moved_years = []
+    for year in range(first, cutoff):
+        if _archive_year(year):
+            moved_years.append(year)
+    if moved_years:
+        with _writer_lock:
+            conn = _writer()
+            # VACUUM attaches a temporary database of its own, so it needs a
+            # free slot; _attach() brings the archives back when queried.
+            for row in conn.execute("PRAGMA database_list").fetchall():
+                if row["name"] not in ("main", "temp"):
+                    conn.execute(f"DETACH DATABASE {row['name']}")
+            conn.execute("VACUUM main")
+    return moved_years
+
+
+def _archive_year(year: int) -> int:
+    start, end = _year_start(year), _year_start(year + 1)
+    with _writer_lock:
+        conn = _writer()
+        if conn.execute(
+            "SELECT 1 FROM expenses WHERE created_at >= ? AND created_at < ? LIMIT 1",
+            (_epoch(start), _epoch(end)),
+        ).fetchone() is None:
+            return 0
+        _archive_dir().mkdir(parents=True, exist_ok=True)
+        path = _archive_dir() / f"{year}.db"
+        (alias,) = _attach(conn, [(year, path)])
+        conn.execute(f"PRAGMA {alias}.journal_mode=WAL")
+        for statement in _ARCHIVE_SCHEMA:
+            conn.execute(statement.format(alias=alias))
+        conn.commit()
+    # Readers union the archive in from now on: a moved row is in one of
+    # the two files whichever side of a month's commit they read.
+    with _archives_lock:
+        _archives[year] = path
+
+    moved = 0
+    month = start
+    while month < end:
+        next_month = _month_start(month + timedelta(days=32))
+        bounds = (_epoch(month), _epoch(next_month))
+        with _writer_lock:
+            conn = _writer()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute(
+                    f"INSERT OR IGNORE INTO {alias}.expenses ({_ROW_COLUMNS}) "
+                    f"SELECT {_ROW_COLUMNS} FROM main.expenses "
+                    "WHERE created_at >= ? AND created_at < ?",
+                    bounds,
+                )
+                count = conn.execute(
+                    "DELETE FROM main.expenses WHERE created_at >= ? AND created_at < ?",
+                    bounds,
+                ).rowcount
+                conn.execute(
+                    "INSERT INTO archives (year, file, rows, archived_at) "
+                    f"VALUES (?, ?, ?, {_NOW_EPOCH}) "
+                    "ON CONFLICT (year) DO UPDATE SET "
+                    "rows = rows + excluded.rows, archived_at = excluded.archived_at",
+                    (year, path.name, count),
+                )
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+        moved += count
+        month = next_month
+    logger.info("Archived %d expenses from %d to %s", moved, year, path)
+    return moved
@@ -0,0 +1,186 @@
+"""Awaitable wrappers around db.py.
+
+Reads run on a small thread pool, each worker holding its own long-lived
+reader connection. Writes go through a single-threaded executor so they are
+serialized on the dedicated writer connection and never block the event loop.
+"""
+import asyncio
+import functools
+from collections import Counter
+from collections.abc import AsyncIterator, Iterator
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+
+import db
+from metrics import span
+
+READ_WORKERS = 4
+
+_read_pool = ThreadPoolExecutor(max_workers=READ_WORKERS, thread_name_prefix="db-read")
+_write_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-write")
+# Archiving runs for minutes; its own thread keeps writes from queueing behind
+# it, and db._writer_lock still serializes them month by month.
+_archive_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-archive")
+
+
+async def _run(pool: ThreadPoolExecutor, fn, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    with span(f"db.{fn.__name__}"):
+        return await loop.run_in_executor(pool, functools.partial(fn, *args, **kwargs))
+
+
+async def _read(fn, *args, **kwargs):
+    return await _run(_read_pool, fn, *args, **kwargs)
+
+
+async def _write(fn, *args, **kwargs):
+    return await _run(_write_pool, fn, *args, **kwargs)
+
+
+async def init_db() -> None:
+    await _write(db.init_db)
+
+
+async def add_expense(
+    user_id: int,
+    amount: float,
+    category: str,
+    description: str,
+    source: str = "text",
+) -> int:
+    return await _write(db.add_expense, user_id, amount, category, description, source)
+
+
+async def add_expenses(user_id: int, items: list[dict], source: str = "text") -> list[int]:
+    return await _write(db.add_expenses, user_id, items, source)
+
+
+async def get_monthly_total(category: str) -> float:
+    return await _read(db.get_monthly_total, category)
+
+
+async def get_budget(category: str) -> float | None:
+    return await _read(db.get_budget, category)
+
+
+async def get_month_to_date(categories: list[str]) -> dict[str, tuple[float, float | None]]:
+    return await _read(db.get_month_to_date, categories)
+
+
+async def get_budget_status() -> list[dict]:
+    return await _read(db.get_budget_status)
+
+
+async def set_budget(category: str, monthly_limit: float) -> None:
+    await _write(db.set_budget, category, monthly_limit)
+
+
+async def get_all_budgets() -> list[dict]:
+    return await _read(db.get_all_budgets)
+
+
+async def get_expenses_since(since: datetime) -> list[dict]:
+    return await _read(db.get_expenses_since, since)
+
+
+async def get_week_expenses() -> list[dict]:
+    return await _read(db.get_week_expenses)
+
+
+async def get_month_expenses() -> list[dict]:
+    return await _read(db.get_month_expenses)
+
+
+async def get_last_n_days_expenses(days: int = 90) -> list[dict]:
+    return await _read(db.get_last_n_days_expenses, days)
+
+
+async def get_earliest_since(since: datetime) -> datetime | None:
+    return await _read(db.get_earliest_since, since)
+
+
+async def get_previous_week_total() -> float:
+    return await _read(db.get_previous_week_total)
+
+
+async def get_total(
+    since: datetime,
+    until: datetime | None,
+    category: str | None = None,
+    user_id: int | None = None,
+) -> dict:
+    return await _read(db.get_total, since, until, category, user_id)
+
+
+async def get_category_totals(
+    since: datetime, until: datetime | None, user_id: int | None = None
+) -> list[dict]:
+    return await _read(db.get_category_totals, since, until, user_id)
+
+
+async def get_largest_expenses(
+    since: datetime,
+    until: datetime | None,
+    limit: int = 5,
+    category: str | None = None,
+    user_id: int | None = None,
+) -> list[dict]:
+    return await _read(db.get_largest_expenses, since, until, limit, category, user_id)
+
+
+async def get_daily_totals(since: datetime) -> list[dict]:
+    return await _read(db.get_daily_totals, since)
+
+
+async def get_rollups(
+    grain: str, since: date, until: date | None = None, user_id: int | None = None
+) -> list[dict]:
+    return await _read(db.get_rollups, grain, since, until, user_id)
+
+
+async def get_top_descriptions(since: datetime, limit: int = 20) -> list[dict]:
+    return await _read(db.get_top_descriptions, since, limit)
+
+
+async def get_expenses(
+    since: datetime,
+    until: datetime | None,
+    category: str | None = None,
+    user_id: int | None = None,
+    limit: int = 200,
+) -> list[dict]:
+    return await _read(db.get_expenses, since, until, category, user_id, limit)
+
+
+def _next_chunk(chunks: Iterator[list[dict]]) -> list[dict] | None:
+    return next(chunks, None)
+
+
+async def iter_expenses(
+    since: datetime | None, until: datetime | None, chunk_size: int = 1000
+) -> AsyncIterator[list[dict]]:
+    """Chunks of db.iter_expenses, each fetched on the read pool."""
+    chunks = db.iter_expenses(since, until, chunk_size)
+    try:
+        while (chunk := await _read(_next_chunk, chunks)) is not None:
+            yield chunk
+    finally:
+        await _read(chunks.close)
+
+
+async def import_expenses(
+    user_id: int, items: list[dict], source: str, imported: Counter
+) -> tuple[int, int]:
+    return await _write(db.import_expenses, user_id, items, source, imported)
+
+
+async def archive_closed_years() -> list[int]:
+    return await _run(_archive_pool, db.archive_closed_years)
+
+
+def shutdown() -> None:
+    """Drain the pools and close the writer connection."""
+    _read_pool.shutdown(wait=True)
+    _write_pool.shutdown(wait=True)
+    _archive_pool.shutdown(wait=True)
+    db.close_connections()
@@ -0,0 +1,52 @@
+import logging
+import tempfile
+from pathlib import Path
+
+from telegram import Update
+from telegram.ext import ContextTypes
+
+from metrics import span, traced
+from middleware import authorized, notify_others
+from services.bank_import import StatementError, import_statement
+
+logger = logging.getLogger(__name__)
+
+# Telegram doesn't let bots download files larger than this.
+MAX_DOWNLOAD_BYTES = 20 * 1024 * 1024
+
+
+@authorized
+@traced("document")
+async def handle_statement(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Import a bank or credit-card statement sent as a CSV document."""
+    document = update.message.document
+    if document.file_size and document.file_size > MAX_DOWNLOAD_BYTES:
+        await update.message.reply_text("Файл слишком большой: Telegram отдаёт ботам до 20 МБ.")
+        return
+
+    progress = await update.message.reply_text("📥 Импортирую выписку...")
+    user_id = update.effective_user.id
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "statement.csv"
+        with span("telegram.download"):
+            file = await context.bot.get_file(document.file_id)
+            await file.download_to_drive(path)
+        try:
+            summary = await import_statement(path, user_id)
+        except StatementError as e:
+            await progress.edit_text(f"Не удалось прочитать выписку: {e}.")
+            return
+
+    lines = [
+        f"📥 Выписка: {summary['rows']} строк",
+        f"✅ Добавлено трат: {summary['inserted']}",
+        f"🔁 Уже были записаны: {summary['duplicates']}",
+    ]
+    if summary["income"]:
+        lines.append(f"↩️ Поступления и возвраты пропущены: {summary['income']}")
+    if summary["unparsed"]:
+        lines.append(f"⚠️ Не распознано строк: {summary['unparsed']}")
+    await progress.edit_text("\n".join(lines))
+    if summary["inserted"]:
+        name = update.effective_user.first_name
+        notify_others(user_id, f"👤 {name} импортировал(а) выписку: {summary['inserted']} трат")
@@ -1,8 +1,16 @@
 from telegram import Update
 from telegram.ext import ContextTypes
 
+from config import ADMIN_USER_IDS, CATEGORIES
+from metrics import render_summary, traced
 from middleware import authorized
-from reports import build_week_report, build_month_report, build_budget_report
+from reports import (
+    build_budget_report,
+    build_month_report,
+    build_trend_report,
+    build_week_report,
+    build_year_report,
+)
 
 
 WIFE_USER_ID = 6783217385
@@ -21,25 +29,78 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         "Команды:\n"
         "/week — отчёт за неделю\n"
         "/month — отчёт за месяц\n"
+        "/year — год по месяцам и категориям против прошлого\n"
+        "/trend [недели] [категория] — динамика за 12 месяцев или недель\n"
         "/budget — статус бюджетов\n"
-        "/setbudget — установить лимит на категорию\n\n"
-        "Также можешь задать вопрос о расходах в свободной форме."
+        "/setbudget — установить лимит на категорию\n"
+        "/export — выгрузить траты в CSV или JSONL\n\n"
+        "Также можешь задать вопрос о расходах в свободной форме "
+        "или прислать CSV-выписку банка для импорта."
     )
 
 
 @authorized
+@traced("command")
 async def week(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    report = build_week_report()
+    report = await build_week_report()
     await update.message.reply_text(report, parse_mode="Markdown")
 
 
 @authorized
+@traced("command")
 async def month(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    report = build_month_report()
+    report = await build_month_report()
     await update.message.reply_text(report, parse_mode="Markdown")
 
 
 @authorized
+@traced("command")
+async def year(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    report = await build_year_report()
+    await update.message.reply_text(report, parse_mode="Markdown")
+
+
+def _find_category(name: str) -> str | None:
+    """The category named exactly (ignoring case), else the only one starting with name."""
+    name = name.lower()
+    for category in CATEGORIES:
+        if category.lower() == name:
+            return category
+    matches = [c for c in CATEGORIES if c.lower().startswith(name)]
+    return matches[0] if len(matches) == 1 else None
+
+
+@authorized
+@traced("command")
+async def trend(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """/trend [недели] [категория]: monthly (or weekly) totals for the last year."""
+    args = list(context.args or [])
+    grain = "month"
+    if args and args[0].lower() in ("недели", "нед", "weeks"):
+        grain = "week"
+        args = args[1:]
+    category = None
+    if args:
+        category = _find_category(" ".join(args))
+        if category is None:
+            await update.message.reply_text(
+                "Не знаю такой категории. Есть: " + ", ".join(CATEGORIES)
+            )
+            return
+    report = await build_trend_report(grain, category)
+    await update.message.reply_text(report, parse_mode="Markdown")
+
+
+@authorized
+@traced("command")
 async def budget(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    report = build_budget_report()
+    report = await build_budget_report()
     await update.message.reply_text(report, parse_mode="Markdown")
+
+
+@authorized
+async def stats(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Per-stage latency percentiles and cache/queue counters (admins only)."""
+    if update.effective_user.id not in ADMIN_USER_IDS:
+        return
+    await update.message.reply_text(render_summary())
@@ -1,88 +1,179 @@
+import asyncio
 import logging
 
-from telegram import Update
+from telegram import Message, Update
 from telegram.ext import ContextTypes
 
-import db
+import db_async
+from coalescer import Coalescer
+from metrics import span, traced
 from middleware import authorized, notify_others
-from reports import format_expense_feedback
-from services.ai_parser import parse_expense_text
+from reports import format_batch_feedback, format_expense_feedback
+from services import media_cache
+from services.ai_parser import parse_expense_offline, parse_expense_text, parse_expense_texts
 from services.whisper import transcribe_voice
 from handlers.question import handle_question
 
 logger = logging.getLogger(__name__)
 
 
+# Text messages that need the LLM are held this long after the user's latest
+# one (at most MAX_BURST_SECONDS in all), so a quick burst costs one request.
+BURST_WINDOW_SECONDS = 1.5
+MAX_BURST_SECONDS = 4.0
+MAX_BURST_MESSAGES = 10
+# Messages the local parser won't guess at while OpenAI is down are parsed
+# again this often (longer than the circuit stays open), this many times.
+DEFERRED_RETRY_SECONDS = 60.0
+DEFERRED_ATTEMPTS = 5
+
+_deferred: set[asyncio.Task] = set()
+
+
+def _expense_line(item: dict) -> str:
+    return f"{item['category']}, {item['amount']:.0f}₽ — {item['description']}"
+
+
+async def _record(
+    user_id: int,
+    messages: list[Message],
+    texts: list[str],
+    results: list[dict | None],
+    source: str,
+    attempt: int = 0,
+) -> None:
+    """Save the expenses of parsed messages in one insert, then answer each message.
+
+    Replies quote their message when several are answered at once, or late.
+    Deferred messages are parsed again in the background.
+    """
+    items = [
+        item for result in results if result is not None and result["type"] == "expense"
+        for item in result["items"]
+    ]
+    if items:
+        await db_async.add_expenses(user_id, items, source=source)
+
+    quote = len(messages) > 1 or attempt > 0
+    deferred = []
+    for message, text, result in zip(messages, texts, results):
+        if result is not None and result["type"] == "deferred":
+            deferred.append((message, text))
+            if attempt == 0:
+                await message.reply_text(
+                    "⏳ Распознавание сейчас недоступно. Запишу, как только оно заработает.",
+                    do_quote=quote,
+                )
+        elif result is None:
+            error = (
+                "Не удалось распознать трату из голосового сообщения." if source == "voice"
+                else "Не удалось распознать сообщение. Попробуйте ещё раз."
+            )
+            await message.reply_text(error, do_quote=quote)
+        elif result["type"] == "question":
+            await handle_question(message, text, user_id)
+        else:
+            if len(result["items"]) == 1:
+                item = result["items"][0]
+                feedback = await format_expense_feedback(item["category"], item["amount"])
+            else:
+                feedback = await format_batch_feedback(result["items"])
+            with span("telegram.reply"):
+                await message.reply_text(feedback, do_quote=quote)
+
+    if items:
+        name = messages[0].from_user.first_name
+        if source == "voice":
+            name += " (голос)"
+        if len(items) == 1:
+            notify_others(user_id, f"👤 {name}: {_expense_line(items[0])}")
+        else:
+            lines = "\n".join(f"• {_expense_line(item)}" for item in items)
+            notify_others(user_id, f"👤 {name}:\n{lines}")
+
+    if deferred:
+        task = asyncio.create_task(_retry_deferred(
+            user_id, [m for m, _ in deferred], [t for _, t in deferred], source, attempt + 1
+        ))
+        _deferred.add(task)
+        task.add_done_callback(_deferred.discard)
+
+
+async def _retry_deferred(
+    user_id: int, messages: list[Message], texts: list[str], source: str, attempt: int
+) -> None:
+    """Parse deferred messages again later; give up after DEFERRED_ATTEMPTS."""
+    await asyncio.sleep(DEFERRED_RETRY_SECONDS)
+    try:
+        results = await parse_expense_texts(texts)
+        if attempt >= DEFERRED_ATTEMPTS:
+            results = [None if r is not None and r["type"] == "deferred" else r for r in results]
+        await _record(user_id, messages, texts, results, source, attempt)
+    except Exception:
+        logger.exception("Retrying %d deferred message(s) failed", len(messages))
+
+
+@traced("text_burst")
+async def _flush_texts(user_id: int, burst: list[tuple[Message, bool]]) -> None:
+    messages = [message for message, _ in burst]
+    texts = [message.text.strip() for message in messages]
+    checked = [i for i, (_, offline_missed) in enumerate(burst) if offline_missed]
+    results = await parse_expense_texts(texts, skip_offline=checked)
+    await _record(user_id, messages, texts, results, "text")
+
+
+# Each message is queued with whether parse_expense_offline already missed it.
+text_bursts: Coalescer[int, tuple[Message, bool]] = Coalescer(
+    _flush_texts, BURST_WINDOW_SECONDS, MAX_BURST_SECONDS, MAX_BURST_MESSAGES
+)
+
+
 @authorized
+@traced("text")
 async def handle_text_expense(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Handle plain text messages: parse as expense or question."""
+    """Handle plain text messages: parse as expenses or a question.
+
+    Messages the local parser or the parse cache resolve are answered right
+    away; the others are coalesced per user and parsed in one LLM request.
+    """
     text = update.message.text.strip()
     if not text:
         return
 
-    result = await parse_expense_text(text)
-    if result is None:
-        await update.message.reply_text("Не удалось распознать сообщение. Попробуйте ещё раз.")
+    user_id = update.effective_user.id
+    if text_bursts.busy(user_id):
+        text_bursts.add(user_id, (update.message, False))
         return
-
-    if result["type"] == "question":
-        answer = await handle_question(text)
-        await update.message.reply_text(answer)
+    result = await parse_expense_offline(text)
+    if result is not None:
+        await _record(user_id, [update.message], [text], [result], "text")
         return
-
-    user_id = update.effective_user.id
-    db.add_expense(
-        user_id=user_id,
-        amount=result["amount"],
-        category=result["category"],
-        description=result["description"],
-        source="text",
-    )
-    feedback = format_expense_feedback(result["category"], result["amount"])
-    await update.message.reply_text(feedback)
-    name = update.effective_user.first_name
-    await notify_others(
-        context.bot, user_id,
-        f"👤 {name}: {result['category']}, {result['amount']:.0f}₽ — {result['description']}"
-    )
+    text_bursts.add(user_id, (update.message, True))
 
 
 @authorized
+@traced("voice")
 async def handle_voice(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handle voice messages: transcribe → parse → save."""
     voice = update.message.voice
-    file = await context.bot.get_file(voice.file_id)
-    voice_bytes = await file.download_as_bytearray()
+    cached = await media_cache.lookup("voice", unique_id=voice.file_unique_id)
+    if cached is None:
+        with span("telegram.download"):
+            file = await context.bot.get_file(voice.file_id)
+            voice_bytes = bytes(await file.download_as_bytearray())
+        digest = media_cache.content_hash(voice_bytes)
+        cached = await media_cache.lookup("voice", digest=digest)
 
-    transcription = await transcribe_voice(bytes(voice_bytes))
-    if transcription is None:
-        await update.message.reply_text("Не удалось распознать голосовое сообщение.")
-        return
+    if cached is not None:
+        transcription = cached["result"]
+    else:
+        transcription = await transcribe_voice(voice_bytes)
+        if transcription is None:
+            await update.message.reply_text("Не удалось распознать голосовое сообщение.")
+            return
+        await media_cache.store("voice", transcription, voice.file_unique_id, digest)
 
     await update.message.reply_text(f"🎤 _{transcription}_", parse_mode="Markdown")
 
     result = await parse_expense_text(transcription)
-    if result is None:
-        await update.message.reply_text("Не удалось распознать трату из голосового сообщения.")
-        return
-
-    if result["type"] == "question":
-        answer = await handle_question(transcription)
-        await update.message.reply_text(answer)
-        return
-
-    user_id = update.effective_user.id
-    db.add_expense(
-        user_id=user_id,
-        amount=result["amount"],
-        category=result["category"],
-        description=result["description"],
-        source="voice",
-    )
-    feedback = format_expense_feedback(result["category"], result["amount"])
-    await update.message.reply_text(feedback)
-    name = update.effective_user.first_name
-    await notify_others(
-        context.bot, user_id,
-        f"👤 {name} (голос): {result['category']}, {result['amount']:.0f}₽ — {result['description']}"
-    )
+    await _record(update.effective_user.id, [update.message], [transcription], [result], "voice")
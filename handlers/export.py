@@ -0,0 +1,59 @@
+from datetime import datetime, timedelta
+
+from telegram import Update
+from telegram.ext import ContextTypes
+
+from config import ISRAEL_TZ
+from metrics import span, traced
+from middleware import authorized
+from services.export import FORMATS, export_expenses
+
+USAGE = (
+    "Использование: /export [с] [по] [csv|jsonl]\n"
+    "Даты в формате ДД.ММ.ГГГГ или ГГГГ-ММ-ДД, обе включительно.\n"
+    "Например: /export 01.01.2025 31.03.2025 jsonl"
+)
+
+
+def _parse_day(token: str) -> datetime | None:
+    for fmt in ("%d.%m.%Y", "%Y-%m-%d"):
+        try:
+            return datetime.strptime(token, fmt).replace(tzinfo=ISRAEL_TZ)
+        except ValueError:
+            continue
+    return None
+
+
+@authorized
+@traced("command")
+async def export(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Send expenses for a date range as a CSV or JSON Lines document."""
+    fmt = "csv"
+    days = []
+    for token in context.args or []:
+        if token.lower() in FORMATS:
+            fmt = token.lower()
+        elif (day := _parse_day(token)) is not None:
+            days.append(day)
+        else:
+            await update.message.reply_text(USAGE)
+            return
+    if len(days) > 2:
+        await update.message.reply_text(USAGE)
+        return
+
+    since = days[0] if days else None
+    until = days[1] + timedelta(days=1) if len(days) == 2 else None
+    document, count = await export_expenses(since, until, fmt)
+    with document:
+        if count == 0:
+            await update.message.reply_text("За этот период трат нет.")
+            return
+        first = f"{since:%Y%m%d}" if since else "start"
+        last = f"{until - timedelta(days=1):%Y%m%d}" if until else "now"
+        with span("telegram.upload"):
+            await update.message.reply_document(
+                document=document,
+                filename=f"expenses_{first}_{last}.{fmt}",
+                caption=f"📤 Экспорт: {count} трат",
+            )
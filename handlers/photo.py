@@ -1,53 +1,91 @@
 import logging
+import re
+import time
+from datetime import datetime
 
 from telegram import Update
 from telegram.ext import ContextTypes
 
-import db
+import db_async
+from metrics import span, traced
+from config import ISRAEL_TZ
 from middleware import authorized, notify_others
-from reports import format_expense_feedback
+from reports import format_batch_feedback
+from services import media_cache
 from services.ai_parser import parse_receipt_photo
+from services.image_prep import choose_photo_size, prepare_receipt
+from streaming import ProgressiveMessage
 
 logger = logging.getLogger(__name__)
 
 
 @authorized
+@traced("photo")
 async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Handle receipt photos: parse via Claude Vision → save items."""
-    photo = update.message.photo[-1]  # highest resolution
-    file = await context.bot.get_file(photo.file_id)
-    image_bytes = await file.download_as_bytearray()
+    """Handle receipt photos: parse via Claude Vision → save items.
 
-    await update.message.reply_text("🔍 Анализирую чек...")
+    Receipts seen before (same Telegram file or same bytes) reuse the cached
+    parse, and ones already saved are flagged instead of being counted twice.
+    """
+    photo = choose_photo_size(update.message.photo)
+    cached = await media_cache.lookup("receipt", unique_id=photo.file_unique_id)
+    digest = None
+    if cached is None:
+        with span("telegram.download"):
+            file = await context.bot.get_file(photo.file_id)
+            raw_bytes = bytes(await file.download_as_bytearray())
+        digest = media_cache.content_hash(raw_bytes)
+        cached = await media_cache.lookup("receipt", digest=digest)
+
+    if cached is not None and cached["recorded_at"] is not None:
+        recorded = datetime.fromtimestamp(cached["recorded_at"], tz=ISRAEL_TZ)
+        await update.message.reply_text(
+            f"⚠️ Этот чек уже был добавлен {recorded:%d.%m.%Y %H:%M}. "
+            "Повторно не сохраняю."
+        )
+        return
+
+    progress = await ProgressiveMessage.send(update.message, "🔍 Анализирую чек...", "Receipt")
+    if cached is not None:
+        items = cached["result"]
+    else:
+        image_bytes = await prepare_receipt(raw_bytes)
+
+        async def show_found_items(raw: str) -> None:
+            found = re.findall(r'"description"\s*:\s*"([^"]*)"', raw)
+            if found:
+                await progress.update(
+                    "🔍 Анализирую чек...\n" + "\n".join(f"• {d}" for d in found)
+                )
+
+        started = time.perf_counter()
+        items = await parse_receipt_photo(image_bytes, on_progress=show_found_items)
+        logger.info(
+            "Receipt %dx%d parsed in %.1fs from %d bytes: %s items",
+            photo.width, photo.height, time.perf_counter() - started, len(image_bytes),
+            "no" if items is None else len(items),
+        )
 
-    items = await parse_receipt_photo(bytes(image_bytes))
     if items is None:
-        await update.message.reply_text("Не удалось распознать чек. Попробуйте другое фото.")
+        await progress.finish("Не удалось распознать чек. Попробуйте другое фото.", parse_mode=None)
         return
 
     if not items:
-        await update.message.reply_text("На фото не найдено позиций чека.")
+        await media_cache.store("receipt", items, photo.file_unique_id, digest)
+        await progress.finish("На фото не найдено позиций чека.", parse_mode=None)
         return
 
     user_id = update.effective_user.id
-    feedback_lines = []
-    for item in items:
-        db.add_expense(
-            user_id=user_id,
-            amount=item["amount"],
-            category=item["category"],
-            description=item["description"],
-            source="photo",
-        )
-        feedback_lines.append(
-            format_expense_feedback(item["category"], item["amount"])
-        )
+    await db_async.add_expenses(user_id, items, source="photo")
+    await media_cache.store("receipt", items, photo.file_unique_id, digest, recorded=True)
+    feedback = await format_batch_feedback(items)
 
     total = sum(item["amount"] for item in items)
     header = f"🧾 Распознано позиций: {len(items)}, итого: {total:.0f}₽\n"
-    await update.message.reply_text(header + "\n".join(feedback_lines))
+    with span("telegram.reply"):
+        await progress.finish(header + feedback, parse_mode=None)
     name = update.effective_user.first_name
-    await notify_others(
-        context.bot, user_id,
+    notify_others(
+        user_id,
         f"👤 {name} добавил(а) чек: {len(items)} поз., итого {total:.0f}₽"
     )
@@ -1,19 +1,151 @@
-import db
+import logging
+import re
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from telegram import Message
+
+import db_async
+from analytics import answer_locally, resolve_period
+from config import ISRAEL_TZ
+from metrics import span
 from services.ai_parser import answer_question
+from services.local_parser import match_category
+from streaming import ProgressiveMessage
+
+logger = logging.getLogger(__name__)
+
+HISTORY_DAYS = 90
+DAILY_DAYS = 14
+CONTEXT_TOKEN_BUDGET = 3000
+
+
+def _estimate_tokens(text: str) -> int:
+    """Rough token count; Cyrillic text averages about 3 characters per token."""
+    return len(text) // 3 + 1
+
+
+def _user_label(uid: int, asker_id: int | None) -> str:
+    return "я" if uid == asker_id else f"член семьи {uid}"
+
+
+def _aggregate_sections(
+    daily: list[dict], top: list[dict], asker_id: int | None, today: str
+) -> list[str]:
+    """Summary tables, most general first, so that truncation drops the detail."""
+    by_category: dict[str, float] = defaultdict(float)
+    by_user: dict[int, float] = defaultdict(float)
+    weekly: dict[tuple[str, str], float] = defaultdict(float)
+    recent: dict[tuple[str, str], float] = defaultdict(float)
+    recent_since = (
+        datetime.fromisoformat(today) - timedelta(days=DAILY_DAYS)
+    ).date().isoformat()
+    count = 0
+    for r in daily:
+        by_category[r["category"]] += r["total"]
+        by_user[r["user_id"]] += r["total"]
+        week = datetime.fromisoformat(r["day"]).strftime("%G-W%V")
+        weekly[(week, r["category"])] += r["total"]
+        if r["day"] >= recent_since:
+            recent[(r["day"], r["category"])] += r["total"]
+        count += r["count"]
 
+    total = sum(by_category.values())
+    sections = [
+        f"Сегодня {today}. За последние {HISTORY_DAYS} дней: "
+        f"{count} трат на сумму {total:.2f}",
+        "Итого по категориям:\n" + "\n".join(
+            f"{cat} | {amt:.2f}"
+            for cat, amt in sorted(by_category.items(), key=lambda x: x[1], reverse=True)
+        ),
+        "Итого по людям:\n" + "\n".join(
+            f"{_user_label(uid, asker_id)} | {amt:.2f}" for uid, amt in by_user.items()
+        ),
+        "По неделям (неделя | категория | сумма):\n" + "\n".join(
+            f"{week} | {cat} | {amt:.2f}" for (week, cat), amt in sorted(weekly.items())
+        ),
+        f"По дням за последние {DAILY_DAYS} дней (дата | категория | сумма):\n" + "\n".join(
+            f"{day} | {cat} | {amt:.2f}" for (day, cat), amt in sorted(recent.items())
+        ),
+        "Крупнейшие статьи (описание | категория | сумма | раз):\n" + "\n".join(
+            f"{r['description']} | {r['category']} | {r['total']:.2f} | {r['count']}"
+            for r in top
+        ),
+    ]
+    return sections
 
-def _expenses_to_text(expenses: list[dict]) -> str:
-    if not expenses:
+
+async def build_context(
+    question: str, asker_id: int | None = None, budget: int = CONTEXT_TOKEN_BUDGET
+) -> str:
+    """Compact expense context for the LLM, kept under a token budget.
+
+    Aggregated tables over the last 90 days come first; raw rows are only
+    added for the category/period the question is about, newest first, until
+    the budget runs out.
+    """
+    now = datetime.now(tz=ISRAEL_TZ)
+    since = now - timedelta(days=HISTORY_DAYS)
+    daily = await db_async.get_daily_totals(since)
+    if not daily:
         return "Нет данных о расходах."
-    lines = ["Дата | Категория | Сумма | Описание"]
-    for e in expenses:
-        date = e["created_at"][:10]
-        lines.append(f"{date} | {e['category']} | {e['amount']} | {e['description']}")
-    return "\n".join(lines)
-
-
-async def handle_question(question: str) -> str:
-    """Load recent expenses and answer a question about them."""
-    expenses = db.get_last_n_days_expenses(90)
-    table = _expenses_to_text(expenses)
-    return await answer_question(question, table)
+    top = await db_async.get_top_descriptions(since)
+
+    parts: list[str] = []
+    used = 0
+    for section in _aggregate_sections(daily, top, asker_id, now.date().isoformat()):
+        cost = _estimate_tokens(section)
+        if used + cost > budget:
+            break
+        parts.append(section)
+        used += cost
+
+    q = question.lower().replace("ё", "е")
+    category = match_category(re.findall(r"[a-zа-я]+", q))
+    period = resolve_period(q, now)
+    rows = await db_async.get_expenses(period["start"], period["until"], category)
+    scope = f"{category or 'все категории'}, {period['label']}"
+    header = f"Отдельные траты ({scope}; дата | категория | сумма | описание | кто):"
+    lines = [header]
+    used += _estimate_tokens(header)
+    for e in rows:
+        line = (
+            f"{e['created_at'][:10]} | {e['category']} | {e['amount']} | "
+            f"{e['description']} | {_user_label(e['user_id'], asker_id)}"
+        )
+        cost = _estimate_tokens(line)
+        if used + cost > budget:
+            break
+        lines.append(line)
+        used += cost
+    if len(lines) > 1:
+        parts.append("\n".join(lines))
+
+    context = "\n\n".join(parts)
+    logger.info(
+        "Q&A context: %d chars, ~%d tokens (budget %d), %d/%d raw rows",
+        len(context), _estimate_tokens(context), budget, len(lines) - 1, len(rows),
+    )
+    return context
+
+
+async def handle_question(message: Message, question: str, user_id: int | None = None) -> None:
+    """Answer a question about expenses in reply to message.
+
+    Common question shapes are answered locally from SQL aggregates; anything
+    else goes to the LLM with a compact, token-budgeted context, and the answer
+    is streamed into a placeholder message.
+    """
+    with span("question.local"):
+        answer = await answer_locally(question, user_id)
+    if answer is not None:
+        with span("telegram.reply"):
+            await message.reply_text(answer)
+        return
+
+    with span("question.context"):
+        context = await build_context(question, user_id)
+    progress = await ProgressiveMessage.send(message, "🤔 Думаю...", "Q&A")
+    answer = await answer_question(question, context, on_progress=progress.update)
+    with span("telegram.reply"):
+        await progress.finish(answer)
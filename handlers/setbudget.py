@@ -9,7 +9,7 @@ from telegram.ext import (
     filters,
 )
 
-import db
+import db_async
 from config import CATEGORIES
 from middleware import authorized
 
@@ -43,7 +43,7 @@ async def category_chosen(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         return CHOOSING_CATEGORY
 
     context.user_data["budget_category"] = category
-    current = db.get_budget(category)
+    current = await db_async.get_budget(category)
     msg = f"Категория: {category}\n"
     if current is not None:
         msg += f"Текущий лимит: {current:.0f}₽\n"
@@ -64,7 +64,7 @@ async def amount_entered(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         return ENTERING_AMOUNT
 
     category = context.user_data.pop("budget_category")
-    db.set_budget(category, amount)
+    await db_async.set_budget(category, amount)
     await update.message.reply_text(
         f"✅ Бюджет установлен: {category} — {amount:.0f}₽/мес"
     )
@@ -89,4 +89,8 @@ def get_setbudget_handler() -> ConversationHandler:
             ],
         },
         fallbacks=[CommandHandler("cancel", cancel)],
+        # Conversations are keyed by chat and user; update_processor runs a
+        # chat's updates one at a time, so state changes stay in order.
+        per_chat=True,
+        per_user=True,
     )
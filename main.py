@@ -12,12 +12,28 @@ from telegram.ext import (
 )
 
 import db
-from config import ALLOWED_USER_IDS, ISRAEL_TZ, TELEGRAM_BOT_TOKEN
-from handlers.commands import budget, month, start, week
-from handlers.expense import handle_text_expense, handle_voice
+import db_async
+from config import (
+    ALLOWED_USER_IDS,
+    ISRAEL_TZ,
+    METRICS_PORT,
+    TELEGRAM_API_URL,
+    TELEGRAM_BOT_TOKEN,
+    WEBHOOK_PORT,
+    WEBHOOK_SECRET,
+    WEBHOOK_URL,
+)
+from handlers.bank_import import handle_statement
+from handlers.commands import budget, month, start, stats, trend, week, year
+from handlers.export import export
+from handlers.expense import handle_text_expense, handle_voice, text_bursts
 from handlers.photo import handle_photo
 from handlers.setbudget import get_setbudget_handler
+from metrics import start_metrics_server
+from outbox import outbox
 from reports import build_week_report
+from services import ai_gateway
+from update_processor import update_processor
 
 logging.basicConfig(
     format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
@@ -25,6 +41,8 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+WEBHOOK_PATH = "telegram"
+
 # Israel timezone (Asia/Jerusalem, handles DST automatically)
 
 
@@ -38,20 +56,56 @@ async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE) -> N
 
 async def send_weekly_report(context: ContextTypes.DEFAULT_TYPE) -> None:
     """Send weekly report to all allowed users (Sunday 19:00 MSK)."""
-    report = build_week_report()
+    report = await build_week_report()
     for user_id in ALLOWED_USER_IDS:
-        try:
-            await context.bot.send_message(
-                chat_id=user_id, text=report, parse_mode="Markdown"
-            )
-        except Exception:
-            logger.exception("Failed to send weekly report to %d", user_id)
+        outbox.send(user_id, report, parse_mode="Markdown")
 
 
-def main() -> None:
-    db.init_db()
+async def archive_closed_years(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Move long-closed years out of the hot table (nightly, and once at startup)."""
+    years = await db_async.archive_closed_years()
+    if years:
+        logger.info("Archived years: %s", years)
+
+
+async def on_startup(app: Application) -> None:
+    outbox.start(app.bot)
+    await ai_gateway.warm_up()
+    if METRICS_PORT:
+        app.bot_data["metrics_server"] = await start_metrics_server("127.0.0.1", METRICS_PORT)
+
+
+async def on_stop(app: Application) -> None:
+    # Answer coalesced text messages and flush the outbox while the bot can
+    # still send; by post_shutdown its HTTP client is already closed.
+    await text_bursts.drain()
+    await outbox.drain()
+
+
+async def on_shutdown(app: Application) -> None:
+    await outbox.stop()
+    await ai_gateway.close()
+    server = app.bot_data.get("metrics_server")
+    if server is not None:
+        server.close()
+        await server.wait_closed()
+    db_async.shutdown()
+
 
-    app = Application.builder().token(TELEGRAM_BOT_TOKEN).build()
+def build_app() -> Application:
+    builder = (
+        Application.builder()
+        .token(TELEGRAM_BOT_TOKEN)
+        .post_init(on_startup)
+        .post_stop(on_stop)
+        .post_shutdown(on_shutdown)
+        .concurrent_updates(update_processor)
+    )
+    if TELEGRAM_API_URL:
+        builder = builder.base_url(f"{TELEGRAM_API_URL}/bot").base_file_url(
+            f"{TELEGRAM_API_URL}/file/bot"
+        )
+    app = builder.build()
 
     # Conversation handler must be added before generic text handler
     app.add_handler(get_setbudget_handler())
@@ -59,10 +113,20 @@ def main() -> None:
     app.add_handler(CommandHandler("start", start))
     app.add_handler(CommandHandler("week", week))
     app.add_handler(CommandHandler("month", month))
+    app.add_handler(CommandHandler("year", year))
+    app.add_handler(CommandHandler("trend", trend))
     app.add_handler(CommandHandler("budget", budget))
+    app.add_handler(CommandHandler("stats", stats))
+    app.add_handler(CommandHandler("export", export))
 
     app.add_handler(MessageHandler(filters.VOICE, handle_voice))
     app.add_handler(MessageHandler(filters.PHOTO, handle_photo))
+    app.add_handler(
+        MessageHandler(
+            filters.Document.FileExtension("csv") | filters.Document.MimeType("text/csv"),
+            handle_statement,
+        )
+    )
     app.add_handler(
         MessageHandler(filters.TEXT & ~filters.COMMAND, handle_text_expense)
     )
@@ -75,9 +139,35 @@ def main() -> None:
         time=datetime.time(hour=19, minute=0, tzinfo=ISRAEL_TZ),
         days=(6,),  # Sunday
     )
+    # Archive closed years: nightly at 03:30, and shortly after startup
+    app.job_queue.run_daily(
+        archive_closed_years,
+        time=datetime.time(hour=3, minute=30, tzinfo=ISRAEL_TZ),
+    )
+    app.job_queue.run_once(archive_closed_years, when=60)
+    return app
+
 
-    logger.info("Bot started")
-    app.run_polling(allowed_updates=Update.ALL_TYPES)
+def main() -> None:
+    db.init_db()
+    app = build_app()
+
+    if WEBHOOK_URL:
+        # Telegram keeps queuing updates while the webhook is set, so a
+        # restart or deploy loses nothing; SIGTERM stops the server after
+        # in-flight updates are handled.
+        logger.info("Bot started (webhook on port %d)", WEBHOOK_PORT)
+        app.run_webhook(
+            listen="0.0.0.0",
+            port=WEBHOOK_PORT,
+            url_path=WEBHOOK_PATH,
+            webhook_url=f"{WEBHOOK_URL}/{WEBHOOK_PATH}",
+            secret_token=WEBHOOK_SECRET,
+            allowed_updates=Update.ALL_TYPES,
+        )
+    else:
+        logger.info("Bot started (polling)")
+        app.run_polling(allowed_updates=Update.ALL_TYPES)
 
 
 if __name__ == "__main__":
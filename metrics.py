@@ -0,0 +1,185 @@
+import asyncio
+import contextlib
+import contextvars
+import functools
+import logging
+import threading
+import time
+from collections import defaultdict, deque
+
+logger = logging.getLogger(__name__)
+
+SAMPLES_PER_SERIES = 1000
+SLOW_UPDATE_SECONDS = 5.0
+QUANTILES = (0.5, 0.95, 0.99)
+
+_lock = threading.Lock()
+_samples: dict[tuple[str, str], deque[float]] = defaultdict(
+    lambda: deque(maxlen=SAMPLES_PER_SERIES)
+)
+_counts: dict[tuple[str, str], int] = defaultdict(int)
+_sums: dict[tuple[str, str], float] = defaultdict(float)
+_trace: contextvars.ContextVar[dict | None] = contextvars.ContextVar("trace", default=None)
+
+
+def record(stage: str, seconds: float, source: str | None = None) -> None:
+    """Add one timing to the (stage, source) histogram and the current trace."""
+    trace = _trace.get()
+    if source is None:
+        source = trace["source"] if trace is not None else "background"
+    key = (stage, source)
+    with _lock:
+        _samples[key].append(seconds)
+        _counts[key] += 1
+        _sums[key] += seconds
+    if trace is not None:
+        trace["spans"].append((stage, seconds))
+
+
+@contextlib.contextmanager
+def span(stage: str):
+    """Time the enclosed block as one pipeline stage."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(stage, time.perf_counter() - started)
+
+
+def traced(source: str):
+    """Decorator for handlers: time the whole update and log slow ones by stage."""
+
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            trace = {"source": source, "spans": []}
+            token = _trace.set(trace)
+            started = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                total = time.perf_counter() - started
+                _trace.reset(token)
+                record("total", total, source)
+                if total >= SLOW_UPDATE_SECONDS:
+                    breakdown = ", ".join(f"{s} {t:.2f}s" for s, t in trace["spans"])
+                    logger.warning(
+                        "Slow %s update: %.2fs (%s)", source, total, breakdown or "no spans"
+                    )
+
+        return wrapper
+
+    return decorator
+
+
+def _quantile(sorted_values: list[float], q: float) -> float:
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * q))]
+
+
+def snapshot() -> list[dict]:
+    """Per (stage, source): count, sum and p50/p95/p99 over recent samples."""
+    with _lock:
+        series = {key: sorted(values) for key, values in _samples.items()}
+        counts = dict(_counts)
+        sums = dict(_sums)
+    result = []
+    for (stage, source), values in sorted(series.items()):
+        if not values:
+            continue
+        result.append({
+            "stage": stage,
+            "source": source,
+            "count": counts[(stage, source)],
+            "sum": sums[(stage, source)],
+            **{f"p{int(q * 100)}": _quantile(values, q) for q in QUANTILES},
+        })
+    return result
+
+
+def _gauges() -> dict[str, float]:
+    """Counters from the caches and queues, imported lazily to avoid cycles."""
+    from outbox import outbox
+    from services import (
+        ai_gateway, audio_prep, image_prep, local_parser, media_cache, parse_cache, resilience,
+    )
+    from update_processor import update_processor
+
+    gauges = {"local_parser_hit_rate": local_parser.hit_rate()}
+    for prefix, counters in (
+        ("local_parser", local_parser.stats),
+        ("parse_cache", parse_cache.stats),
+        ("media_cache", media_cache.stats),
+        ("image_prep", image_prep.stats),
+        ("audio_prep", audio_prep.stats),
+        ("outbox", outbox.stats()),
+        ("openai", resilience.stats()),
+        ("ai", ai_gateway.stats()),
+        ("updates", update_processor.stats()),
+    ):
+        for name, value in counters.items():
+            if isinstance(value, (int, float)):
+                gauges[f"{prefix}_{name}"] = value
+    return gauges
+
+
+def render_text() -> str:
+    """Prometheus text exposition of the stage histograms and gauges."""
+    lines = [
+        "# TYPE finance_bot_stage_seconds summary",
+    ]
+    for s in snapshot():
+        labels = f'stage="{s["stage"]}",source="{s["source"]}"'
+        for q in QUANTILES:
+            lines.append(
+                f'finance_bot_stage_seconds{{{labels},quantile="{q}"}} {s[f"p{int(q * 100)}"]:.6f}'
+            )
+        lines.append(f"finance_bot_stage_seconds_count{{{labels}}} {s['count']}")
+        lines.append(f"finance_bot_stage_seconds_sum{{{labels}}} {s['sum']:.6f}")
+    for name, value in _gauges().items():
+        lines.append(f"finance_bot_{name} {value}")
+    return "\n".join(lines) + "\n"
+
+
+def render_summary() -> str:
+    """Human-readable table for the /stats command."""
+    rows = snapshot()
+    if not rows:
+        return "Пока нет замеров."
+    lines = ["stage/source: n, p50 / p95 / p99 (ms)"]
+    for s in rows:
+        lines.append(
+            f"{s['stage']}/{s['source']}: {s['count']}, "
+            f"{s['p50'] * 1000:.0f} / {s['p95'] * 1000:.0f} / {s['p99'] * 1000:.0f}"
+        )
+    lines.append("")
+    lines.extend(f"{name}: {value:g}" for name, value in _gauges().items())
+    return "\n".join(lines)
+
+
+async def _serve_metrics(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    try:
+        request_line = await reader.readline()
+        while (await reader.readline()).strip():
+            pass  # skip headers
+        path = request_line.split()[1] if len(request_line.split()) > 1 else b"/"
+        if path == b"/metrics":
+            body = render_text().encode()
+            status = b"200 OK"
+        else:
+            body, status = b"not found\n", b"404 Not Found"
+        writer.write(
+            b"HTTP/1.1 " + status + b"\r\n"
+            b"Content-Type: text/plain; version=0.0.4\r\n"
+            b"Content-Length: " + str(len(body)).encode() + b"\r\n"
+            b"Connection: close\r\n\r\n" + body
+        )
+        await writer.drain()
+    finally:
+        writer.close()
+
+
+async def start_metrics_server(host: str, port: int) -> asyncio.AbstractServer:
+    """Serve render_text() at http://host:port/metrics."""
+    server = await asyncio.start_server(_serve_metrics, host, port)
+    logger.info("Metrics endpoint on http://%s:%d/metrics", host, port)
+    return server
@@ -1,22 +1,20 @@
 import functools
 import logging
 
-from telegram import Bot, Update
+from telegram import Update
 from telegram.ext import ContextTypes
 
 from config import ALLOWED_USER_IDS
+from outbox import outbox
 
 logger = logging.getLogger(__name__)
 
 
-async def notify_others(bot: Bot, sender_id: int, text: str) -> None:
-    """Send a notification to all allowed users except the sender."""
+def notify_others(sender_id: int, text: str) -> None:
+    """Queue a notification to all allowed users except the sender."""
     for user_id in ALLOWED_USER_IDS:
         if user_id != sender_id:
-            try:
-                await bot.send_message(chat_id=user_id, text=text)
-            except Exception:
-                logger.warning("Failed to notify user %d", user_id)
+            outbox.send(user_id, text)
 
 
 def authorized(func):
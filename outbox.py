@@ -0,0 +1,140 @@
+import asyncio
+import logging
+import statistics
+import time
+from collections import deque
+from datetime import timedelta
+
+from telegram import Bot
+from telegram.error import NetworkError, RetryAfter, TelegramError, TimedOut
+
+logger = logging.getLogger(__name__)
+
+WORKERS = 8
+MAX_ATTEMPTS = 3
+# Telegram allows about 30 messages per second overall and 1 per second per chat.
+GLOBAL_INTERVAL = 1 / 30
+PER_CHAT_INTERVAL = 1.0
+DEPTH_WARNING = 50
+
+
+def retry_after_seconds(error: RetryAfter) -> float:
+    delay = error.retry_after
+    if isinstance(delay, timedelta):
+        return delay.total_seconds()
+    return float(delay)
+
+
+class Outbox:
+    """Fire-and-forget queue for outbound messages.
+
+    Messages are sent concurrently by a pool of workers, spaced to respect
+    Telegram's global and per-chat limits, and retried on RetryAfter and
+    network errors. Messages to the same chat keep their order.
+    """
+
+    def __init__(self) -> None:
+        self._bot: Bot | None = None
+        self._queue: asyncio.Queue | None = None
+        self._workers: list[asyncio.Task] = []
+        self._chat_locks: dict[int, asyncio.Lock] = {}
+        self._chat_next: dict[int, float] = {}
+        self._global_next = 0.0
+        self._latencies: deque[float] = deque(maxlen=500)
+        self._sent = 0
+        self._failed = 0
+
+    def start(self, bot: Bot) -> None:
+        self._bot = bot
+        self._queue = asyncio.Queue()
+        self._workers = [
+            asyncio.create_task(self._worker(), name=f"outbox-{i}") for i in range(WORKERS)
+        ]
+
+    async def drain(self, timeout: float = 10.0) -> None:
+        """Give queued messages a chance to go out; call while the bot can still send."""
+        if self._queue is None:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Outbox drained with %d unsent messages", self._queue.qsize())
+
+    async def stop(self) -> None:
+        """Cancel the workers; anything still queued is dropped."""
+        if self._queue is None:
+            return
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    def send(self, chat_id: int, text: str, **kwargs) -> None:
+        """Queue a message for delivery without waiting for it."""
+        if self._queue is None:
+            raise RuntimeError("Outbox is not started")
+        self._queue.put_nowait((chat_id, text, kwargs, time.monotonic()))
+        depth = self._queue.qsize()
+        if depth >= DEPTH_WARNING:
+            logger.warning("Outbox queue depth is %d", depth)
+
+    async def _wait_for_slot(self, chat_id: int) -> None:
+        now = time.monotonic()
+        start = max(now, self._global_next, self._chat_next.get(chat_id, 0.0))
+        self._global_next = max(now, self._global_next) + GLOBAL_INTERVAL
+        self._chat_next[chat_id] = start + PER_CHAT_INTERVAL
+        if start > now:
+            await asyncio.sleep(start - now)
+
+    async def _deliver(self, chat_id: int, text: str, kwargs: dict) -> bool:
+        for attempt in range(1, MAX_ATTEMPTS + 1):
+            await self._wait_for_slot(chat_id)
+            try:
+                await self._bot.send_message(chat_id=chat_id, text=text, **kwargs)
+                return True
+            except RetryAfter as e:
+                delay = retry_after_seconds(e)
+                logger.info("Rate limited sending to %d, retrying in %.1fs", chat_id, delay)
+                self._chat_next[chat_id] = time.monotonic() + delay
+            except (TimedOut, NetworkError) as e:
+                logger.info("Network error sending to %d (attempt %d): %s", chat_id, attempt, e)
+                await asyncio.sleep(2 ** attempt)
+            except TelegramError:
+                logger.warning("Failed to send message to %d", chat_id, exc_info=True)
+                return False
+        logger.warning("Giving up on message to %d after %d attempts", chat_id, MAX_ATTEMPTS)
+        return False
+
+    async def _worker(self) -> None:
+        while True:
+            chat_id, text, kwargs, queued_at = await self._queue.get()
+            lock = self._chat_locks.setdefault(chat_id, asyncio.Lock())
+            try:
+                async with lock:
+                    delivered = await self._deliver(chat_id, text, kwargs)
+                if delivered:
+                    self._sent += 1
+                    self._latencies.append(time.monotonic() - queued_at)
+                else:
+                    self._failed += 1
+            except Exception:
+                self._failed += 1
+                logger.exception("Outbox worker error")
+            finally:
+                self._queue.task_done()
+
+    def stats(self) -> dict:
+        """Queue depth, delivery counters and enqueue-to-send latency percentiles."""
+        latencies = sorted(self._latencies)
+        p50 = statistics.median(latencies) if latencies else 0.0
+        p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] if latencies else 0.0
+        return {
+            "depth": self._queue.qsize() if self._queue is not None else 0,
+            "sent": self._sent,
+            "failed": self._failed,
+            "latency_p50": p50,
+            "latency_p95": p95,
+        }
+
+
+outbox = Outbox()
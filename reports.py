@@ -1,16 +1,102 @@
+import threading
 from collections import defaultdict
+from datetime import date, datetime, timedelta
 
 import db
+import db_async
+from config import ISRAEL_TZ
 
+MONTH_NAMES = (
+    "янв", "фев", "мар", "апр", "май", "июн", "июл", "авг", "сен", "окт", "ноя", "дек",
+)
+TREND_PERIODS = 12
+# The trend compares the mean of the last few complete periods with the few before.
+TREND_WINDOW = 3
+BAR_WIDTH = 10
 
-def _format_amount(amount: float) -> str:
+# (report type, period) -> (text, expires_at, covers_from, covers_until)
+_cache: dict[tuple[str, str], tuple[str, datetime, datetime, datetime | None]] = {}
+_cache_lock = threading.Lock()
+_generation = 0
+
+
+def format_amount(amount: float) -> str:
     if amount == int(amount):
         return f"{int(amount)}₽"
     return f"{amount:.2f}₽"
 
 
-def build_week_report() -> str:
-    expenses = db.get_week_expenses()
+def _on_write(table: str, timestamps: list[datetime]) -> None:
+    """Drop cached reports whose period a committed write touches."""
+    global _generation
+    with _cache_lock:
+        _generation += 1
+        for key, (_, _, start, end) in list(_cache.items()):
+            if table == "budgets":
+                stale = key[0] in ("month", "budget")
+            else:
+                stale = any(start <= t and (end is None or t < end) for t in timestamps)
+            if stale:
+                del _cache[key]
+
+
+db.add_write_listener(_on_write)
+
+
+def _cached(key: tuple[str, str], now: datetime) -> tuple[str | None, int]:
+    """Cached text (or None) plus the generation to pass to _store."""
+    with _cache_lock:
+        entry = _cache.get(key)
+        if entry is not None and now < entry[1]:
+            return entry[0], _generation
+        return None, _generation
+
+
+def _store(
+    key: tuple[str, str],
+    generation: int,
+    text: str,
+    expires_at: datetime,
+    start: datetime,
+    end: datetime | None,
+) -> None:
+    with _cache_lock:
+        # A write landed while the report was being built; it may be stale.
+        if generation != _generation:
+            return
+        for old_key in list(_cache):
+            if old_key[0] == key[0]:
+                del _cache[old_key]
+        _cache[key] = (text, expires_at, start, end)
+
+
+def _month_bounds(now: datetime) -> tuple[datetime, datetime]:
+    start = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    end = (start + timedelta(days=32)).replace(day=1)
+    return start, end
+
+
+async def build_week_report() -> str:
+    """Rolling 7-day report, cached until a write or until an expense ages out of
+    the current or previous week window."""
+    now = datetime.now(tz=ISRAEL_TZ)
+    key = ("week", "rolling")
+    text, generation = _cached(key, now)
+    if text is not None:
+        return text
+
+    text = await _build_week_report()
+    expires_at = now + timedelta(days=1)
+    for window in (timedelta(days=7), timedelta(days=14)):
+        earliest = await db_async.get_earliest_since(now - window)
+        if earliest is not None:
+            expires_at = min(expires_at, earliest + window)
+    _store(key, generation, text, expires_at, now - timedelta(days=14), None)
+    return text
+
+
+async def _build_week_report() -> str:
+    expenses = await db_async.get_week_expenses()
     if not expenses:
         return "📊 За последнюю неделю расходов нет."
 
@@ -23,23 +109,35 @@ def build_week_report() -> str:
 
     lines = ["📊 *Отчёт за неделю*", ""]
     for cat, amt in top:
-        lines.append(f"  {cat}: {_format_amount(amt)}")
-    lines.append(f"\n*Итого: {_format_amount(total)}*")
+        lines.append(f"  {cat}: {format_amount(amt)}")
+    lines.append(f"\n*Итого: {format_amount(total)}*")
 
-    prev_total = db.get_previous_week_total()
+    prev_total = await db_async.get_previous_week_total()
     if prev_total > 0:
         diff = total - prev_total
         pct = (diff / prev_total) * 100
         sign = "+" if diff > 0 else ""
         lines.append(
-            f"vs прошлая неделя: {sign}{_format_amount(diff)} ({sign}{pct:.0f}%)"
+            f"vs прошлая неделя: {sign}{format_amount(diff)} ({sign}{pct:.0f}%)"
         )
 
     return "\n".join(lines)
 
 
-def build_month_report() -> str:
-    expenses = db.get_month_expenses()
+async def build_month_report() -> str:
+    """Current month report, cached until a write or the end of the month."""
+    now = datetime.now(tz=ISRAEL_TZ)
+    start, end = _month_bounds(now)
+    key = ("month", f"{start:%Y-%m}")
+    text, generation = _cached(key, now)
+    if text is None:
+        text = await _build_month_report()
+        _store(key, generation, text, end, start, end)
+    return text
+
+
+async def _build_month_report() -> str:
+    expenses = await db_async.get_month_expenses()
     if not expenses:
         return "📊 В этом месяце расходов нет."
 
@@ -49,25 +147,210 @@ def build_month_report() -> str:
         by_category[e["category"]] += e["amount"]
 
     top = sorted(by_category.items(), key=lambda x: x[1], reverse=True)
-    budgets = {b["category"]: b["monthly_limit"] for b in db.get_all_budgets()}
+    budgets = {b["category"]: b["monthly_limit"] for b in await db_async.get_all_budgets()}
 
     lines = ["📊 *Отчёт за месяц*", ""]
     for cat, amt in top:
-        line = f"  {cat}: {_format_amount(amt)}"
+        line = f"  {cat}: {format_amount(amt)}"
         if cat in budgets:
             limit = budgets[cat]
             pct = (amt / limit) * 100
-            line += f" из {_format_amount(limit)} ({pct:.0f}%)"
+            line += f" из {format_amount(limit)} ({pct:.0f}%)"
             if amt > limit:
                 line += " ⚠️"
         lines.append(line)
 
-    lines.append(f"\n*Итого: {_format_amount(total)}*")
+    lines.append(f"\n*Итого: {format_amount(total)}*")
     return "\n".join(lines)
 
 
-def build_budget_report() -> str:
-    budgets = db.get_all_budgets()
+def _next_midnight(now: datetime) -> datetime:
+    return (now + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def _change(current: float, previous: float) -> str:
+    """Signed difference and percentage, or empty if there is nothing to compare with."""
+    if previous <= 0:
+        return ""
+    diff = current - previous
+    sign = "+" if diff > 0 else ""
+    return f"{sign}{format_amount(diff)} ({sign}{diff / previous * 100:.0f}%)"
+
+
+def _bar(value: float, largest: float) -> str:
+    if largest <= 0 or value <= 0:
+        return ""
+    return "█" * max(1, round(BAR_WIDTH * value / largest))
+
+
+async def build_year_report() -> str:
+    """This year by month and category against the same dates last year.
+
+    Read from the month and day rollups, so the cost doesn't grow with the
+    number of expenses. Cached until a write to either year or midnight.
+    """
+    now = datetime.now(tz=ISRAEL_TZ)
+    key = ("year", f"{now:%Y-%m-%d}")
+    text, generation = _cached(key, now)
+    if text is None:
+        text = await _build_year_report(now.date())
+        last_year = now.replace(
+            year=now.year - 1, month=1, day=1, hour=0, minute=0, second=0, microsecond=0
+        )
+        _store(key, generation, text, _next_midnight(now), last_year, None)
+    return text
+
+
+async def _build_year_report(today: date) -> str:
+    year_start = date(today.year, 1, 1)
+    last_year_start = date(today.year - 1, 1, 1)
+    month_start = today.replace(day=1)
+    try:
+        same_day_last_year = today.replace(year=today.year - 1)
+    except ValueError:  # Feb 29
+        same_day_last_year = today.replace(year=today.year - 1, day=28)
+
+    months = await db_async.get_rollups("month", last_year_start, None)
+    # Last year's part of the current month, up to today's date.
+    days = await db_async.get_rollups(
+        "day", month_start.replace(year=today.year - 1), same_day_last_year + timedelta(days=1)
+    )
+
+    by_month: dict[tuple[int, int], float] = defaultdict(float)
+    this_year: dict[str, float] = defaultdict(float)
+    last_year: dict[str, float] = defaultdict(float)
+    for r in months:
+        if r["period"] >= year_start:
+            by_month[(today.year, r["period"].month)] += r["total"]
+            this_year[r["category"]] += r["total"]
+        elif r["period"].month != today.month:
+            by_month[(today.year - 1, r["period"].month)] += r["total"]
+            if r["period"].month < today.month:
+                last_year[r["category"]] += r["total"]
+    # The current month is compared over the same dates, not last year's whole month.
+    for r in days:
+        by_month[(today.year - 1, today.month)] += r["total"]
+        last_year[r["category"]] += r["total"]
+
+    if not this_year:
+        return "📅 В этом году расходов нет."
+
+    lines = [f"📅 *{today.year} год*", ""]
+    for month in range(1, today.month + 1):
+        label = MONTH_NAMES[month - 1]
+        if month == today.month:
+            label += f" (по {today.day}-е)"
+        line = f"  {label}: {format_amount(by_month[(today.year, month)])}"
+        previous = by_month[(today.year - 1, month)]
+        if previous:
+            line += f" · {today.year - 1}: {format_amount(previous)}"
+        lines.append(line)
+
+    total = sum(this_year.values())
+    previous_total = sum(last_year.values())
+    lines.append(f"\n*С начала года: {format_amount(total)}*")
+    if previous_total > 0:
+        lines.append(f"vs {today.year - 1} на ту же дату: {_change(total, previous_total)}")
+
+    lines += ["", "*По категориям:*"]
+    for cat, amt in sorted(this_year.items(), key=lambda x: x[1], reverse=True):
+        change = _change(amt, last_year.get(cat, 0))
+        lines.append(f"  {cat}: {format_amount(amt)}" + (f", {change}" if change else ""))
+    return "\n".join(lines)
+
+
+def _trend_periods(grain: str, today: date) -> list[date]:
+    """Start dates of the last TREND_PERIODS periods, the current one last."""
+    if grain == "week":
+        current = today - timedelta(days=today.weekday())
+        return [current - timedelta(weeks=n) for n in range(TREND_PERIODS - 1, -1, -1)]
+    periods = []
+    year, month = today.year, today.month
+    for _ in range(TREND_PERIODS):
+        periods.append(date(year, month, 1))
+        year, month = (year, month - 1) if month > 1 else (year - 1, 12)
+    return periods[::-1]
+
+
+def _period_label(grain: str, period: date) -> str:
+    if grain == "week":
+        return f"{period:%d.%m}"
+    return f"{MONTH_NAMES[period.month - 1]} {period:%y}"
+
+
+async def build_trend_report(grain: str = "month", category: str | None = None) -> str:
+    """Totals over the last TREND_PERIODS months (or weeks), overall or for one category.
+
+    Read from the rollups; cached until a write in the window or midnight.
+    """
+    now = datetime.now(tz=ISRAEL_TZ)
+    periods = _trend_periods(grain, now.date())
+    key = ("trend", f"{grain}:{category or ''}:{now:%Y-%m-%d}")
+    text, generation = _cached(key, now)
+    if text is None:
+        text = await _build_trend_report(grain, category, periods)
+        start = datetime.combine(periods[0], datetime.min.time(), tzinfo=ISRAEL_TZ)
+        _store(key, generation, text, _next_midnight(now), start, None)
+    return text
+
+
+async def _build_trend_report(grain: str, category: str | None, periods: list[date]) -> str:
+    rows = await db_async.get_rollups(grain, periods[0], None)
+    if category is not None:
+        rows = [r for r in rows if r["category"] == category]
+    if not rows:
+        return "📈 За этот период расходов нет."
+
+    totals: dict[date, float] = defaultdict(float)
+    by_category: dict[str, dict[date, float]] = defaultdict(lambda: defaultdict(float))
+    for r in rows:
+        totals[r["period"]] += r["total"]
+        by_category[r["category"]][r["period"]] += r["total"]
+
+    unit = "недель" if grain == "week" else "месяцев"
+    title = f"📈 *{category or 'Все траты'}: {TREND_PERIODS} {unit}*"
+    largest = max(totals.values())
+    lines = [title, ""]
+    for period in periods:
+        amount = totals.get(period, 0)
+        lines.append(
+            f"  {_period_label(grain, period)}: {format_amount(amount)} {_bar(amount, largest)}"
+        )
+
+    # The current period is still filling up; averages use complete ones only.
+    complete = periods[:-1]
+    per = "нед" if grain == "week" else "мес"
+    series = {category: totals} if category is not None else by_category
+    lines += ["", f"*В среднем за {per}:*"]
+    ranked = sorted(series.items(), key=lambda x: sum(x[1].values()), reverse=True)
+    for cat, values in ranked:
+        average = sum(values.get(p, 0) for p in complete) / len(complete)
+        recent = sum(values.get(p, 0) for p in complete[-TREND_WINDOW:]) / TREND_WINDOW
+        before = complete[-2 * TREND_WINDOW:-TREND_WINDOW]
+        earlier = sum(values.get(p, 0) for p in before) / TREND_WINDOW
+        line = f"  {cat}: {format_amount(round(average, 2))}"
+        if earlier > 0:
+            pct = (recent - earlier) / earlier * 100
+            arrow = "↑" if pct > 0 else "↓" if pct < 0 else "→"
+            line += f" {arrow} {pct:+.0f}% за {TREND_WINDOW} {per}"
+        lines.append(line)
+    return "\n".join(lines)
+
+
+async def build_budget_report() -> str:
+    """Budget status for the current month, cached like build_month_report."""
+    now = datetime.now(tz=ISRAEL_TZ)
+    start, end = _month_bounds(now)
+    key = ("budget", f"{start:%Y-%m}")
+    text, generation = _cached(key, now)
+    if text is None:
+        text = await _build_budget_report()
+        _store(key, generation, text, end, start, end)
+    return text
+
+
+async def _build_budget_report() -> str:
+    budgets = await db_async.get_budget_status()
     if not budgets:
         return "Бюджеты не установлены. Используйте /setbudget."
 
@@ -75,35 +358,53 @@ def build_budget_report() -> str:
     for b in budgets:
         cat = b["category"]
         limit = b["monthly_limit"]
-        spent = db.get_monthly_total(cat)
+        spent = b["spent"]
         pct = (spent / limit) * 100 if limit > 0 else 0
         status = "⚠️" if spent > limit else "✅"
         lines.append(
-            f"  {status} {cat}: {_format_amount(spent)} / {_format_amount(limit)} ({pct:.0f}%)"
+            f"  {status} {cat}: {format_amount(spent)} / {format_amount(limit)} ({pct:.0f}%)"
         )
 
     return "\n".join(lines)
 
 
-def format_expense_feedback(category: str, amount: float) -> str:
-    """Format feedback message after recording an expense."""
-    lines = [f"✅ {category}, {_format_amount(amount)}"]
+def _budget_line(category: str, monthly_total: float, budget: float) -> str:
+    if monthly_total > budget:
+        over = monthly_total - budget
+        return (
+            f"⚠️ {category}: {format_amount(monthly_total)} — "
+            f"превышен лимит {format_amount(budget)} на {format_amount(over)}"
+        )
+    pct = (monthly_total / budget) * 100
+    return (
+        f"📊 {category} в этом месяце: "
+        f"{format_amount(monthly_total)} из {format_amount(budget)} ({pct:.0f}%)"
+    )
 
-    monthly_total = db.get_monthly_total(category)
-    budget = db.get_budget(category)
 
+async def format_expense_feedback(category: str, amount: float) -> str:
+    """Format feedback message after recording an expense."""
+    lines = [f"✅ {category}, {format_amount(amount)}"]
+
+    monthly_total, budget = (await db_async.get_month_to_date([category]))[category]
     if budget is not None:
-        pct = (monthly_total / budget) * 100
-        if monthly_total > budget:
-            over = monthly_total - budget
-            lines.append(
-                f"⚠️ {category}: {_format_amount(monthly_total)} — "
-                f"превышен лимит {_format_amount(budget)} на {_format_amount(over)}"
-            )
-        else:
-            lines.append(
-                f"📊 {category} в этом месяце: "
-                f"{_format_amount(monthly_total)} из {_format_amount(budget)} ({pct:.0f}%)"
-            )
+        lines.append(_budget_line(category, monthly_total, budget))
+
+    return "\n".join(lines)
+
+
+async def format_batch_feedback(items: list[dict]) -> str:
+    """Format feedback for several expenses recorded at once (e.g. a receipt).
+
+    One line per item, then one budget line per affected category.
+    """
+    lines = [f"✅ {item['category']}, {format_amount(item['amount'])}" for item in items]
+
+    categories = list(dict.fromkeys(item["category"] for item in items))
+    totals = await db_async.get_month_to_date(categories)
+    for cat in categories:
+        monthly_total, budget = totals[cat]
+        if budget is not None:
+            lines.append(_budget_line(cat, monthly_total, budget))
 
     return "\n".join(lines)
@@ -0,0 +1,246 @@
+import asyncio
+import io
+import logging
+import time
+from collections import deque
+from typing import Awaitable, Callable, NamedTuple, TypeVar
+
+import httpx
+from openai import AsyncOpenAI
+
+from config import OPENAI_API_KEY
+from metrics import record
+from services import resilience
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# One keep-alive pool for every OpenAI call. Idle connections are kept long
+# enough to bridge the usual gap between a family's messages.
+MAX_CONNECTIONS = 20
+MAX_KEEPALIVE_CONNECTIONS = 10
+KEEPALIVE_SECONDS = 120.0
+CONNECT_TIMEOUT = 5.0
+WARM_UP_TIMEOUT = 5.0
+
+# Per model: calls in flight at once and tokens per minute (None for no token
+# limit; Whisper is billed by audio length). Keep them under the account's
+# limits so bursts queue here instead of coming back as 429s.
+MODEL_LIMITS: dict[str, tuple[int, int | None]] = {
+    "gpt-4o-mini": (8, 150_000),
+    "gpt-4o": (4, 30_000),
+    "whisper-1": (4, None),
+}
+DEFAULT_LIMITS = (4, None)
+# Rough prompt size: Cyrillic text runs at about 3 characters per token, and
+# a high-detail receipt photo at about 1000 tokens.
+CHARS_PER_TOKEN = 3
+IMAGE_TOKENS = 1000
+TPM_WINDOW_SECONDS = 60.0
+
+client = AsyncOpenAI(
+    api_key=OPENAI_API_KEY,
+    # Retries are done by services.resilience, with hedging and a circuit breaker.
+    max_retries=0,
+    http_client=httpx.AsyncClient(
+        limits=httpx.Limits(
+            max_connections=MAX_CONNECTIONS,
+            max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=KEEPALIVE_SECONDS,
+        ),
+        timeout=httpx.Timeout(60.0, connect=CONNECT_TIMEOUT),
+        follow_redirects=True,
+    ),
+)
+
+
+class _Streamed(NamedTuple):
+    text: str
+    usage: object | None
+
+
+class _Model:
+    """Concurrency slots and a sliding one-minute token budget for one model."""
+
+    def __init__(self, name: str) -> None:
+        concurrency, self.tpm = MODEL_LIMITS.get(name, DEFAULT_LIMITS)
+        self.slots = asyncio.Semaphore(concurrency)
+        # Waiters for the token budget are served in arrival order.
+        self.budget_lock = asyncio.Lock()
+        # Set when a call used fewer tokens than reserved, so the head waiter re-checks.
+        self.refunded = asyncio.Event()
+        # [reserved at, tokens] per call in the last TPM_WINDOW_SECONDS.
+        self.spent: deque[list] = deque()
+        self.spent_tokens = 0
+        self.counters = {
+            "calls": 0, "in_flight": 0, "queued": 0, "throttled": 0,
+            "prompt_tokens": 0, "completion_tokens": 0,
+        }
+
+    def _expire(self, now: float) -> None:
+        while self.spent and now - self.spent[0][0] >= TPM_WINDOW_SECONDS:
+            self.spent_tokens -= self.spent.popleft()[1]
+
+    async def reserve(self, tokens: int) -> list | None:
+        """Wait until tokens fit in the last minute's budget and charge them."""
+        if self.tpm is None:
+            return None
+        # A call bigger than the whole budget would otherwise wait forever.
+        tokens = min(tokens, self.tpm)
+        async with self.budget_lock:
+            while True:
+                now = time.monotonic()
+                self._expire(now)
+                if self.spent_tokens + tokens <= self.tpm:
+                    break
+                self.counters["throttled"] += 1
+                self.refunded.clear()
+                try:
+                    await asyncio.wait_for(
+                        self.refunded.wait(), self.spent[0][0] + TPM_WINDOW_SECONDS - now
+                    )
+                except asyncio.TimeoutError:
+                    pass
+        entry = [now, tokens]
+        self.spent.append(entry)
+        self.spent_tokens += tokens
+        return entry
+
+    def settle(self, entry: list | None, usage: object | None) -> None:
+        """Replace the estimate with the usage the API reported."""
+        if usage is None:
+            return
+        prompt = getattr(usage, "prompt_tokens", 0) or 0
+        completion = getattr(usage, "completion_tokens", 0) or 0
+        self.counters["prompt_tokens"] += prompt
+        self.counters["completion_tokens"] += completion
+        if entry is not None and time.monotonic() - entry[0] < TPM_WINDOW_SECONDS:
+            self.spent_tokens += prompt + completion - entry[1]
+            if prompt + completion < entry[1]:
+                self.refunded.set()
+            entry[1] = prompt + completion
+
+
+_models: dict[str, _Model] = {}
+
+
+def _estimate_tokens(messages: list[dict], max_tokens: int) -> int:
+    """Prompt estimate plus max_tokens, which OpenAI also counts against the limit."""
+    tokens = max_tokens
+    for message in messages:
+        content = message["content"]
+        if isinstance(content, str):
+            content = [{"type": "text", "text": content}]
+        for part in content:
+            if part["type"] == "text":
+                tokens += len(part["text"]) // CHARS_PER_TOKEN + 1
+            else:
+                tokens += IMAGE_TOKENS
+    return tokens
+
+
+async def _call(
+    model: str,
+    tokens: int,
+    request: Callable[[], Awaitable[T]],
+    hedge: bool = True,
+) -> T:
+    """Queue for the model's limits, then run request() through services.resilience.
+
+    The slot and token budget are held per call: retries and a hedged
+    duplicate run inside them. Records queueing and per-attempt latency.
+    """
+    limits = _models.setdefault(model, _Model(model))
+    limits.counters["calls"] += 1
+    limits.counters["queued"] += 1
+    started = time.perf_counter()
+    try:
+        entry = await limits.reserve(tokens)
+        await limits.slots.acquire()
+    finally:
+        limits.counters["queued"] -= 1
+    record("ai.queue", time.perf_counter() - started)
+
+    async def attempt() -> T:
+        attempt_started = time.perf_counter()
+        try:
+            return await request()
+        finally:
+            record(f"ai.{model}", time.perf_counter() - attempt_started)
+
+    limits.counters["in_flight"] += 1
+    try:
+        result = await resilience.call(model, attempt, hedge)
+    finally:
+        limits.counters["in_flight"] -= 1
+        limits.slots.release()
+    limits.settle(entry, getattr(result, "usage", None))
+    return result
+
+
+async def chat(on_progress: Callable[[str], Awaitable[None]] | None = None, **kwargs) -> str:
+    """Run a chat completion; with on_progress, stream it and report the text so far.
+
+    kwargs go to chat.completions.create. A streamed completion is retried
+    from the start but never hedged.
+    """
+    model = kwargs["model"]
+    tokens = _estimate_tokens(kwargs["messages"], kwargs.get("max_tokens", 0))
+    if on_progress is None:
+        response = await _call(model, tokens, lambda: client.chat.completions.create(**kwargs))
+        return response.choices[0].message.content
+
+    async def stream() -> _Streamed:
+        chunks = await client.chat.completions.create(
+            stream=True, stream_options={"include_usage": True}, **kwargs
+        )
+        text, usage = "", None
+        async for chunk in chunks:
+            usage = chunk.usage or usage
+            if chunk.choices and chunk.choices[0].delta.content:
+                text += chunk.choices[0].delta.content
+                await on_progress(text)
+        return _Streamed(text, usage)
+
+    return (await _call(model, tokens, stream, hedge=False)).text
+
+
+async def transcribe(audio: bytes, filename: str, **kwargs) -> str:
+    """Transcribe audio with Whisper; kwargs go to audio.transcriptions.create."""
+    model = kwargs.setdefault("model", "whisper-1")
+
+    def request():
+        # Each attempt needs its own file object.
+        buf = io.BytesIO(audio)
+        buf.name = filename
+        return client.audio.transcriptions.create(file=buf, **kwargs)
+
+    return (await _call(model, 0, request)).text
+
+
+async def warm_up() -> None:
+    """Open a pooled connection (DNS, TCP, TLS) before the first real call."""
+    started = time.perf_counter()
+    try:
+        await client.with_options(timeout=WARM_UP_TIMEOUT).models.list()
+    except Exception as e:
+        logger.warning("OpenAI warm-up failed: %s", e)
+        return
+    logger.info("OpenAI connection warmed up in %.0fms", (time.perf_counter() - started) * 1000)
+
+
+async def close() -> None:
+    await client.close()
+
+
+def stats() -> dict:
+    """Per model: calls, in flight, queued, TPM waits, token usage and the last minute's spend."""
+    result = {}
+    for name, limits in _models.items():
+        prefix = name.replace("-", "_").replace(".", "_")
+        for key, value in limits.counters.items():
+            result[f"{prefix}_{key}"] = value
+        limits._expire(time.monotonic())
+        result[f"{prefix}_tokens_last_minute"] = limits.spent_tokens
+    return result
@@ -1,18 +1,42 @@
 import base64
+import hashlib
 import json
 import logging
 import re
+from typing import Awaitable, Callable, Collection
 
-from openai import AsyncOpenAI
-
-from config import OPENAI_API_KEY, CATEGORIES
+from config import CATEGORIES
+from metrics import span
+from services import ai_gateway, parse_cache, resilience
+from services.local_parser import parse_expense_fallback, parse_expense_local
 
 logger = logging.getLogger(__name__)
-client = AsyncOpenAI(api_key=OPENAI_API_KEY)
 
 GPT_MODEL = "gpt-4o-mini"
 CATEGORIES_STR = ", ".join(CATEGORIES)
 
+EXPENSE_PROMPT = f"""Ты — финансовый помощник. Пользователь отправил одно или несколько сообщений подряд, они переданы JSON-массивом строк. Для каждого сообщения определи, это запись расходов или вопрос о финансах.
+
+В одном сообщении может быть несколько трат: "хлеб 12, молоко 8, такси 40" — это три траты.
+
+Верни JSON-массив, по одному элементу на каждое сообщение, в том же порядке.
+Если сообщение — расходы:
+{{"type": "expense", "items": [{{"amount": <число>, "category": "<категория>", "description": "<краткое описание>"}}]}}
+
+Если это вопрос или просьба показать информацию:
+{{"type": "question"}}
+
+Доступные категории: {CATEGORIES_STR}
+Выбирай наиболее подходящую категорию. Если ни одна не подходит, используй "Другое".
+Сумму всегда возвращай как число (без "₽", "руб" и т.д.).
+
+Верни ТОЛЬКО JSON-массив, без пояснений."""
+
+# Cached parses are only valid for the prompt, categories and model they came from.
+PARSE_CACHE_VERSION = hashlib.sha256(
+    f"{GPT_MODEL}\n{EXPENSE_PROMPT}".encode()
+).hexdigest()[:16]
+
 
 def _strip_code_fences(text: str) -> str:
     """Remove markdown code fences that LLMs sometimes add around JSON."""
@@ -22,58 +46,120 @@ def _strip_code_fences(text: str) -> str:
     return text.strip()
 
 
-async def parse_expense_text(text: str) -> dict | None:
-    """Parse user text as either an expense or a question.
+async def parse_expense_offline(text: str) -> dict | None:
+    """parse_expense_text without the LLM: the local parser, then the parse cache.
 
-    Returns:
-        {"type": "expense", "amount": float, "category": str, "description": str}
-        or {"type": "question"}
-        or None on error
+    None means the message needs an API call.
     """
-    prompt = f"""Ты — финансовый помощник. Пользователь отправил сообщение. Определи, это запись расхода или вопрос о финансах.
+    with span("local_parser"):
+        local = parse_expense_local(text)
+    if local is not None:
+        return local
 
-Если это расход, верни JSON:
-{{"type": "expense", "amount": <число>, "category": "<категория>", "description": "<краткое описание>"}}
+    with span("parse_cache"):
+        return await parse_cache.get(text, PARSE_CACHE_VERSION)
 
-Если это вопрос или просьба показать информацию, верни:
-{{"type": "question"}}
 
-Доступные категории: {CATEGORIES_STR}
-Выбирай наиболее подходящую категорию. Если ни одна не подходит, используй "Другое".
-Сумму всегда возвращай как число (без "₽", "руб" и т.д.).
+def _normalize(parsed: object) -> dict | None:
+    """Validate one message's result from the LLM; None if it is unusable."""
+    if not isinstance(parsed, dict):
+        return None
+    if parsed.get("type") == "question":
+        return {"type": "question"}
+    if parsed.get("type") != "expense" or not parsed.get("items"):
+        return None
+    items = []
+    for item in parsed["items"]:
+        amount = float(item["amount"])
+        if amount <= 0:
+            continue
+        category = item["category"] if item["category"] in CATEGORIES else "Другое"
+        items.append({
+            "amount": amount,
+            "category": category,
+            "description": str(item.get("description") or category),
+        })
+    return {"type": "expense", "items": items} if items else None
+
+
+async def parse_expense_texts(
+    texts: list[str], skip_offline: Collection[int] = ()
+) -> list[dict | None]:
+    """Parse several messages, each as expenses or a question, in one API call.
+
+    Returns one result per text, in order:
+        {"type": "expense", "items": [{"amount": float, "category": str,
+                                        "description": str}, ...]}
+        or {"type": "question"}
+        or {"type": "deferred"} if the API is unavailable (see below)
+        or None on error
 
-Верни ТОЛЬКО JSON, без пояснений."""
+    Messages resolved by the local parser or the parse cache are left out of
+    the request; if none are left, no API call is made. skip_offline holds
+    the indices of texts the caller already knows both miss. If the API
+    fails or its circuit is open, the rest get local_parser's best-effort
+    parse, and those it won't guess at come back deferred for the caller to
+    retry.
+    """
+    results = [
+        None if i in skip_offline else await parse_expense_offline(text)
+        for i, text in enumerate(texts)
+    ]
+    pending = [i for i, result in enumerate(results) if result is None]
+    if not pending:
+        return results
 
     try:
-        response = await client.chat.completions.create(
-            model=GPT_MODEL,
-            max_tokens=256,
-            timeout=15.0,
-            messages=[
-                {"role": "system", "content": prompt},
-                {"role": "user", "content": text},
-            ],
-        )
-        raw = response.choices[0].message.content
+        with span("llm.parse"):
+            raw = await ai_gateway.chat(
+                model=GPT_MODEL,
+                max_tokens=256 * len(pending),
+                timeout=15.0,
+                messages=[
+                    {"role": "system", "content": EXPENSE_PROMPT},
+                    {
+                        "role": "user",
+                        "content": json.dumps([texts[i] for i in pending], ensure_ascii=False),
+                    },
+                ],
+            )
         parsed = json.loads(_strip_code_fences(raw))
-        if parsed.get("type") == "expense":
-            parsed["amount"] = float(parsed["amount"])
-            if parsed["category"] not in CATEGORIES:
-                parsed["category"] = "Другое"
-        return parsed
-    except (json.JSONDecodeError, KeyError, ValueError) as e:
+        if isinstance(parsed, dict) and len(pending) == 1:
+            parsed = [parsed]
+        if not isinstance(parsed, list) or len(parsed) != len(pending):
+            raise ValueError(f"expected {len(pending)} results, got {raw[:200]!r}")
+        for i, entry in zip(pending, parsed):
+            results[i] = _normalize(entry)
+            if results[i] is not None:
+                await parse_cache.put(texts[i], PARSE_CACHE_VERSION, results[i])
+    except (json.JSONDecodeError, KeyError, TypeError, ValueError) as e:
         logger.error("Failed to parse GPT response: %s", e)
-        return None
     except Exception as e:
-        logger.error("OpenAI API error: %s", e)
-        return None
+        if not isinstance(e, resilience.CircuitOpenError):
+            logger.error("OpenAI API error, parsing locally: %s", e)
+        results = [
+            r if r is not None else parse_expense_fallback(t) or {"type": "deferred"}
+            for r, t in zip(results, texts)
+        ]
+    return results
+
+
+async def parse_expense_text(text: str) -> dict | None:
+    """Parse one message; see parse_expense_texts."""
+    (result,) = await parse_expense_texts([text])
+    return result
 
 
-async def parse_receipt_photo(image_bytes: bytes, media_type: str = "image/jpeg") -> list[dict] | None:
+async def parse_receipt_photo(
+    image_bytes: bytes,
+    media_type: str = "image/jpeg",
+    on_progress: Callable[[str], Awaitable[None]] | None = None,
+) -> list[dict] | None:
     """Parse receipt photo via GPT-4o Vision.
 
     Returns list of {"amount": float, "category": str, "description": str}
-    or None on error.
+    or None on error. If on_progress is given, the response is streamed and
+    the raw JSON received so far is passed to it.
     """
     b64 = base64.standard_b64encode(image_bytes).decode()
 
@@ -86,26 +172,27 @@ async def parse_receipt_photo(image_bytes: bytes, media_type: str = "image/jpeg"
 Суммы — числа без валюты. Верни ТОЛЬКО JSON."""
 
     try:
-        response = await client.chat.completions.create(
-            model="gpt-4o",
-            max_tokens=1024,
-            timeout=30.0,
-            messages=[
-                {
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": f"data:{media_type};base64,{b64}",
+        with span("llm.receipt"):
+            raw = await ai_gateway.chat(
+                on_progress,
+                model="gpt-4o",
+                max_tokens=1024,
+                timeout=30.0,
+                messages=[
+                    {
+                        "role": "user",
+                        "content": [
+                            {
+                                "type": "image_url",
+                                "image_url": {
+                                    "url": f"data:{media_type};base64,{b64}",
+                                },
                             },
-                        },
-                        {"type": "text", "text": prompt},
-                    ],
-                }
-            ],
-        )
-        raw = response.choices[0].message.content
+                            {"type": "text", "text": prompt},
+                        ],
+                    }
+                ],
+            )
         items = json.loads(_strip_code_fences(raw))
         if not isinstance(items, list):
             return None
@@ -122,12 +209,17 @@ async def parse_receipt_photo(image_bytes: bytes, media_type: str = "image/jpeg"
         return None
 
 
-async def answer_question(question: str, expenses_text: str) -> str:
+async def answer_question(
+    question: str,
+    expenses_text: str,
+    on_progress: Callable[[str], Awaitable[None]] | None = None,
+) -> str:
     """Answer a user question about their finances using expense data.
 
-    Returns the answer string or an error message.
+    Returns the answer string or an error message. If on_progress is given,
+    the answer is streamed and the text so far is passed to it.
     """
-    prompt = f"""Ты — финансовый помощник семьи. Вот данные о расходах за последние 90 дней:
+    prompt = f"""Ты — финансовый помощник семьи. Вот сводка расходов за последние 90 дней и отдельные траты по теме вопроса:
 
 {expenses_text}
 
@@ -135,16 +227,17 @@ async def answer_question(question: str, expenses_text: str) -> str:
 Если данных недостаточно, так и скажи."""
 
     try:
-        response = await client.chat.completions.create(
-            model=GPT_MODEL,
-            max_tokens=1024,
-            timeout=15.0,
-            messages=[
-                {"role": "system", "content": prompt},
-                {"role": "user", "content": question},
-            ],
-        )
-        return response.choices[0].message.content
+        with span("llm.answer"):
+            return await ai_gateway.chat(
+                on_progress,
+                model=GPT_MODEL,
+                max_tokens=1024,
+                timeout=15.0,
+                messages=[
+                    {"role": "system", "content": prompt},
+                    {"role": "user", "content": question},
+                ],
+            )
     except Exception as e:
         logger.error("OpenAI API error (Q&A): %s", e)
         return "Не удалось получить ответ от AI. Попробуйте позже."
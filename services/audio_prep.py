@@ -0,0 +1,149 @@
+import asyncio
+import functools
+import logging
+import re
+import shutil
+import subprocess
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from metrics import span
+
+logger = logging.getLogger(__name__)
+
+# Whisper works on 16 kHz mono internally; Opus at 16 kbit/s keeps speech intact.
+SAMPLE_RATE = 16000
+BITRATE = "16k"
+# Half the encoding time of the default 10 for about the same size; it matters
+# on a single shared CPU.
+OPUS_COMPRESSION_LEVEL = 5
+SILENCE_THRESHOLD = "-40dB"
+# Pauses longer than PAUSE_SECONDS are cut to about PAUSE_SECONDS + KEEP_SILENCE_SECONDS,
+# which keeps word boundaries audible; leading and trailing silence is dropped.
+PAUSE_SECONDS = 0.3
+KEEP_SILENCE_SECONDS = 0.2
+# Notes longer than MAX_CHUNK_SECONDS after trimming are cut at a pause into
+# chunks of MIN_CHUNK_SECONDS..MAX_CHUNK_SECONDS, or hard at the maximum if
+# there is no pause in that range.
+MAX_CHUNK_SECONDS = 30.0
+MIN_CHUNK_SECONDS = 10.0
+FFMPEG_TIMEOUT = 60
+
+_FILTER = (
+    f"silenceremove=start_periods=1:start_threshold={SILENCE_THRESHOLD}"
+    f":stop_periods=-1:stop_duration={PAUSE_SECONDS}:stop_silence={KEEP_SILENCE_SECONDS}"
+    f":stop_threshold={SILENCE_THRESHOLD},"
+    f"silencedetect=noise={SILENCE_THRESHOLD}:d={PAUSE_SECONDS}"
+)
+_PAUSE_RE = re.compile(rb"silence_start: ([\d.]+).*?silence_end: ([\d.]+)", re.S)
+# Opus granule positions count 48 kHz samples whatever the input rate.
+_OPUS_GRANULE_RATE = 48000
+
+_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="audio-prep")
+
+stats = {
+    "notes": 0, "chunks": 0, "bytes_in": 0, "bytes_out": 0,
+    "audio_seconds_out": 0.0, "seconds": 0.0,
+}
+
+
+@functools.cache
+def _ffmpeg() -> str | None:
+    path = shutil.which("ffmpeg")
+    if path is None:
+        logger.warning("ffmpeg not found, voice notes go to Whisper unprocessed")
+    return path
+
+
+def ogg_duration(data: bytes) -> float:
+    """Length in seconds of an Ogg Opus stream, from its last page's granule position."""
+    last_page = data.rfind(b"OggS")
+    head = data.find(b"OpusHead")
+    if last_page < 0 or head < 0:
+        return 0.0
+    granule = int.from_bytes(data[last_page + 6:last_page + 14], "little", signed=True)
+    pre_skip = int.from_bytes(data[head + 10:head + 12], "little")
+    return max(granule - pre_skip, 0) / _OPUS_GRANULE_RATE
+
+
+def split_points(pauses: list[float], duration: float) -> list[float]:
+    """Where to cut a note of duration seconds, given the midpoints of its pauses."""
+    cuts, start = [], 0.0
+    while duration - start > MAX_CHUNK_SECONDS:
+        in_range = [
+            p for p in pauses if start + MIN_CHUNK_SECONDS <= p <= start + MAX_CHUNK_SECONDS
+        ]
+        start = in_range[-1] if in_range else start + MAX_CHUNK_SECONDS
+        cuts.append(start)
+    return cuts
+
+
+def preprocess_voice(voice_bytes: bytes) -> list[bytes]:
+    """Trim silence, downmix and re-encode; split long notes at pauses.
+
+    Returns the Ogg Opus chunks in order, or no chunks if the note is silent.
+    """
+    ffmpeg = _ffmpeg()
+    trimmed = subprocess.run(
+        [
+            ffmpeg, "-hide_banner", "-nostats", "-i", "pipe:0", "-af", _FILTER,
+            "-ac", "1", "-ar", str(SAMPLE_RATE),
+            "-c:a", "libopus", "-b:a", BITRATE, "-application", "voip",
+            "-compression_level", str(OPUS_COMPRESSION_LEVEL),
+            "-f", "ogg", "pipe:1",
+        ],
+        input=voice_bytes, capture_output=True, timeout=FFMPEG_TIMEOUT, check=True,
+    )
+    duration = ogg_duration(trimmed.stdout)
+    if duration <= 0:
+        return []
+    pauses = [(float(start) + float(end)) / 2 for start, end in _PAUSE_RE.findall(trimmed.stderr)]
+    cuts = split_points(pauses, duration)
+    if not cuts:
+        return [trimmed.stdout]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        subprocess.run(
+            [
+                ffmpeg, "-hide_banner", "-nostats", "-loglevel", "error",
+                "-i", "pipe:0", "-c", "copy", "-f", "segment",
+                "-segment_times", ",".join(f"{cut:.3f}" for cut in cuts),
+                "-reset_timestamps", "1", str(Path(tmp) / "%03d.ogg"),
+            ],
+            input=trimmed.stdout, capture_output=True, timeout=FFMPEG_TIMEOUT, check=True,
+        )
+        return [path.read_bytes() for path in sorted(Path(tmp).glob("*.ogg"))]
+
+
+async def prepare_voice(voice_bytes: bytes) -> list[bytes]:
+    """Run preprocess_voice in the worker pool; fall back to the original note."""
+    if _ffmpeg() is None:
+        return [voice_bytes]
+    started = time.perf_counter()
+    loop = asyncio.get_running_loop()
+    try:
+        with span("audio_prep"):
+            chunks = await loop.run_in_executor(_pool, preprocess_voice, voice_bytes)
+    except Exception:
+        logger.exception("Voice preprocessing failed, sending original note")
+        return [voice_bytes]
+    if len(chunks) == 1 and len(chunks[0]) >= len(voice_bytes):
+        chunks = [voice_bytes]
+
+    elapsed = time.perf_counter() - started
+    size = sum(len(chunk) for chunk in chunks)
+    seconds = sum(ogg_duration(chunk) for chunk in chunks)
+    stats["notes"] += 1
+    stats["chunks"] += len(chunks)
+    stats["bytes_in"] += len(voice_bytes)
+    stats["bytes_out"] += size
+    stats["audio_seconds_out"] += seconds
+    stats["seconds"] += elapsed
+    logger.info(
+        "Voice note: %d -> %d bytes (%.0f%%), %.1fs of audio in %d chunk(s), %.0f ms",
+        len(voice_bytes), size, size / len(voice_bytes) * 100,
+        seconds, len(chunks), elapsed * 1000,
+    )
+    return chunks
@@ -0,0 +1,231 @@
+import asyncio
+import codecs
+import csv
+import io
+import logging
+import re
+from collections import Counter
+from datetime import date, datetime, time
+from itertools import chain
+from pathlib import Path
+from typing import Iterator
+
+import db_async
+from config import ISRAEL_TZ
+from services.local_parser import match_category
+
+logger = logging.getLogger(__name__)
+
+SOURCE = "bank"
+BATCH_ROWS = 500
+SNIFF_BYTES = 64 * 1024
+# Statements often start with account details before the header row.
+HEADER_SEARCH_ROWS = 30
+# Rows used to decide whether expenses are the negative or the positive amounts.
+SIGN_SAMPLE_ROWS = 200
+# Imported rows get this local time, so their UTC date is the statement date.
+IMPORT_TIME = time(12, 0)
+MAX_DESCRIPTION = 200
+
+ENCODINGS = ("utf-8-sig", "cp1255", "cp1251")
+DELIMITERS = (";", ",", "\t", "|")
+DATE_FORMATS = ("%d/%m/%Y", "%d.%m.%Y", "%Y-%m-%d", "%d-%m-%Y", "%d/%m/%y", "%d.%m.%y")
+DATE_HEADERS = ("дата", "date", "תאריך")
+# Most specific first: a card statement's charge amount beats the original-currency one.
+AMOUNT_HEADERS = ("סכום חיוב", "charge", "debit", "сумма", "amount", "סכום", "sum")
+DESCRIPTION_HEADERS = (
+    "описание", "назначение", "получатель", "description", "details", "merchant",
+    "payee", "בית עסק", "בית העסק", "תיאור", "פרטים",
+)
+
+
+class StatementError(ValueError):
+    """The file doesn't look like a statement we can read."""
+
+
+def _detect_encoding(sample: bytes) -> str:
+    for encoding in ENCODINGS:
+        try:
+            codecs.getincrementaldecoder(encoding)().decode(sample, final=False)
+            return encoding
+        except UnicodeDecodeError:
+            continue
+    return "utf-8"
+
+
+def _detect_delimiter(sample: str) -> str:
+    """The delimiter that splits the most sample lines into the same number of cells.
+
+    csv.Sniffer gives up on statements that open with free-text lines.
+    """
+    lines = [line for line in sample.splitlines() if line.strip()]
+    best, best_score = ",", 0
+    for delimiter in DELIMITERS:
+        counts = Counter(line.count(delimiter) for line in lines)
+        counts.pop(0, None)
+        score = max(counts.values(), default=0)
+        if score > best_score:
+            best, best_score = delimiter, score
+    return best
+
+
+def _parse_date(cell: str) -> date | None:
+    cell = cell.strip().split(" ")[0]
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(cell, fmt).date()
+        except ValueError:
+            continue
+    return None
+
+
+def _parse_amount(cell: str) -> float | None:
+    """Parse "1,234.50", "1 234,50", "-45", "45.00-" and the like."""
+    negative = "-" in cell or "−" in cell
+    s = re.sub(r"[^\d,.]", "", cell)
+    if not re.search(r"\d", s):
+        return None
+    if "," in s and "." in s:
+        if s.rfind(",") > s.rfind("."):
+            s = s.replace(".", "").replace(",", ".")
+        else:
+            s = s.replace(",", "")
+    elif "," in s:
+        s = s.replace(",", ".") if re.search(r",\d{1,2}$", s) else s.replace(",", "")
+    try:
+        amount = float(s)
+    except ValueError:
+        return None
+    return -amount if negative else amount
+
+
+def _find_column(header: list[str], names: tuple[str, ...]) -> int | None:
+    cells = [c.strip().lower() for c in header]
+    for name in names:
+        for i, cell in enumerate(cells):
+            if name in cell:
+                return i
+    return None
+
+
+def _columns_from_header(row: list[str]) -> tuple[int, int, int | None] | None:
+    date_col = _find_column(row, DATE_HEADERS)
+    amount_col = _find_column(row, AMOUNT_HEADERS)
+    if date_col is None or amount_col is None or date_col == amount_col:
+        return None
+    return date_col, amount_col, _find_column(row, DESCRIPTION_HEADERS)
+
+
+def _columns_from_data(row: list[str]) -> tuple[int, int, int | None] | None:
+    """Guess columns from a data row: a date, an amount and the longest text."""
+    date_col = next((i for i, c in enumerate(row) if _parse_date(c)), None)
+    if date_col is None:
+        return None
+    amount_col = next(
+        (i for i, c in enumerate(row)
+         if i != date_col and _parse_amount(c) is not None
+         and not _parse_date(c) and not re.search(r"[^\W\d_]", c)),
+        None,
+    )
+    if amount_col is None:
+        return None
+    texts = [
+        (len(c.strip()), i) for i, c in enumerate(row)
+        if i not in (date_col, amount_col) and re.search(r"[^\W\d_]", c)
+    ]
+    return date_col, amount_col, max(texts)[1] if texts else None
+
+
+def _rows(path: Path) -> Iterator[list[str]]:
+    with open(path, "rb") as raw:
+        sample = raw.read(SNIFF_BYTES)
+        raw.seek(0)
+        encoding = _detect_encoding(sample)
+        delimiter = _detect_delimiter(sample.decode(encoding, errors="ignore"))
+        text = io.TextIOWrapper(raw, encoding=encoding, errors="replace", newline="")
+        yield from csv.reader(text, delimiter=delimiter)
+
+
+def _records(path: Path, summary: dict) -> Iterator[dict]:
+    """Signed {"date", "amount", "description"} records from the statement."""
+    rows = _rows(path)
+    columns = None
+    for _, row in zip(range(HEADER_SEARCH_ROWS), rows):
+        columns = _columns_from_header(row)
+        if columns is not None:
+            pending = []
+            break
+        columns = _columns_from_data(row)
+        if columns is not None:
+            pending = [row]
+            break
+    if columns is None:
+        raise StatementError("не найдены колонки с датой и суммой")
+
+    date_col, amount_col, description_col = columns
+    for row in chain(pending, rows):
+        if not any(cell.strip() for cell in row):
+            continue
+        summary["rows"] += 1
+        try:
+            day = _parse_date(row[date_col])
+            amount = _parse_amount(row[amount_col])
+        except IndexError:
+            day = amount = None
+        if day is None or not amount:
+            summary["unparsed"] += 1
+            continue
+        description = row[description_col].strip() if description_col is not None else ""
+        yield {"date": day, "amount": amount, "description": description}
+
+
+def _expenses(path: Path, summary: dict) -> Iterator[dict]:
+    """Expense items, with the sign convention taken from the first records.
+
+    Bank accounts list spending as negative amounts, card statements as
+    positive ones; the minority sign (income, refunds) is skipped.
+    """
+    records = _records(path, summary)
+    head = [r for _, r in zip(range(SIGN_SAMPLE_ROWS), records)]
+    spending_negative = sum(r["amount"] < 0 for r in head) > len(head) / 2
+    for record in chain(head, records):
+        if (record["amount"] < 0) != spending_negative:
+            summary["income"] += 1
+            continue
+        description = record["description"][:MAX_DESCRIPTION] or "Выписка"
+        words = re.findall(r"[a-zа-я]+", description.lower().replace("ё", "е"))
+        yield {
+            "amount": abs(record["amount"]),
+            "category": match_category(words) or "Другое",
+            "description": description,
+            "created_at": datetime.combine(record["date"], IMPORT_TIME, tzinfo=ISRAEL_TZ),
+        }
+
+
+def _batches(path: Path, summary: dict) -> Iterator[list[dict]]:
+    items = _expenses(path, summary)
+    while batch := [item for _, item in zip(range(BATCH_ROWS), items)]:
+        yield batch
+
+
+async def import_statement(path: Path, user_id: int) -> dict:
+    """Import a bank or card statement CSV for user_id, batch by batch.
+
+    The file is parsed as a stream in a worker thread; each batch is
+    deduplicated against recorded expenses and inserted in one transaction.
+    Returns counts: rows, inserted, duplicates, income and unparsed.
+    Raises StatementError if the file has no recognizable date/amount columns.
+    """
+    summary = {"rows": 0, "inserted": 0, "duplicates": 0, "income": 0, "unparsed": 0}
+    loop = asyncio.get_running_loop()
+    batches = _batches(path, summary)
+    imported: Counter = Counter()
+    try:
+        while (batch := await loop.run_in_executor(None, next, batches, None)) is not None:
+            inserted, skipped = await db_async.import_expenses(user_id, batch, SOURCE, imported)
+            summary["inserted"] += inserted
+            summary["duplicates"] += skipped
+    finally:
+        batches.close()
+    logger.info("Statement import for %d: %s", user_id, summary)
+    return summary
@@ -0,0 +1,61 @@
+import csv
+import io
+import json
+import logging
+import tempfile
+from datetime import datetime, timezone
+
+import db_async
+from config import ISRAEL_TZ
+
+logger = logging.getLogger(__name__)
+
+CHUNK_ROWS = 1000
+# Exports larger than this spill from memory to a temporary file.
+SPOOL_BYTES = 1_000_000
+FIELDS = ["date", "amount", "category", "description", "source", "user_id"]
+FORMATS = ("csv", "jsonl")
+
+
+def _record(expense: dict) -> dict:
+    created = datetime.fromisoformat(expense["created_at"]).replace(tzinfo=timezone.utc)
+    return {
+        "date": created.astimezone(ISRAEL_TZ).isoformat(timespec="seconds"),
+        "amount": expense["amount"],
+        "category": expense["category"],
+        "description": expense["description"],
+        "source": expense["source"],
+        "user_id": expense["user_id"],
+    }
+
+
+async def export_expenses(
+    since: datetime | None, until: datetime | None, fmt: str = "csv"
+) -> tuple[tempfile.SpooledTemporaryFile, int]:
+    """Write expenses in [since, until) as CSV or JSON Lines, chunk by chunk.
+
+    Returns the file, rewound, and the number of rows written. Only one
+    chunk of rows is held at a time; the encoded output stays in memory up
+    to SPOOL_BYTES and goes to disk after that.
+    """
+    out = tempfile.SpooledTemporaryFile(max_size=SPOOL_BYTES)
+    # utf-8-sig so that spreadsheet apps detect Cyrillic correctly.
+    text = io.TextIOWrapper(out, encoding="utf-8-sig" if fmt == "csv" else "utf-8", newline="")
+    writer = csv.DictWriter(text, fieldnames=FIELDS) if fmt == "csv" else None
+    if writer is not None:
+        writer.writeheader()
+
+    count = 0
+    async for chunk in db_async.iter_expenses(since, until, CHUNK_ROWS):
+        records = [_record(e) for e in chunk]
+        if writer is not None:
+            writer.writerows(records)
+        else:
+            text.writelines(json.dumps(r, ensure_ascii=False) + "\n" for r in records)
+        count += len(records)
+
+    text.flush()
+    text.detach()
+    out.seek(0)
+    logger.info("Exported %d expenses as %s", count, fmt)
+    return out, count
@@ -0,0 +1,109 @@
+import asyncio
+import io
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image, ImageFilter, ImageOps
+from telegram import PhotoSize
+
+from metrics import span
+
+logger = logging.getLogger(__name__)
+
+# Smallest long side at which receipt text is still reliably readable.
+MIN_LONG_SIDE = 1000
+TARGET_LONG_SIDE = 1280
+MAX_BYTES = 200_000
+JPEG_QUALITIES = (80, 70, 60, 50)
+# A detected paper area smaller than this share of the frame is probably noise.
+MIN_CROP_SHARE = 0.2
+CROP_MARGIN = 0.02
+
+_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="image-prep")
+
+stats = {"images": 0, "bytes_in": 0, "bytes_out": 0, "seconds": 0.0}
+
+
+def choose_photo_size(sizes: list[PhotoSize]) -> PhotoSize:
+    """The smallest size whose long side is still legible, else the largest."""
+    for size in sorted(sizes, key=lambda s: s.width * s.height):
+        if max(size.width, size.height) >= MIN_LONG_SIDE:
+            return size
+    return max(sizes, key=lambda s: s.width * s.height)
+
+
+def _receipt_box(gray: Image.Image) -> tuple[int, int, int, int] | None:
+    """Bounding box of the bright paper area, or None if it can't be found."""
+    small = gray.copy()
+    small.thumbnail((256, 256))
+    blurred = small.filter(ImageFilter.BoxBlur(3))
+    histogram = blurred.histogram()
+    total = sum(histogram)
+    mean = sum(i * n for i, n in enumerate(histogram)) / total
+    mask = blurred.point(lambda v: 255 if v > mean else 0)
+    box = mask.getbbox()
+    if box is None:
+        return None
+    left, top, right, bottom = box
+    share = (right - left) * (bottom - top) / (small.width * small.height)
+    if share < MIN_CROP_SHARE or share > 0.95:
+        return None
+    scale_x = gray.width / small.width
+    scale_y = gray.height / small.height
+    margin_x = int(gray.width * CROP_MARGIN)
+    margin_y = int(gray.height * CROP_MARGIN)
+    return (
+        max(int(left * scale_x) - margin_x, 0),
+        max(int(top * scale_y) - margin_y, 0),
+        min(int(right * scale_x) + margin_x, gray.width),
+        min(int(bottom * scale_y) + margin_y, gray.height),
+    )
+
+
+def preprocess_receipt(image_bytes: bytes) -> bytes:
+    """Crop to the receipt, convert to grayscale and recompress to a byte budget."""
+    image = Image.open(io.BytesIO(image_bytes))
+    image = ImageOps.exif_transpose(image)
+    gray = ImageOps.grayscale(image)
+
+    box = _receipt_box(gray)
+    if box is not None:
+        gray = gray.crop(box)
+    gray = ImageOps.autocontrast(gray, cutoff=1)
+    gray.thumbnail((TARGET_LONG_SIDE, TARGET_LONG_SIDE), Image.Resampling.LANCZOS)
+
+    out = b""
+    for quality in JPEG_QUALITIES:
+        buf = io.BytesIO()
+        gray.save(buf, format="JPEG", quality=quality, optimize=True)
+        out = buf.getvalue()
+        if len(out) <= MAX_BYTES:
+            break
+    return out
+
+
+async def prepare_receipt(image_bytes: bytes) -> bytes:
+    """Run preprocess_receipt in the worker pool; fall back to the original bytes."""
+    started = time.perf_counter()
+    loop = asyncio.get_running_loop()
+    try:
+        with span("image_prep"):
+            prepared = await loop.run_in_executor(_pool, preprocess_receipt, image_bytes)
+    except Exception:
+        logger.exception("Receipt preprocessing failed, sending original image")
+        return image_bytes
+    if len(prepared) >= len(image_bytes):
+        prepared = image_bytes
+
+    elapsed = time.perf_counter() - started
+    stats["images"] += 1
+    stats["bytes_in"] += len(image_bytes)
+    stats["bytes_out"] += len(prepared)
+    stats["seconds"] += elapsed
+    logger.info(
+        "Receipt image: %d -> %d bytes (%.0f%%) in %.0f ms",
+        len(image_bytes), len(prepared),
+        len(prepared) / len(image_bytes) * 100, elapsed * 1000,
+    )
+    return prepared
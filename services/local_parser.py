@@ -0,0 +1,204 @@
+import logging
+import re
+
+from config import CATEGORIES
+
+logger = logging.getLogger(__name__)
+
+# Word stems (matched as prefixes of lowercased words) for each category.
+CATEGORY_KEYWORDS: dict[str, list[str]] = {
+    "Продукты": [
+        "продукт", "супермаркет", "хлеб", "молок", "молоч", "овощ", "фрукт",
+        "мясо", "мяса", "курица", "курицу", "рыба", "рыбу", "сыр", "яйца",
+        "бакалея", "шуфер", "рами", "виктори", "йохананоф",
+    ],
+    "Рестораны/Кафе": [
+        "ресторан", "кафе", "кофе", "обед", "ужин", "завтрак", "пицц", "суши",
+        "бургер", "шаурм", "фалафел", "вольт", "wolt", "макдон",
+    ],
+    "Транспорт": [
+        "транспорт", "такси", "бензин", "топлив", "заправк", "автобус", "метро", "поезд",
+        "равкав", "парковк", "gett", "uber", "убер", "электричк", "самокат",
+    ],
+    "Здоровье": [
+        "здоров", "аптек", "лекарств", "врач", "стоматолог", "зубн", "анализ",
+        "больниц", "клиник", "витамин", "маккаби", "клалит",
+    ],
+    "Дом": [
+        "дом", "аренд", "квартплат", "коммунал", "электричеств", "интернет",
+        "ремонт", "мебел", "арнон", "ваад", "уборк", "хозтовар",
+    ],
+    "Дети": [
+        "дети", "детей", "детск", "садик", "школ", "игрушк", "подгузник", "памперс", "кружок",
+        "кружк", "няня", "няне",
+    ],
+    "Развлечения": [
+        "развлечен", "кино", "театр", "концерт", "музей", "боулинг",
+        "аттракцион", "netflix", "нетфликс",
+    ],
+    "Одежда": [
+        "одежд", "обувь", "обуви", "кроссовк", "куртк", "плать", "джинс",
+        "футболк", "рубашк", "штаны", "носки",
+    ],
+    "Подарки": ["подар", "цветы", "букет"],
+    "Пожертвования": ["пожертв", "цдак", "благотвор", "донат"],
+}
+
+QUESTION_WORDS = {
+    "сколько", "какие", "какой", "какая", "каких", "что", "где", "когда",
+    "почему", "зачем", "как", "покажи", "показать", "сравни", "сравнить",
+    "топ", "итого", "отчет", "статистика",
+}
+
+# Stems of requests the LLM would act on ("удали последние 2 траты").
+COMMAND_STEMS = (
+    "удал", "отмен", "исправ", "измен", "поправ", "покаж", "показ", "верн",
+    "сброс", "очист", "напомн", "установ", "постав",
+)
+
+_AMOUNT_RE = re.compile(
+    r"(?<![\w.,])"
+    r"(?P<int>\d{1,3}(?:[ \u00a0\u202f']\d{3}(?!\d))+"  # 2 300
+    r"|\d{1,3}(?:[.,]\d{3}(?!\d))+"  # 2,300 / 2.300
+    r"|\d+)"
+    r"(?:[.,](?P<frac>\d{1,2})(?!\d))?"
+    # "2.5к" or a standalone "5 к", but not the preposition in "300 к празднику".
+    r"(?P<mult>(?<=\d)[кk]|\s*тыс\.?|\s+[кk](?=\s*(?:[^\w\s]|$)))?"
+    r"\s*(?P<cur>₽|₪|руб(?:лей|ля|ль)?\.?|р\.?|шек(?:елей|еля|ель)?|ils|nis|rub)?"
+    r"(?!\w)",
+    re.IGNORECASE,
+)
+_WORD_RE = re.compile(r"[a-zа-я]+")
+# "хлеб 12, молоко 8; такси 40": a comma needs a space after it, so "2,300" stays whole.
+_ITEM_SEP_RE = re.compile(r"\s*(?:[;\n]|,\s)\s*")
+
+stats = {"local": 0, "fallback": 0}
+
+
+def match_category(words: list[str]) -> str | None:
+    """Return the single category the words point to, or None if none/ambiguous."""
+    found = set()
+    for word in words:
+        for category, stems in CATEGORY_KEYWORDS.items():
+            if any(word.startswith(stem) for stem in stems):
+                found.add(category)
+    if len(found) != 1:
+        return None
+    category = found.pop()
+    return category if category in CATEGORIES else None
+
+
+def _parse_amount(match: re.Match) -> float:
+    digits = re.sub(r"[^\d]", "", match["int"])
+    amount = float(digits)
+    if match["frac"]:
+        amount += float(f"0.{match['frac']}")
+    if match["mult"]:
+        amount *= 1000
+    return amount
+
+
+def _is_question(text: str, words: list[str]) -> bool:
+    if text.rstrip().endswith("?"):
+        return True
+    return bool(words) and words[0] in QUESTION_WORDS
+
+
+def _is_command(words: list[str]) -> bool:
+    return any(word.startswith(COMMAND_STEMS) for word in words)
+
+
+def _parse_item(text: str, lenient: bool = False) -> dict | None:
+    """One expense with exactly one amount and one clear category, or None.
+
+    lenient also accepts a part with no clear category.
+    """
+    matches = list(_AMOUNT_RE.finditer(text.lower().replace("ё", "е")))
+    if len(matches) != 1:
+        return None
+    match = matches[0]
+    amount = _parse_amount(match)
+    rest = (text[: match.start()] + " " + text[match.end():]).strip(" ,.-—:;\t\n")
+    rest = re.sub(r"\s+", " ", rest)
+    category = match_category(_WORD_RE.findall(rest.lower().replace("ё", "е")))
+    if amount <= 0 or not rest or (not lenient and category is None):
+        return None
+    return {"amount": amount, "category": category or "Другое", "description": rest}
+
+
+def parse_expense_fallback(text: str) -> dict | None:
+    """Best-effort parse for when the LLM is unavailable.
+
+    Every part needs exactly one amount; parts with a description but no
+    clear category are recorded as "Другое". Anything that might be a
+    question or a command, or a number on its own, returns None so it waits
+    for the LLM instead of being saved as an expense.
+
+    >>> parse_expense_fallback("сантехник 300")["items"][0]["category"]
+    'Другое'
+    >>> parse_expense_fallback("а сколько я потратил за 3 дня?") is None
+    True
+    >>> parse_expense_fallback("покажи траты за 7 дней") is None
+    True
+    >>> parse_expense_fallback("удали последние 2 траты") is None
+    True
+    >>> parse_expense_fallback("300 ₪") is None
+    True
+    """
+    normalized = text.lower().replace("ё", "е")
+    words = _WORD_RE.findall(normalized)
+    if "?" in normalized or _is_command(words) or any(word in QUESTION_WORDS for word in words):
+        return None
+    parts = [part for part in _ITEM_SEP_RE.split(text.strip()) if part]
+    items = [_parse_item(part, lenient=True) for part in parts]
+    if not items or not all(items):
+        return None
+    return {"type": "expense", "items": items}
+
+
+def parse_expense_local(text: str) -> dict | None:
+    """Parse simple messages like "продукты 2300" without calling the LLM.
+
+    A message listing several expenses ("хлеб 12, молоко 8, такси 40") is
+    resolved locally only if every part is. Returns the same shapes as
+    ai_parser.parse_expense_text, or None when the message is not clear-cut
+    and should go to the LLM instead, as do commands ("удали кофе 18"),
+    which would otherwise be saved as new spending.
+
+    >>> [item["amount"] for item in parse_expense_local("продукты 2.5к")["items"]]
+    [2500.0]
+    >>> [item["amount"] for item in parse_expense_local("подарок 300 к празднику")["items"]]
+    [300.0]
+    >>> [item["amount"] for item in parse_expense_local("цветы 500 к дню рождения")["items"]]
+    [500.0]
+    >>> parse_expense_local("удали кофе 18") is None
+    True
+    >>> parse_expense_local("верни 200 за такси") is None
+    True
+    """
+    normalized = text.lower().replace("ё", "е")
+    words = _WORD_RE.findall(normalized)
+
+    if _is_question(normalized, words):
+        result = {"type": "question"}
+    elif _is_command(words):
+        result = None
+    else:
+        parts = [part for part in _ITEM_SEP_RE.split(text.strip()) if part]
+        items = [_parse_item(part) for part in parts]
+        result = None
+        if items and all(items):
+            result = {"type": "expense", "items": items}
+
+    if result is None:
+        stats["fallback"] += 1
+    else:
+        stats["local"] += 1
+    logger.debug("Local parse of %r: %s", text, result)
+    return result
+
+
+def hit_rate() -> float:
+    """Share of messages resolved locally, i.e. LLM calls saved."""
+    total = stats["local"] + stats["fallback"]
+    return stats["local"] / total if total else 0.0
@@ -0,0 +1,126 @@
+import asyncio
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from config import CACHE_DB_PATH
+from metrics import span
+
+logger = logging.getLogger(__name__)
+
+TTL_SECONDS = 90 * 24 * 3600
+MAX_ENTRIES = 2000
+
+_lock = threading.Lock()
+# Lookups and stores run here, off the event loop; one thread is plenty.
+_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="media-cache")
+_conn: sqlite3.Connection | None = None
+
+stats = {"hits_unique_id": 0, "hits_hash": 0, "misses": 0}
+
+
+def content_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def _connection() -> sqlite3.Connection:
+    global _conn
+    if _conn is None:
+        _conn = sqlite3.connect(CACHE_DB_PATH, check_same_thread=False)
+        _conn.execute("PRAGMA journal_mode=WAL")
+        _conn.execute("PRAGMA synchronous=NORMAL")
+        _conn.executescript("""
+            CREATE TABLE IF NOT EXISTS media_cache (
+                key TEXT PRIMARY KEY,
+                result TEXT NOT NULL,
+                recorded_at REAL,
+                created_at REAL NOT NULL,
+                last_used REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_media_cache_last_used
+                ON media_cache(last_used);
+        """)
+    return _conn
+
+
+def _keys(kind: str, unique_id: str | None, digest: str | None) -> list[str]:
+    keys = []
+    if unique_id:
+        keys.append(f"{kind}:uid:{unique_id}")
+    if digest:
+        keys.append(f"{kind}:sha:{digest}")
+    return keys
+
+
+def _lookup(kind: str, unique_id: str | None, digest: str | None) -> dict | None:
+    now = time.time()
+    with _lock:
+        conn = _connection()
+        for key in _keys(kind, unique_id, digest):
+            row = conn.execute(
+                "SELECT result, recorded_at, created_at FROM media_cache WHERE key = ?",
+                (key,),
+            ).fetchone()
+            if row is None or row[2] < now - TTL_SECONDS:
+                continue
+            with conn:
+                conn.execute(
+                    "UPDATE media_cache SET last_used = ? WHERE key = ?", (now, key)
+                )
+            stats["hits_hash" if ":sha:" in key else "hits_unique_id"] += 1
+            return {"result": json.loads(row[0]), "recorded_at": row[1]}
+        stats["misses"] += 1
+    return None
+
+
+def _store(kind: str, result, unique_id: str | None, digest: str | None, recorded: bool) -> None:
+    now = time.time()
+    payload = json.dumps(result, ensure_ascii=False)
+    recorded_at = now if recorded else None
+    with _lock:
+        conn = _connection()
+        with conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO media_cache "
+                "(key, result, recorded_at, created_at, last_used) VALUES (?, ?, ?, ?, ?)",
+                [(key, payload, recorded_at, now, now) for key in _keys(kind, unique_id, digest)],
+            )
+            conn.execute(
+                "DELETE FROM media_cache WHERE created_at < ?", (now - TTL_SECONDS,)
+            )
+            (size,) = conn.execute("SELECT COUNT(*) FROM media_cache").fetchone()
+            if size > MAX_ENTRIES:
+                conn.execute(
+                    "DELETE FROM media_cache WHERE key IN ("
+                    "SELECT key FROM media_cache ORDER BY last_used LIMIT ?)",
+                    (size - MAX_ENTRIES,),
+                )
+
+
+async def lookup(
+    kind: str, unique_id: str | None = None, digest: str | None = None
+) -> dict | None:
+    """Find a cached result by Telegram file_unique_id, then by content hash.
+
+    Returns {"result": ..., "recorded_at": float | None} or None.
+    recorded_at is set once the result has been saved as expenses.
+    """
+    loop = asyncio.get_running_loop()
+    with span("media_cache"):
+        return await loop.run_in_executor(_pool, _lookup, kind, unique_id, digest)
+
+
+async def store(
+    kind: str,
+    result,
+    unique_id: str | None = None,
+    digest: str | None = None,
+    recorded: bool = False,
+) -> None:
+    """Cache a result under every key we know for the media."""
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(_pool, _store, kind, result, unique_id, digest, recorded)
@@ -0,0 +1,128 @@
+import asyncio
+import json
+import logging
+import re
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from config import CACHE_DB_PATH
+
+logger = logging.getLogger(__name__)
+
+TTL_SECONDS = 30 * 24 * 3600
+MAX_ENTRIES = 5000
+
+_lock = threading.Lock()
+# Lookups and stores run here, off the event loop; one thread is plenty.
+_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="parse-cache")
+_conn: sqlite3.Connection | None = None
+_version: str | None = None
+
+stats = {"hits": 0, "misses": 0}
+
+
+def normalize(text: str) -> str:
+    """Cache key for a message: case, "ё", spacing and end punctuation don't matter."""
+    text = text.lower().replace("ё", "е")
+    text = re.sub(r"\s+", " ", text)
+    return text.strip(" .,!;")
+
+
+def _connection(version: str) -> sqlite3.Connection:
+    """Open the cache database, dropping every entry made under another version."""
+    global _conn, _version
+    if _conn is None:
+        _conn = sqlite3.connect(CACHE_DB_PATH, check_same_thread=False)
+        _conn.execute("PRAGMA journal_mode=WAL")
+        _conn.execute("PRAGMA synchronous=NORMAL")
+        _conn.executescript("""
+            CREATE TABLE IF NOT EXISTS parse_cache (
+                key TEXT PRIMARY KEY,
+                version TEXT NOT NULL,
+                result TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_used REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_parse_cache_last_used
+                ON parse_cache(last_used);
+        """)
+    if _version != version:
+        with _conn:
+            deleted = _conn.execute(
+                "DELETE FROM parse_cache WHERE version != ?", (version,)
+            ).rowcount
+        if deleted:
+            logger.info("Parse cache invalidated: %d stale entries dropped", deleted)
+        _version = version
+    return _conn
+
+
+def _get(text: str, version: str) -> dict | None:
+    key = normalize(text)
+    now = time.time()
+    with _lock:
+        conn = _connection(version)
+        row = conn.execute(
+            "SELECT result, created_at FROM parse_cache WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None or row[1] < now - TTL_SECONDS:
+            if row is not None:
+                with conn:
+                    conn.execute("DELETE FROM parse_cache WHERE key = ?", (key,))
+            stats["misses"] += 1
+            return None
+        with conn:
+            conn.execute(
+                "UPDATE parse_cache SET last_used = ? WHERE key = ?", (now, key)
+            )
+        stats["hits"] += 1
+    return json.loads(row[0])
+
+
+def _put(text: str, version: str, result: dict) -> None:
+    key = normalize(text)
+    now = time.time()
+    with _lock:
+        conn = _connection(version)
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO parse_cache "
+                "(key, version, result, created_at, last_used) VALUES (?, ?, ?, ?, ?)",
+                (key, version, json.dumps(result, ensure_ascii=False), now, now),
+            )
+            conn.execute(
+                "DELETE FROM parse_cache WHERE created_at < ?", (now - TTL_SECONDS,)
+            )
+            (size,) = conn.execute("SELECT COUNT(*) FROM parse_cache").fetchone()
+            if size > MAX_ENTRIES:
+                conn.execute(
+                    "DELETE FROM parse_cache WHERE key IN ("
+                    "SELECT key FROM parse_cache ORDER BY last_used LIMIT ?)",
+                    (size - MAX_ENTRIES,),
+                )
+
+
+async def get(text: str, version: str) -> dict | None:
+    """Return the cached parse for text, or None on a miss or expired entry."""
+    return await asyncio.get_running_loop().run_in_executor(_pool, _get, text, version)
+
+
+async def put(text: str, version: str, result: dict) -> None:
+    """Store a parse result, evicting least recently used entries over MAX_ENTRIES."""
+    await asyncio.get_running_loop().run_in_executor(_pool, _put, text, version, result)
+
+
+def cache_stats() -> dict:
+    """Hit/miss counters plus the current number of stored entries."""
+    with _lock:
+        size = 0
+        if _conn is not None:
+            (size,) = _conn.execute("SELECT COUNT(*) FROM parse_cache").fetchone()
+    lookups = stats["hits"] + stats["misses"]
+    return {
+        **stats,
+        "size": size,
+        "hit_rate": stats["hits"] / lookups if lookups else 0.0,
+    }
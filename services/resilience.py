@@ -0,0 +1,190 @@
+import asyncio
+import logging
+import random
+import time
+from collections import deque
+from typing import Awaitable, Callable, TypeVar
+
+import openai
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+MAX_ATTEMPTS = 3
+# Full jitter: attempt n waits a random time up to min(BACKOFF_MAX, BACKOFF_BASE * 2**(n-1)).
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 4.0
+# A second, hedged request goes out when the first is slower than this
+# quantile of recent successful calls (once there are enough of them).
+HEDGE_QUANTILE = 0.95
+HEDGE_MIN_SAMPLES = 20
+HEDGE_MIN_DELAY = 1.0
+LATENCY_WINDOW = 200
+# The circuit opens when at least FAILURE_RATE of the last FAILURE_WINDOW
+# attempts (and no fewer than FAILURE_MIN_ATTEMPTS) failed transiently, and
+# stays open for OPEN_SECONDS before a single probe request is let through.
+FAILURE_WINDOW = 20
+FAILURE_MIN_ATTEMPTS = 10
+FAILURE_RATE = 0.6
+OPEN_SECONDS = 30.0
+
+TRANSIENT_ERRORS = (
+    openai.APIConnectionError,  # includes APITimeoutError
+    openai.RateLimitError,
+    openai.InternalServerError,
+    asyncio.TimeoutError,
+)
+
+CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+
+
+class CircuitOpenError(Exception):
+    """The endpoint has been failing; the call was not attempted."""
+
+
+class _Endpoint:
+    """Latency history and circuit state for one model."""
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.latencies: deque[float] = deque(maxlen=LATENCY_WINDOW)
+        self.state = CLOSED
+        self.outcomes: deque[bool] = deque(maxlen=FAILURE_WINDOW)
+        self.opened_at = 0.0
+        self.probing = False
+        self.counters = {
+            "calls": 0, "retries": 0, "hedges": 0, "hedge_wins": 0,
+            "failures": 0, "short_circuits": 0, "opened": 0,
+        }
+
+    def allow(self) -> bool:
+        if self.state == CLOSED:
+            return True
+        if self.state == OPEN and time.monotonic() - self.opened_at >= OPEN_SECONDS:
+            self.state = HALF_OPEN
+        if self.state == HALF_OPEN and not self.probing:
+            self.probing = True
+            return True
+        return False
+
+    def succeeded(self, seconds: float | None) -> None:
+        if seconds is not None:
+            self.latencies.append(seconds)
+        if self.state != CLOSED:
+            logger.info("OpenAI %s circuit closed", self.name)
+            self.outcomes.clear()
+        self.state = CLOSED
+        self.outcomes.append(True)
+        self.probing = False
+
+    def failed(self) -> None:
+        self.counters["failures"] += 1
+        self.outcomes.append(False)
+        self.probing = False
+        failures = self.outcomes.count(False)
+        # Calls already in flight when the circuit opened don't reopen it.
+        tripped = (
+            self.state == CLOSED
+            and len(self.outcomes) >= FAILURE_MIN_ATTEMPTS
+            and failures >= FAILURE_RATE * len(self.outcomes)
+        )
+        if self.state == HALF_OPEN or tripped:
+            self.state = OPEN
+            self.opened_at = time.monotonic()
+            self.counters["opened"] += 1
+            logger.warning(
+                "OpenAI %s circuit open for %.0fs: %d of the last %d attempts failed",
+                self.name, OPEN_SECONDS, failures, len(self.outcomes),
+            )
+
+    def hedge_delay(self) -> float | None:
+        if len(self.latencies) < HEDGE_MIN_SAMPLES:
+            return None
+        ordered = sorted(self.latencies)
+        return max(HEDGE_MIN_DELAY, ordered[int(len(ordered) * HEDGE_QUANTILE) - 1])
+
+    async def attempt(self, request: Callable[[], Awaitable[T]], hedge: bool) -> T:
+        """Run request(); past the hedge delay, race it against a second one."""
+        tasks = [asyncio.ensure_future(request())]
+        try:
+            delay = self.hedge_delay() if hedge else None
+            if delay is not None:
+                done, _ = await asyncio.wait(tasks, timeout=delay)
+                if not done:
+                    self.counters["hedges"] += 1
+                    tasks.append(asyncio.ensure_future(request()))
+            pending, error = set(tasks), None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is not tasks[0]:
+                            self.counters["hedge_wins"] += 1
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                if task.done() and not task.cancelled():
+                    task.exception()  # mark a losing failure as retrieved
+                else:
+                    task.cancel()
+
+
+_endpoints: dict[str, _Endpoint] = {}
+
+
+async def call(name: str, request: Callable[[], Awaitable[T]], hedge: bool = True) -> T:
+    """Await request() with retries, hedging and a circuit breaker per endpoint name.
+
+    request must start a fresh API call each time it is invoked. Transient
+    errors (timeouts, connection errors, 429 and 5xx) are retried with
+    jittered backoff; other errors are raised at once. Pass hedge=False for
+    calls that cannot run twice side by side (streams that report progress).
+    Raises CircuitOpenError without calling the API while the circuit is open.
+    """
+    endpoint = _endpoints.setdefault(name, _Endpoint(name))
+    endpoint.counters["calls"] += 1
+    attempt = 0
+    while True:
+        attempt += 1
+        if not endpoint.allow():
+            endpoint.counters["short_circuits"] += 1
+            raise CircuitOpenError(f"{name} circuit is open")
+        started = time.monotonic()
+        try:
+            result = await endpoint.attempt(request, hedge)
+        except TRANSIENT_ERRORS as e:
+            endpoint.failed()
+            if attempt == MAX_ATTEMPTS:
+                raise
+            delay = random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (attempt - 1)))
+            logger.info(
+                "OpenAI %s attempt %d failed (%s), retrying in %.2fs",
+                name, attempt, type(e).__name__, delay,
+            )
+            endpoint.counters["retries"] += 1
+            await asyncio.sleep(delay)
+            continue
+        except openai.APIStatusError:
+            # The API answered (e.g. 400 or 401): not an outage.
+            endpoint.succeeded(None)
+            raise
+        except BaseException:
+            endpoint.probing = False
+            raise
+        endpoint.succeeded(time.monotonic() - started)
+        return result
+
+
+def stats() -> dict:
+    """Counters, hedge delay and circuit state (0 closed, 1 half-open, 2 open) per endpoint."""
+    result = {}
+    for name, endpoint in _endpoints.items():
+        prefix = name.replace("-", "_").replace(".", "_")
+        for key, value in endpoint.counters.items():
+            result[f"{prefix}_{key}"] = value
+        result[f"{prefix}_state"] = (CLOSED, HALF_OPEN, OPEN).index(endpoint.state)
+        result[f"{prefix}_hedge_delay"] = endpoint.hedge_delay() or 0.0
+    return result
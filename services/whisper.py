@@ -1,28 +1,39 @@
-import io
+import asyncio
 import logging
 
-from openai import AsyncOpenAI
-
-from config import OPENAI_API_KEY
+from metrics import span
+from services import ai_gateway, audio_prep, resilience
 
 logger = logging.getLogger(__name__)
-client = AsyncOpenAI(api_key=OPENAI_API_KEY)
 
 
 async def transcribe_voice(voice_bytes: bytes) -> str | None:
     """Transcribe voice message bytes (OGG) via OpenAI Whisper.
 
-    Returns transcribed text or None on error.
+    Silence is trimmed first; a long note is split at pauses and its chunks
+    are transcribed concurrently, then joined in order.
+    Returns transcribed text or None on error or if the note is silent.
     """
+    chunks = await audio_prep.prepare_voice(voice_bytes)
+    if not chunks:
+        logger.info("Voice note is silent, nothing to transcribe")
+        return None
     try:
-        buf = io.BytesIO(voice_bytes)
-        buf.name = "voice.ogg"
-        response = await client.audio.transcriptions.create(
-            model="whisper-1",
-            file=buf,
-            language="ru",
-        )
-        return response.text
+        with span("whisper"):
+            texts = await asyncio.gather(
+                *(
+                    ai_gateway.transcribe(chunk, "voice.ogg", language="ru", timeout=30.0)
+                    for chunk in chunks
+                ),
+                return_exceptions=True,
+            )
+        for text in texts:
+            if isinstance(text, BaseException):
+                raise text
+        return " ".join(text.strip() for text in texts if text.strip())
+    except resilience.CircuitOpenError as e:
+        logger.warning("Whisper transcription skipped: %s", e)
+        return None
     except Exception:
         logger.exception("Whisper transcription failed")
         return None
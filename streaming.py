@@ -0,0 +1,104 @@
+import logging
+import time
+
+from telegram import Message
+from telegram.error import BadRequest, RetryAfter, TelegramError
+
+from outbox import retry_after_seconds
+
+logger = logging.getLogger(__name__)
+
+# Telegram tolerates roughly one edit per second per chat.
+EDIT_INTERVAL = 1.0
+MAX_MESSAGE_LENGTH = 4096
+
+
+def _split(text: str) -> list[str]:
+    """Split text into Telegram-sized chunks, preferring line breaks."""
+    chunks = []
+    while len(text) > MAX_MESSAGE_LENGTH:
+        cut = text.rfind("\n", 0, MAX_MESSAGE_LENGTH)
+        if cut <= 0:
+            cut = MAX_MESSAGE_LENGTH
+        chunks.append(text[:cut])
+        text = text[cut:].lstrip("\n")
+    chunks.append(text)
+    return chunks
+
+
+class ProgressiveMessage:
+    """A placeholder message that is edited in place as content arrives.
+
+    update() is throttled to EDIT_INTERVAL and always sends plain text, since
+    partial Markdown rarely parses. finish() tries Markdown and falls back to
+    plain text if Telegram rejects the entities.
+    """
+
+    def __init__(self, message: Message, label: str) -> None:
+        self._message = message
+        self._label = label
+        self._shown = message.text or ""
+        self._started = time.monotonic()
+        self._first_content: float | None = None
+        self._next_edit = 0.0
+
+    @classmethod
+    async def send(cls, reply_to: Message, placeholder: str, label: str) -> "ProgressiveMessage":
+        message = await reply_to.reply_text(placeholder)
+        return cls(message, label)
+
+    async def update(self, text: str) -> None:
+        if not text.strip():
+            return
+        now = time.monotonic()
+        if self._first_content is None:
+            self._first_content = now
+            logger.info(
+                "%s: first content after %.2fs", self._label, now - self._started
+            )
+        if now < self._next_edit:
+            return
+        text = text[:MAX_MESSAGE_LENGTH]
+        if text == self._shown:
+            return
+        self._next_edit = now + EDIT_INTERVAL
+        try:
+            await self._message.edit_text(text)
+            self._shown = text
+        except RetryAfter as e:
+            self._next_edit = now + retry_after_seconds(e)
+        except TelegramError as e:
+            logger.debug("%s: progress edit failed: %s", self._label, e)
+
+    async def _edit(self, text: str, parse_mode: str | None) -> None:
+        if text == self._shown:
+            return
+        try:
+            await self._message.edit_text(text, parse_mode=parse_mode)
+        except BadRequest as e:
+            if "not modified" in str(e).lower():
+                pass
+            elif parse_mode is None:
+                raise
+            else:
+                await self._message.edit_text(text)
+        self._shown = text
+
+    async def finish(self, text: str, parse_mode: str | None = "Markdown") -> None:
+        """Replace the placeholder with the final text, overflowing into new messages."""
+        first, *rest = _split(text)
+        await self._edit(first, parse_mode)
+        for chunk in rest:
+            try:
+                await self._message.reply_text(chunk, parse_mode=parse_mode)
+            except BadRequest:
+                await self._message.reply_text(chunk)
+        first_content = (
+            f"{self._first_content - self._started:.2f}s"
+            if self._first_content is not None
+            else "n/a"
+        )
+        logger.info(
+            "%s: finished in %.2fs (first content %s)",
+            self._label, time.monotonic() - self._started, first_content,
+        )
@@ -0,0 +1,87 @@
+import asyncio
+import logging
+from collections import Counter
+from typing import Any, Awaitable
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+from config import MAX_CONCURRENT_UPDATES
+
+logger = logging.getLogger(__name__)
+
+# Bound on update tasks PTB keeps in flight, waiting ones included.
+MAX_PENDING_UPDATES = 256
+
+
+def _chat_key(update: object) -> int | None:
+    if not isinstance(update, Update):
+        return None
+    if update.effective_chat is not None:
+        return update.effective_chat.id
+    if update.effective_user is not None:
+        return update.effective_user.id
+    return None
+
+
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    """Process updates from different chats concurrently, one at a time per chat.
+
+    An update first waits for the previous update from its chat to finish,
+    then for one of max_concurrent slots. Waiting for the chat comes first,
+    so a burst from one chat never holds slots the other chats could use.
+    PTB's own semaphore only bounds how many update tasks exist at all.
+
+    Per-chat order is what keeps ConversationHandler state (keyed by chat
+    and user) and user_data consistent, as in sequential processing.
+    """
+
+    def __init__(self, max_concurrent: int) -> None:
+        super().__init__(max(MAX_PENDING_UPDATES, max_concurrent))
+        self._slots = asyncio.Semaphore(max_concurrent)
+        self._limit = max_concurrent
+        self._chat_locks: dict[int, asyncio.Lock] = {}
+        self._chat_pending: Counter = Counter()
+        self._running = 0
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        key = _chat_key(update)
+        if key is None:
+            await self._run(coroutine)
+            return
+        lock = self._chat_locks.setdefault(key, asyncio.Lock())
+        self._chat_pending[key] += 1
+        try:
+            async with lock:
+                await self._run(coroutine)
+        finally:
+            self._chat_pending[key] -= 1
+            if not self._chat_pending[key]:
+                del self._chat_pending[key]
+                del self._chat_locks[key]
+
+    async def _run(self, coroutine: Awaitable[Any]) -> None:
+        async with self._slots:
+            self._running += 1
+            try:
+                await coroutine
+            finally:
+                self._running -= 1
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    def stats(self) -> dict:
+        """Updates being handled, waiting for their turn, and the concurrency cap."""
+        return {
+            "running": self._running,
+            "waiting": self.current_concurrent_updates - self._running,
+            "chats": len(self._chat_pending),
+            "limit": self._limit,
+        }
+
+
+update_processor = ChatOrderedUpdateProcessor(MAX_CONCURRENT_UPDATES)